@@ -0,0 +1,47 @@
+"""
+A small, serializable Bloom filter.
+
+Used for per-user "already seen" sets (see api/seen.py): membership tests
+never miss an added key and return false positives at roughly
+``error_rate`` while the filter holds at most ``capacity`` keys.
+"""
+import hashlib
+import math
+
+
+def optimal_parameters(capacity, error_rate):
+    """(bit_count, hash_count) for ``capacity`` keys at ``error_rate`` false positives."""
+    capacity = max(int(capacity), 1)
+    bit_count = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    bit_count = max(8, (bit_count + 7) // 8 * 8)
+    hash_count = max(1, int(round(bit_count / capacity * math.log(2))))
+    return bit_count, hash_count
+
+
+class BloomFilter:
+    def __init__(self, bit_count, hash_count, bits=None):
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bytearray(bits) if bits is not None else bytearray(bit_count // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.01):
+        return cls(*optimal_parameters(capacity, error_rate))
+
+    def _positions(self, key):
+        # Kirsch-Mitzenmacher double hashing over one 128-bit digest
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self):
+        return bytes(self.bits)
@@ -0,0 +1,44 @@
+"""
+Whether the default cache is shared by every worker process.
+
+Several lookups are cached and dropped by signals when the underlying row
+changes (socket tokens in api/ws_auth.py, chat membership in
+api/membership.py). That only works when every process reads the same cache:
+with the default per-process ``LocMemCache`` a logout or unmatch handled by
+one worker leaves the entry in the others. Set ``CACHE_URL`` to a Redis URL
+to share it; until then ``authorization_ttl`` caps how long a positive
+authorization may be served from a process-local cache.
+
+Presence (api/presence.py) keeps a per-user connection counter in the same
+cache, which has no such fallback: with sockets spread over several
+processes each would count only its own. A channel layer other than the
+in-memory one means more than one process, so ``check_shared_cache``
+refuses that combination at startup (``manage.py check``).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+def is_shared(alias='default'):
+    """False when ``alias`` lives in this process only (``LocMemCache``)."""
+    return not isinstance(caches[alias], LocMemCache)
+
+
+def authorization_ttl(ttl):
+    """``ttl`` for a cached grant, bounded by ``LOCAL_CACHE_AUTH_TTL`` when the cache is process-local."""
+    return ttl if is_shared() else min(ttl, settings.LOCAL_CACHE_AUTH_TTL)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+    if backend == 'channels.layers.InMemoryChannelLayer' or is_shared():
+        return []
+    return [Error(
+        'The default cache is process-local but the channel layer spans processes',
+        hint='Set CACHE_URL to a Redis URL shared by every worker (presence counters live in the cache).',
+        obj=backend,
+        id='api.E001',
+    )]
@@ -0,0 +1,327 @@
+"""
+Channel layer backends that fan ``group_send`` out across ASGI processes.
+
+``InMemoryChannelLayer`` only delivers inside one process, so notifications
+and chat break as soon as more than one worker runs. Production uses Redis
+(``channels_redis``, sharded over every host in ``CHANNEL_LAYER_HOSTS``);
+see ``CHANNEL_LAYERS`` in settings.py.
+
+``BrokerChannelLayer`` is a pure-Python stand-in with the same semantics for
+development, CI and benchmarks: a small TCP broker (``run_channel_broker``)
+keeps group membership and routes messages, and every process keeps its own
+channels' queues locally. Channel names carry the owning connection's id
+(``<prefix>.<client>!<suffix>``, like channels_redis), so the broker can
+deliver a group message to each member process with one frame per process
+rather than one per socket. Groups and channels are sharded over several
+brokers by CRC32, as channels_redis does. Each layer holds one connection
+per broker for the life of the process, owned by a background event loop,
+so sync callers (``async_to_sync``) do not reconnect on every call.
+"""
+import asyncio
+import binascii
+import logging
+import random
+import string
+import struct
+import threading
+import time
+import uuid
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!I')
+
+
+async def read_frame(reader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+
+def write_frame(writer, frame):
+    payload = msgpack.packb(frame, use_bin_type=True)
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+def _client_of(channel):
+    # "<prefix>.<client>!<suffix>" -> "<client>"
+    return channel.split('!', 1)[0].rsplit('.', 1)[-1]
+
+
+def shard_index(key, shard_count):
+    return binascii.crc32(key.encode()) % shard_count
+
+
+# --- Broker ---
+
+class ChannelBroker:
+    """Routes channel and group messages between connected layer clients."""
+
+    def __init__(self, group_expiry=86400):
+        self.group_expiry = group_expiry
+        self.clients = {}  # client id -> StreamWriter
+        self.groups = {}  # group -> {channel: joined_at}
+        self.client_memberships = {}  # client id -> {(group, channel)}, to drop a client without scanning every group
+
+    async def serve(self, host='127.0.0.1', port=6390):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader, writer):
+        client_id = None
+        try:
+            while True:
+                op, *args = await read_frame(reader)
+                if op == 'hello':
+                    client_id = args[0]
+                    self.clients[client_id] = writer
+                elif op == 'send':
+                    channel, message = args
+                    self._deliver({_client_of(channel): [channel]}, message)
+                elif op == 'group_add':
+                    group, channel = args
+                    self.groups.setdefault(group, {})[channel] = time.time()
+                    self.client_memberships.setdefault(_client_of(channel), set()).add((group, channel))
+                elif op == 'group_discard':
+                    self._discard(*args)
+                elif op == 'group_send':
+                    group, message = args
+                    self._deliver(self._members_by_client(group), message)
+                elif op == 'flush':
+                    self.groups.clear()
+                    self.client_memberships.clear()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if client_id is not None and self.clients.get(client_id) is writer:
+                del self.clients[client_id]
+                self._drop_client_channels(client_id)
+            writer.close()
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        memberships = self.client_memberships.get(_client_of(channel))
+        if memberships is not None:
+            memberships.discard((group, channel))
+
+    def _members_by_client(self, group):
+        members = self.groups.get(group, {})
+        cutoff = time.time() - self.group_expiry
+        by_client = {}
+        for channel, joined_at in list(members.items()):
+            if joined_at < cutoff:
+                self._discard(group, channel)
+                continue
+            by_client.setdefault(_client_of(channel), []).append(channel)
+        return by_client
+
+    def _deliver(self, by_client, message):
+        # One frame per member process, however many of its sockets are in the group
+        for client_id, channels in by_client.items():
+            writer = self.clients.get(client_id)
+            if writer is not None:
+                write_frame(writer, ['deliver', channels, message])
+
+    def _drop_client_channels(self, client_id):
+        for group, channel in self.client_memberships.pop(client_id, ()):
+            members = self.groups.get(group)
+            if members is not None:
+                members.pop(channel, None)
+                if not members:
+                    del self.groups[group]
+
+
+# --- Client layer ---
+
+class _Connection:
+    """One broker connection; only ever used on the layer's I/O loop."""
+
+    def __init__(self, layer, host, port):
+        self.layer = layer
+        self.host, self.port = host, port
+        self.writer = None
+        self.reader_task = None
+        self.ready = asyncio.Lock()
+
+    @property
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def open(self):
+        async with self.ready:
+            if not self.is_open:
+                reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                write_frame(self.writer, ['hello', self.layer.client_id])
+                self.reader_task = asyncio.ensure_future(self._read(reader))
+        return self
+
+    async def _read(self, reader):
+        try:
+            while True:
+                op, channels, message = await read_frame(reader)
+                if op == 'deliver':
+                    for channel in channels:
+                        self.layer._enqueue(channel, message, drop_if_full=True)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def call(self, *frame):
+        await self.open()
+        write_frame(self.writer, list(frame))
+        await self.writer.drain()
+
+    def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = self.reader_task = None
+        # A later open() may run on a new I/O loop
+        self.ready = asyncio.Lock()
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by one or more ``ChannelBroker`` processes (``hosts``: ["host:port", ...]).
+
+    The broker connections belong to one background event loop per layer
+    (started on first use) and every call is handed to it, so sync code
+    calling ``async_to_sync(layer.group_send)`` (a fresh event loop per call)
+    reuses the same connections and client id instead of opening new ones.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, hosts=None, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.hosts = [self._parse_host(h) for h in (hosts or ['127.0.0.1:6390'])]
+        self.group_expiry = group_expiry
+        self.client_id = uuid.uuid4().hex[:16]
+        self.channels = {}  # local channel name -> asyncio.Queue
+        self._receivers = {}  # local channel name -> event loop its receive() runs on
+        self._connections = [_Connection(self, host, port) for host, port in self.hosts]
+        self._io_loop = None
+        self._io_lock = threading.Lock()
+
+    @staticmethod
+    def _parse_host(host):
+        if isinstance(host, (tuple, list)):
+            return host[0], int(host[1])
+        name, _, port = host.rpartition(':')
+        return name or '127.0.0.1', int(port)
+
+    def _io(self):
+        with self._io_lock:
+            if self._io_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='channel-layer-io', daemon=True).start()
+                self._io_loop = loop
+            return self._io_loop
+
+    async def _run(self, coroutine):
+        """Await ``coroutine`` on the I/O loop, from whichever loop the caller runs on."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._io()))
+
+    async def _open_all(self):
+        for connection in self._connections:
+            await connection.open()
+
+    async def _call(self, key, *frame):
+        await self._run(self._connections[shard_index(key, len(self._connections))].call(*frame))
+
+    def _queue(self, channel):
+        return self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+
+    def _enqueue(self, channel, message, drop_if_full=False):
+        queue = self._queue(channel)
+        if queue.full():
+            if drop_if_full:
+                return
+            raise ChannelFull(channel)
+        item = (time.time() + self.expiry, message)
+        loop = self._receivers.get(channel)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or loop is running:
+            queue.put_nowait(item)
+            return
+        # Deliveries arrive on the I/O loop; wake the receiver on its own loop
+        try:
+            loop.call_soon_threadsafe(self._put, queue, item)
+        except RuntimeError:
+            # The receiver's loop is closed
+            pass
+
+    @staticmethod
+    def _put(queue, item):
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            pass
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f"{prefix}.{self.client_id}!{suffix}"
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        if _client_of(channel) == self.client_id:
+            self._enqueue(channel, message)
+            return
+        await self._call(channel, 'send', channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        self._receivers[channel] = asyncio.get_running_loop()
+        if not all(connection.is_open for connection in self._connections):
+            # Messages for this process's channels are delivered over these connections
+            await self._run(self._open_all())
+        queue = self._queue(channel)
+        while True:
+            expires_at, message = await queue.get()
+            if expires_at >= time.time():
+                return message
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._call(group, 'group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._call(group, 'group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._call(group, 'group_send', group, message)
+
+    async def flush(self):
+        self.channels = {}
+        self._receivers = {}
+        for connection in self._connections:
+            await self._run(connection.call('flush'))
+
+    async def _close_connections(self):
+        for connection in self._connections:
+            connection.close()
+
+    async def close(self):
+        if self._io_loop is None:
+            return
+        await self._run(self._close_connections())
+        with self._io_lock:
+            loop, self._io_loop = self._io_loop, None
+        loop.call_soon_threadsafe(loop.stop)
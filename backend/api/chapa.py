@@ -0,0 +1,260 @@
+"""
+Shared HTTP client for the Chapa payment API.
+
+The payment views used to call ``requests.get/post`` inline: a new TCP+TLS
+connection per call and, for most of them, no timeout, so a slow Chapa
+response held a worker for as long as Chapa took. Every call now goes
+through one pooled keep-alive ``requests.Session`` per process, with:
+
+- bounded timeouts (``CHAPA_CONNECT_TIMEOUT`` / ``CHAPA_READ_TIMEOUT``);
+- up to ``CHAPA_MAX_RETRIES`` retries with exponential backoff and full
+  jitter. GETs retry on connection errors, timeouts, 429 and 5xx. POSTs
+  (initialize, subaccount) retry only when the request never reached Chapa;
+- a circuit breaker: after ``CHAPA_BREAKER_FAILURES`` consecutive failures,
+  calls fail fast with ``ChapaUnavailable`` for ``CHAPA_BREAKER_RESET``
+  seconds instead of queueing up behind a provider that is down.
+
+``request`` returns the ``requests.Response`` and raises ``requests``
+exceptions (``ChapaUnavailable`` is a ``ConnectionError``), so callers keep
+their existing status checks and ``except`` clauses.
+
+The module-level helpers (``initialize``, ``verify``, ...) are for views,
+where a client is waiting: the whole call, retries included, must finish
+within ``CHAPA_REQUEST_DEADLINE`` seconds. Work that does not need an
+answer in the response (webhook verification, see api/payment_verification.py)
+goes through ``defer`` / ``defer_once``, which run it on a background pool
+with the client's full retry budget and return a
+``concurrent.futures.Future``.
+
+``CHAPA_BASE_URL`` points the client elsewhere, e.g. at the local fake
+server in api/fake_chapa.py (``manage.py run_fake_chapa``).
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_BACKOFF_BASE = 0.2  # seconds
+_BACKOFF_CAP = 2.0
+_BANKS_CACHE_KEY = 'chapa:banks'
+
+
+class ChapaUnavailable(requests.exceptions.ConnectionError):
+    """The circuit breaker is open; Chapa was not called."""
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; after ``reset_timeout`` seconds one probe call is let through."""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.error(f"Chapa circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+def _backoff(attempt):
+    """Full jitter: a random delay up to the exponential backoff for this attempt."""
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * (2 ** attempt)))
+
+
+def _not_sent(exc):
+    """True when the request failed before reaching Chapa, so even a POST is safe to repeat."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class ChapaClient:
+    def __init__(self, base_url=None, secret_key=None):
+        self.base_url = (base_url or settings.CHAPA_BASE_URL).rstrip('/')
+        self.secret_key = settings.CHAPA_SECRET_KEY if secret_key is None else secret_key
+        self.timeout = (settings.CHAPA_CONNECT_TIMEOUT, settings.CHAPA_READ_TIMEOUT)
+        self.max_retries = settings.CHAPA_MAX_RETRIES
+        self.breaker = CircuitBreaker(settings.CHAPA_BREAKER_FAILURES, settings.CHAPA_BREAKER_RESET)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.CHAPA_POOL_SIZE, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {self.secret_key}'
+
+    def request(self, method, path, deadline=None, **kwargs):
+        """One Chapa call with retries; returns the last response or raises a ``requests`` exception.
+
+        With ``deadline`` (seconds) the attempts share that budget: timeouts
+        are cut to what is left and no retry starts that could not finish.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        idempotent = method.upper() == 'GET'
+        expires_at = None if deadline is None else time.monotonic() + deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise ChapaUnavailable(f"Chapa circuit open, not calling {method} {path}")
+            try:
+                response = self.session.request(method, url, **{'timeout': self._timeout(expires_at), **kwargs})
+            except requests.exceptions.RequestException as exc:
+                self.breaker.record_failure()
+                delay = _backoff(attempt)
+                if self._may_retry(attempt, delay, expires_at) and (idempotent or _not_sent(exc)):
+                    logger.warning(f"Chapa {method} {path} failed ({exc}), retrying")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                raise
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            delay = _backoff(attempt)
+            if idempotent and response.status_code in _RETRY_STATUSES and self._may_retry(attempt, delay, expires_at):
+                logger.warning(f"Chapa {method} {path} returned {response.status_code}, retrying")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def _timeout(self, expires_at):
+        if expires_at is None:
+            return self.timeout
+        left = max(0.001, expires_at - time.monotonic())
+        return min(self.timeout[0], left), min(self.timeout[1], left)
+
+    def _may_retry(self, attempt, delay, expires_at):
+        if attempt >= self.max_retries:
+            return False
+        # Leave the next attempt at least a connect timeout's worth of the budget
+        return expires_at is None or time.monotonic() + delay + self.timeout[0] <= expires_at
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def initialize(self, payload, **kwargs):
+        return self.post('transaction/initialize', json=payload, **kwargs)
+
+    def verify(self, tx_ref, **kwargs):
+        return self.get(f'transaction/verify/{tx_ref}', **kwargs)
+
+    def create_subaccount(self, payload, **kwargs):
+        return self.post('subaccount', json=payload, **kwargs)
+
+    def banks(self, **kwargs):
+        """The bank list as ``{"data": [...], ...}``, cached for ``CHAPA_BANKS_CACHE_TTL`` seconds."""
+        data = cache.get(_BANKS_CACHE_KEY)
+        if data is None:
+            response = self.get('banks', **kwargs)
+            response.raise_for_status()
+            data = response.json()
+            cache.set(_BANKS_CACHE_KEY, data, settings.CHAPA_BANKS_CACHE_TTL)
+        return data
+
+
+_client = None
+_client_pid = None
+_executor = None
+_deferred = {}  # Future -> (func, args) while it runs
+_deferred_lock = threading.RLock()
+
+
+def get_client():
+    global _client, _client_pid, _executor
+    if _client is None or _client_pid != os.getpid() or _client.base_url != settings.CHAPA_BASE_URL.rstrip('/'):
+        # Forked workers must not share the parent's sockets
+        _client, _client_pid, _executor = ChapaClient(), os.getpid(), None
+    return _client
+
+
+def request(method, path, **kwargs):
+    kwargs.setdefault('deadline', settings.CHAPA_REQUEST_DEADLINE)
+    return get_client().request(method, path, **kwargs)
+
+
+def initialize(payload):
+    return get_client().initialize(payload, deadline=settings.CHAPA_REQUEST_DEADLINE)
+
+
+def verify(tx_ref):
+    return get_client().verify(tx_ref, deadline=settings.CHAPA_REQUEST_DEADLINE)
+
+
+def create_subaccount(payload):
+    return get_client().create_subaccount(payload, deadline=settings.CHAPA_REQUEST_DEADLINE)
+
+
+def banks():
+    return get_client().banks(deadline=settings.CHAPA_REQUEST_DEADLINE)
+
+
+def defer(func, *args, **kwargs):
+    """Run ``func`` on the background pool; returns a Future."""
+    global _executor
+    get_client()
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.CHAPA_POOL_SIZE, thread_name_prefix='chapa')
+    with _deferred_lock:
+        future = _executor.submit(func, *args, **kwargs)
+        _deferred[future] = (func, args)
+    future.add_done_callback(_forget)
+    return future
+
+
+def _forget(future):
+    with _deferred_lock:
+        _deferred.pop(future, None)
+
+
+def defer_once(func, *args):
+    """``defer``, unless the same call is already running: then its Future (a webhook and a client poll share one verify)."""
+    with _deferred_lock:
+        for future, call in _deferred.items():
+            if call == (func, args) and not future.done():
+                return future
+        return defer(func, *args)
+
+
+def drain(timeout=None):
+    """Wait for everything deferred so far (shutdown, tests)."""
+    with _deferred_lock:
+        futures = list(_deferred)
+    futures_wait(futures, timeout=timeout)
@@ -0,0 +1,326 @@
+"""
+The chat store: one append-only ``Message`` table keyed by conversation (Match).
+
+Messages used to be split between ``Message`` (FK to Match, written by
+SendMessageView and the chat WebSocket) and ``ChatMessage`` (FK to Like,
+written by ChatMessagesView). Every writer now goes through ``append``, which
+stamps a per-conversation sequence number (the chat socket batches its writes
+through ``append_batch``, see api/chat_writer.py), and ``merge_legacy`` copies
+ChatMessage rows across (idempotently, keyed on ``legacy_chat_id``) so the
+legacy table can be dropped once nothing writes to it any more.
+
+Conversations idle for ``CHAT_ARCHIVE_AFTER_DAYS`` are moved into compressed
+monthly ``MessageArchive`` buckets by ``archive_inactive`` and restored with
+``thaw`` the next time they are read or written.
+"""
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ChatMessage, Match, Message, MessageArchive
+from . import inbox, message_ids, pairs
+
+logger = logging.getLogger(__name__)
+
+_ARCHIVED_FIELDS = ('id', 'seq', 'sender_id', 'content', 'sent_at', 'read_at', 'legacy_chat_id')
+
+
+def conversation_for_like(like):
+    """The Match (conversation) behind a Like, as addressed by the chat endpoints."""
+    return pairs.get_match(like.liker_id, like.liked_id)
+
+
+def append(match, sender, content):
+    """Store a new message in ``match`` and bump the conversation's last interaction."""
+    if match.archived_at is not None:
+        thaw(match)
+    message = Message.objects.create(match=match, sender=sender, content=content)
+    match.last_interaction_at = message.sent_at
+    match.save(update_fields=['last_interaction_at'])
+    return message
+
+
+def append_batch(messages):
+    """Store several new messages at once; the chat socket's write-behind path (see api/chat_writer.py).
+
+    ``messages`` are unsaved Message rows with ``id`` and ``sent_at`` already
+    set, in send order. Each conversation's rows get consecutive seqs from one
+    ``allocate_seq`` call and are written with one bulk INSERT, in a
+    transaction of their own so a failure only affects that conversation.
+    Returns one entry per input: the stored row, the row stored earlier under
+    the same ``client_msg_id`` (a retried send), None if the conversation is
+    no longer active, or the exception that failed the conversation's write.
+    """
+    # Keyed by str: the socket passes the match id from its URL
+    matches = {str(match.id): match for match in Match.objects.filter(id__in={m.match_id for m in messages}, is_active=True)}
+    for match in matches.values():
+        if match.archived_at is not None:
+            thaw(match)
+
+    client_ids = {m.client_msg_id for m in messages if m.client_msg_id}
+    stored = {
+        (row.sender_id, row.client_msg_id): row
+        for row in Message.objects.filter(client_msg_id__in=client_ids)
+    } if client_ids else {}
+
+    results = [None] * len(messages)
+    new_by_match = {}  # match id -> [(index, message)]
+    first_send = {}  # (sender_id, client_msg_id) -> index of its first copy in this batch
+    repeats = []  # (index, index of the first copy)
+    for index, message in enumerate(messages):
+        key = (message.sender_id, message.client_msg_id)
+        if str(message.match_id) not in matches:
+            continue
+        if message.client_msg_id and key in stored:
+            results[index] = stored[key]
+        elif message.client_msg_id and key in first_send:
+            # The same send may be retried within one batch
+            repeats.append((index, first_send[key]))
+        else:
+            if message.client_msg_id:
+                first_send[key] = index
+            new_by_match.setdefault(str(message.match_id), []).append((index, message))
+
+    for match_id, entries in new_by_match.items():
+        rows = [message for _, message in entries]
+        try:
+            written = _insert_batch(match_id, rows)
+        except Exception as exc:
+            logger.exception(f"Failed to store {len(rows)} chat messages in match {match_id}")
+            written = [exc] * len(rows)
+        for (index, _), row in zip(entries, written):
+            results[index] = row
+    for index, first in repeats:
+        results[index] = results[first]
+    return results
+
+
+def _insert_batch(match_id, rows):
+    """Write one conversation's new rows; returns the stored row for each."""
+    with transaction.atomic():
+        first_seq = Match.allocate_seq(match_id, len(rows))
+        for offset, row in enumerate(rows):
+            row.seq = first_seq + offset
+        Match.objects.filter(id=match_id).update(last_interaction_at=rows[-1].sent_at)
+        skipped = _insert_new(rows)
+        # Re-read by id what this call inserted, and the concurrently stored sends it skipped
+        query = Q(id__in=[row.id for row in rows if (row.sender_id, row.client_msg_id) not in skipped])
+        if skipped:
+            query |= Q(sender_id__in={sender_id for sender_id, _ in skipped}, client_msg_id__in={client_id for _, client_id in skipped})
+        found = list(Message.objects.filter(query))
+        by_id = {message.id for message in found}
+        retries = {(message.sender_id, message.client_msg_id): message for message in found}
+        written = []
+        inserted = []
+        for row in rows:
+            key = (row.sender_id, row.client_msg_id)
+            if key in skipped:
+                written.append(retries[key])
+            elif row.id in by_id:
+                inserted.append(row)
+                written.append(row)
+            else:
+                raise IntegrityError(f"Message {row.id} was not stored")
+    # No post_save for bulk inserts: the inbox is bumped here, for the rows this call inserted
+    if inserted:
+        inbox.record_messages(match_id, inserted)
+    return written
+
+
+def _insert_new(rows):
+    """Bulk insert ``rows``, skipping sends a concurrent retry (another worker) stored first.
+
+    Only the ``(sender, client_msg_id)`` constraint is tolerated: any other
+    conflict, such as two processes minting the same message id, fails the
+    batch rather than drop a row. Returns the skipped (sender_id, client_msg_id) keys.
+    """
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create(rows)
+        return set()
+    except IntegrityError:
+        client_ids = [row.client_msg_id for row in rows if row.client_msg_id]
+        if not client_ids:
+            raise
+        taken = set(Message.objects.filter(
+            sender_id__in={row.sender_id for row in rows}, client_msg_id__in=client_ids,
+        ).values_list('sender_id', 'client_msg_id'))
+        skipped = {(row.sender_id, row.client_msg_id) for row in rows} & taken
+        if not skipped:
+            raise
+    Message.objects.bulk_create([row for row in rows if (row.sender_id, row.client_msg_id) not in skipped])
+    return skipped
+
+
+def messages_for(match):
+    """Queryset over ``match``'s messages, restoring them from the archive first if needed."""
+    if match.archived_at is not None:
+        thaw(match)
+    return Message.objects.filter(match=match)
+
+
+# --- Legacy ChatMessage merge ---
+
+def merge_legacy(batch_size=1000):
+    """Copy ChatMessage rows not yet in the store; safe to re-run. Returns the number copied.
+
+    Walks ChatMessage in (timestamp, id) order a batch at a time. Rows are
+    bulk-inserted (no post_save), since the inbox already counted them when
+    they were first written.
+    """
+    copied = 0
+    after = None
+    while True:
+        chats = ChatMessage.objects.select_related('match').order_by('timestamp', 'id')
+        if after is not None:
+            chats = chats.filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+        batch = list(chats[:batch_size])
+        if not batch:
+            break
+        after = (batch[-1].timestamp, batch[-1].id)
+        merged = set(
+            Message.objects.filter(legacy_chat_id__in=[chat.id for chat in batch]).values_list('legacy_chat_id', flat=True)
+        )
+
+        by_match = {}
+        for chat in batch:
+            if chat.id in merged:
+                continue
+            match = conversation_for_like(chat.match)
+            if match is None:
+                match, _ = pairs.create_match(chat.match.liker_id, chat.match.liked_id)
+            by_match.setdefault(match.id, []).append(chat)
+
+        with transaction.atomic():
+            rows = []
+            for match_id, match_chats in by_match.items():
+                first_seq = Match.allocate_seq(match_id, len(match_chats))
+                for offset, chat in enumerate(match_chats):
+                    rows.append(Message(
+                        id=message_ids.next_id(),
+                        match_id=match_id,
+                        seq=first_seq + offset,
+                        sender_id=chat.sender_id,
+                        content=chat.content,
+                        sent_at=chat.timestamp,
+                        read_at=chat.timestamp if chat.is_read else None,
+                        legacy_chat_id=chat.id,
+                    ))
+            # A concurrent merge may have copied some of these already
+            Message.objects.bulk_create(rows, ignore_conflicts=True)
+        copied += len(rows)
+    if copied:
+        logger.info(f"Merged {copied} legacy chat messages into the chat store")
+    return copied
+
+
+def assign_missing_seq():
+    """Number messages stored without a seq (written by app servers predating it). Returns the count."""
+    numbered = 0
+    for match_id in list(Message.objects.filter(seq__isnull=True).values_list('match_id', flat=True).distinct()):
+        with transaction.atomic():
+            rows = list(Message.objects.select_for_update().filter(match_id=match_id, seq__isnull=True).order_by('sent_at', 'id'))
+            if not rows:
+                continue
+            first_seq = Match.allocate_seq(match_id, len(rows))
+            for offset, row in enumerate(rows):
+                row.seq = first_seq + offset
+            Message.objects.bulk_update(rows, ['seq'], batch_size=1000)
+        numbered += len(rows)
+    return numbered
+
+
+# --- Archival ---
+
+def _serialize(row):
+    item = dict(zip(_ARCHIVED_FIELDS, row))
+    item['sender_id'] = str(item['sender_id'])
+    item['sent_at'] = item['sent_at'].isoformat()
+    item['read_at'] = item['read_at'].isoformat() if item['read_at'] else None
+    item['legacy_chat_id'] = str(item['legacy_chat_id']) if item['legacy_chat_id'] else None
+    return item
+
+
+def _deserialize(match_id, item):
+    return Message(
+        id=item['id'],
+        match_id=match_id,
+        seq=item['seq'],
+        sender_id=item['sender_id'],
+        content=item['content'],
+        sent_at=parse_datetime(item['sent_at']),
+        read_at=parse_datetime(item['read_at']) if item['read_at'] else None,
+        legacy_chat_id=item['legacy_chat_id'],
+    )
+
+
+def archive(match):
+    """Move all of ``match``'s messages into monthly MessageArchive buckets."""
+    with transaction.atomic():
+        match = Match.objects.select_for_update().get(id=match.id)
+        if match.archived_at is not None:
+            return 0
+        buckets = {}
+        rows = Message.objects.filter(match=match).order_by('seq', 'id').values_list(*_ARCHIVED_FIELDS)
+        for row in rows.iterator(chunk_size=2000):
+            sent_at = row[_ARCHIVED_FIELDS.index('sent_at')]
+            buckets.setdefault(sent_at.date().replace(day=1), []).append(_serialize(row))
+        MessageArchive.objects.bulk_create([
+            MessageArchive(
+                match=match,
+                bucket=bucket,
+                first_seq=items[0]['seq'] or 0,
+                last_seq=items[-1]['seq'] or 0,
+                message_count=len(items),
+                payload=zlib.compress(json.dumps(items).encode()),
+            )
+            for bucket, items in buckets.items()
+        ])
+        Message.objects.filter(match=match).delete()
+        match.archived_at = timezone.now()
+        match.save(update_fields=['archived_at'])
+    return sum(len(items) for items in buckets.values())
+
+
+def thaw(match):
+    """Restore an archived conversation's messages into the Message table."""
+    with transaction.atomic():
+        locked = Match.objects.select_for_update().get(id=match.id)
+        if locked.archived_at is None:
+            match.archived_at = None
+            return 0
+        restored = []
+        for archived in MessageArchive.objects.filter(match=locked).order_by('bucket'):
+            items = json.loads(zlib.decompress(bytes(archived.payload)))
+            restored.extend(_deserialize(locked.id, item) for item in items)
+        Message.objects.bulk_create(restored, batch_size=1000)
+        MessageArchive.objects.filter(match=locked).delete()
+        locked.archived_at = None
+        locked.save(update_fields=['archived_at'])
+    match.archived_at = None
+    logger.info(f"Restored {len(restored)} archived messages for match {match.id}")
+    return len(restored)
+
+
+def archive_inactive(days=None, limit=None):
+    """Archive conversations with no activity in ``days`` (CHAT_ARCHIVE_AFTER_DAYS). Returns (conversations, messages)."""
+    days = settings.CHAT_ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    idle = Match.objects.filter(archived_at__isnull=True).filter(
+        Q(last_interaction_at__lt=cutoff) | Q(last_interaction_at__isnull=True, matched_at__lt=cutoff)
+    ).filter(messages__isnull=False).distinct()
+    if limit:
+        idle = idle[:limit]
+    conversations = messages = 0
+    for match in idle:
+        messages += archive(match)
+        conversations += 1
+    logger.info(f"Archived {messages} messages from {conversations} idle conversations")
+    return conversations, messages
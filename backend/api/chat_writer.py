@@ -0,0 +1,124 @@
+"""
+Write-behind persistence for messages sent over the chat WebSocket.
+
+``ChatConsumer`` used to await ``save_message`` (a thread hop plus three
+queries) before broadcasting, so every delivery paid for a database round
+trip. Now a message gets its server id (api/message_ids.py) and timestamp
+in-process, is broadcast to the room straight away, and is handed to the
+process's ``MessageWriter``. The writer collects messages for up to
+``CHAT_WRITE_FLUSH_MS`` milliseconds (or ``CHAT_WRITE_BATCH_SIZE`` messages)
+and stores each batch with ``chat_store.append_batch``, which means one
+transaction, one ``allocate_seq`` and one bulk INSERT per conversation.
+
+The sender is acknowledged (``message_ack`` with the stored id and seq) only
+after the batch commits. Every socket send carries a ``client_msg_id``; a
+client keeps unacknowledged messages and resends them with the same id after
+a reconnect, so a worker dying between the broadcast and the flush loses
+nothing. The retry is stored once (``Message.client_msg_id`` is unique per
+sender, even when two workers race to store it), and the other side
+de-duplicates the repeated broadcast by ``client_msg_id``. A message that
+cannot be stored gets ``message_error`` to the sender and
+``message_retracted`` to the room, so the other side drops it again.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import chat_store, message_ids
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageNotStored(Exception):
+    """The conversation was deactivated before the message was written."""
+
+
+def prepare(match_id, sender, content, client_msg_id=None):
+    """A new, unsaved message with its final id and timestamp, ready to broadcast."""
+    return Message(
+        id=message_ids.next_id(),
+        match_id=match_id,
+        sender=sender,
+        content=content,
+        sent_at=timezone.now(),
+        client_msg_id=client_msg_id or None,
+    )
+
+
+class MessageWriter:
+    """Batches ``write`` calls made on one event loop into ``append_batch`` calls."""
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or settings.CHAT_WRITE_BATCH_SIZE
+        self.flush_interval = settings.CHAT_WRITE_FLUSH_MS / 1000 if flush_interval is None else flush_interval
+        self.pending = []  # [(message, future)]
+        self.timer = None
+        # Batches commit one at a time, in order, so seqs follow send order
+        self.lock = asyncio.Lock()
+        self.flushes = set()
+
+    async def write(self, message):
+        """Queue ``message``; returns the stored row once its batch has committed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((message, future))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.flush_interval, self.flush)
+        # If the caller goes away the message is still written, just not acknowledged
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._store(batch))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def drain(self):
+        """Write everything queued so far (shutdown, tests)."""
+        self.flush()
+        if self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+
+    async def _store(self, batch):
+        async with self.lock:
+            try:
+                results = await database_sync_to_async(chat_store.append_batch)([message for message, _ in batch])
+            except Exception as exc:
+                logger.exception(f"Failed to store a batch of {len(batch)} chat messages")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+        for (_, future), stored in zip(batch, results):
+            if future.done():
+                continue
+            if stored is None:
+                future.set_exception(MessageNotStored())
+            elif isinstance(stored, Exception):
+                future.set_exception(stored)
+            else:
+                future.set_result(stored)
+
+
+_writers = {}  # event loop -> MessageWriter
+
+
+def get_writer():
+    loop = asyncio.get_running_loop()
+    for other in [l for l in _writers if l.is_closed()]:
+        # async_to_sync callers get a fresh loop per call
+        del _writers[other]
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter()
+    return writer
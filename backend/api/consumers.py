@@ -1,18 +1,22 @@
+import asyncio
 import json
 import logging
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from rest_framework.authtoken.models import Token
+
+from . import chat_writer, events, membership, notifications, presence
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 class MatchNotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        # Get user from token
-        self.user = await self.get_user_from_token()
-        if not self.user:
+        # Resolved from the ?token= query string by TokenAuthMiddleware (api/ws_auth.py)
+        self.user = self.scope.get('user')
+        if not self.user or not self.user.is_authenticated:
             await self.close()
             return
 
@@ -24,6 +28,13 @@ class MatchNotificationConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        await database_sync_to_async(presence.connected)(self.user.id)
+        self.last_persisted = None
+        # Replay what was published while this user had no socket (see api/notifications.py).
+        # None until the client resumes or the first event goes out
+        self.delivered_seq = None
+        since = parse_qs(self.scope.get('query_string', b'').decode()).get('since', [None])[0]
+        await self.resume(int(since) if since and since.isdigit() else None)
         logger.info(f"WebSocket connected for user {self.user.id}")
 
     async def disconnect(self, close_code):
@@ -32,6 +43,7 @@ class MatchNotificationConsumer(AsyncWebsocketConsumer):
                 self.user_group_name,
                 self.channel_name
             )
+            await database_sync_to_async(presence.disconnected)(self.user.id)
         logger.info(f"WebSocket disconnected with code {close_code}")
 
     async def receive(self, text_data):
@@ -40,55 +52,80 @@ class MatchNotificationConsumer(AsyncWebsocketConsumer):
             message_type = data.get('type')
             
             if message_type == 'ping':
+                self.last_persisted = await database_sync_to_async(presence.heartbeat)(
+                    self.user.id, self.last_persisted
+                )
                 await self.send(text_data=json.dumps({
                     'type': 'pong',
                     'timestamp': data.get('timestamp')
                 }))
+            elif message_type == 'ack' and isinstance(data.get('seq'), int):
+                # Never past what this socket delivered: the rest may still be on its way
+                if self.delivered_seq is not None:
+                    await database_sync_to_async(notifications.acknowledge)(
+                        self.user.id, min(data['seq'], self.delivered_seq)
+                    )
+            elif message_type == 'resume':
+                since = data.get('since')
+                await self.resume(since if isinstance(since, int) else None)
         except json.JSONDecodeError:
             logger.error("Invalid JSON received")
 
-    # Handle match notification
-    async def match_notification(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'match_notification',
-            'match': event['match'],
-            'message': event['message']
-        }))
+    async def resume(self, since):
+        # Clients that don't send ?since= (older app versions) only get live events
+        if since is None:
+            return
+        self.delivered_seq = since
+        await self.replay()
 
-    # Handle new message notification
-    async def message_notification(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_notification',
-            'match_id': event['match_id'],
-            'message': event['message'],
-            'sender': event['sender']
-        }))
+    async def replay(self):
+        """Send everything stored after ``delivered_seq``, in order."""
+        since = self.delivered_seq
+        stored, missed = await database_sync_to_async(notifications.pending)(self.user.id, since)
+        if missed:
+            await self.send(text_data=json.dumps({'type': 'resync_required', 'since': since}))
+        for seq, event in stored:
+            if seq > self.delivered_seq:
+                self.delivered_seq = seq
+                await self.send(text_data=json.dumps({**event, 'seq': seq}))
 
-    # Handle like notification (for subscribers)
-    async def like_notification(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'like_notification',
-            'liker': event['liker'],
-            'message': event['message']
-        }))
+    async def send_event(self, seq, event):
+        if self.delivered_seq is not None:
+            # Replay and live pushes can overlap right after connect
+            if seq <= self.delivered_seq:
+                return
+            if seq > self.delivered_seq + 1:
+                # Pushes can overtake each other, but seqs commit in order: everything up
+                # to ``seq`` is already in the outbox, so fill the gap from there
+                await self.replay()
+                if seq <= self.delivered_seq:
+                    return
+        self.delivered_seq = seq
+        await self.send(text_data=json.dumps({**event, 'seq': seq}))
 
-    @database_sync_to_async
-    def get_user_from_token(self):
-        try:
-            # Get token from query string
-            token_key = self.scope['query_string'].decode().split('token=')[1].split('&')[0]
-            token = Token.objects.get(key=token_key)
-            return token.user
-        except (IndexError, Token.DoesNotExist):
-            return None
+    # Every push to the user's group is a notify envelope (see api/events.py)
+    async def notify(self, message):
+        if 'v' not in message:
+            # Pre-envelope senders: {"type": "notify", "payload": {...}}
+            items = [message.get('payload', {})]
+        elif message['v'] != events.ENVELOPE_VERSION:
+            logger.warning(f"Dropping notify envelope with unknown version {message['v']}")
+            return
+        else:
+            items = message['events']
+        for item in items:
+            if 'seq' in item:
+                await self.send_event(item['seq'], item)
+            else:
+                await self.send(text_data=json.dumps(item))
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.match_id = self.scope['url_route']['kwargs']['match_id']
-        self.user = await self.get_user_from_token()
+        self.user = self.scope.get('user')
         
-        if not self.user:
+        if not self.user or not self.user.is_authenticated:
             await self.close()
             return
 
@@ -106,10 +143,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        self.typing = presence.TypingCoalescer()
+        self.typing_flush = None
+        self.pending_writes = set()
+        self.last_persisted = None
+        await database_sync_to_async(presence.connected)(self.user.id)
+        await self.broadcast_presence(True)
         logger.info(f"Chat WebSocket connected for user {self.user.id} in match {self.match_id}")
 
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
+            if self.typing_flush is not None:
+                self.typing_flush.cancel()
+            for task in list(self.pending_writes):
+                # Queued messages are still written; only the acks are dropped
+                task.cancel()
+            if self.typing.sent_state:
+                # Don't leave the indicator stuck on the other side
+                await self.broadcast_typing(False)
+            still_online = await database_sync_to_async(presence.disconnected)(self.user.id)
+            await self.broadcast_presence(still_online)
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
@@ -123,8 +176,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if message_type == 'chat_message':
                 content = data.get('content', '').strip()
                 if content:
-                    # Save message to database
-                    message = await self.save_message(content)
+                    client_msg_id = data.get('client_msg_id')
+                    if client_msg_id is not None and len(str(client_msg_id)) > 64:
+                        await self.send(text_data=json.dumps({
+                            'type': 'message_error',
+                            'client_msg_id': client_msg_id,
+                            'error': 'client_msg_id is too long'
+                        }))
+                        return
+                    # Broadcast first; the write is batched and acknowledged when it commits
+                    message = chat_writer.prepare(self.match_id, self.user, content, str(client_msg_id or ''))
+                    if message.client_msg_id is None:
+                        # Clients that send none (the web app) get a server one, so acks and
+                        # retractions still name the message; only their retries are not de-duplicated
+                        message.client_msg_id = f"srv-{message.id}"
+                    self.typing.reset()
+                    if self.typing_flush is not None:
+                        self.typing_flush.cancel()
                     
                     # Send message to room group
                     await self.channel_layer.group_send(
@@ -133,26 +201,101 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             'type': 'chat_message',
                             'message': {
                                 'id': str(message.id),
+                                'client_msg_id': message.client_msg_id,
                                 'content': message.content,
-                                'sender_id': str(message.sender.id),
-                                'sender_name': message.sender.first_name,
+                                'sender_id': str(self.user.id),
+                                'sender_name': self.user.first_name,
                                 'sent_at': message.sent_at.isoformat(),
                             }
                         }
                     )
+                    task = asyncio.ensure_future(self.store_message(message))
+                    self.pending_writes.add(task)
+                    task.add_done_callback(self.pending_writes.discard)
             elif message_type == 'typing':
-                # Broadcast typing indicator
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_indicator',
-                        'user_id': str(self.user.id),
-                        'is_typing': data.get('is_typing', False)
-                    }
+                await self.handle_typing(data.get('is_typing', False))
+            elif message_type == 'ping':
+                self.last_persisted = await database_sync_to_async(presence.heartbeat)(
+                    self.user.id, self.last_persisted
                 )
+                await self.send(text_data=json.dumps({
+                    'type': 'pong',
+                    'timestamp': data.get('timestamp')
+                }))
         except json.JSONDecodeError:
             logger.error("Invalid JSON received in chat")
 
+    async def store_message(self, message):
+        try:
+            stored = await chat_writer.get_writer().write(message)
+        except chat_writer.MessageNotStored:
+            error = 'Match not found'
+        except Exception:
+            error = 'Message could not be saved, please retry'
+        else:
+            await self.send(text_data=json.dumps({
+                'type': 'message_ack',
+                'client_msg_id': message.client_msg_id,
+                'id': str(stored.id),
+                'seq': stored.seq,
+                'sent_at': stored.sent_at.isoformat(),
+            }))
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'message_error',
+            'client_msg_id': message.client_msg_id,
+            'id': str(message.id),
+            'error': error
+        }))
+        # The room already shows the broadcast; take it back (a retry is broadcast again)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'message_retracted',
+                'message': {
+                    'id': str(message.id),
+                    'client_msg_id': message.client_msg_id,
+                    'sender_id': str(self.user.id),
+                }
+            }
+        )
+
+    async def handle_typing(self, is_typing):
+        # Coalesced per sender: one group message per state change, not per keystroke
+        if self.typing.offer(is_typing):
+            await self.broadcast_typing(self.typing.sent_state)
+        elif self.typing.pending is not None and self.typing_flush is None:
+            self.typing_flush = asyncio.ensure_future(self.flush_typing())
+
+    async def flush_typing(self):
+        try:
+            await asyncio.sleep(self.typing.retry_after())
+            state = self.typing.take_pending()
+            if state is not None:
+                await self.broadcast_typing(state)
+        finally:
+            self.typing_flush = None
+
+    async def broadcast_typing(self, is_typing):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_indicator',
+                'user_id': str(self.user.id),
+                'is_typing': is_typing
+            }
+        )
+
+    async def broadcast_presence(self, is_online):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'presence_update',
+                'user_id': str(self.user.id),
+                'is_online': is_online
+            }
+        )
+
     # Receive message from room group
     async def chat_message(self, event):
         message = event['message']
@@ -161,6 +304,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': message
         }))
 
+    # Receive a message that could not be stored from room group
+    async def message_retracted(self, event):
+        # The sender was told with message_error
+        if event['message']['sender_id'] != str(self.user.id):
+            await self.send(text_data=json.dumps({
+                'type': 'message_retracted',
+                'message': event['message']
+            }))
+
     # Receive typing indicator from room group
     async def typing_indicator(self, event):
         # Don't send typing indicator back to the sender
@@ -171,38 +323,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'is_typing': event['is_typing']
             }))
 
-    @database_sync_to_async
-    def get_user_from_token(self):
-        try:
-            token_key = self.scope['query_string'].decode().split('token=')[1].split('&')[0]
-            token = Token.objects.get(key=token_key)
-            return token.user
-        except (IndexError, Token.DoesNotExist):
-            return None
+    # Receive the other participant's presence changes from room group
+    async def presence_update(self, event):
+        if event['user_id'] != str(self.user.id):
+            await self.send(text_data=json.dumps({
+                'type': 'presence_update',
+                'user_id': event['user_id'],
+                'is_online': event['is_online']
+            }))
 
     @database_sync_to_async
     def user_in_match(self):
-        from .models import Match
-        try:
-            match = Match.objects.get(id=self.match_id, is_active=True)
-            return self.user in [match.user1, match.user2]
-        except Match.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, content):
-        from .models import Match, Message
-        from django.utils import timezone
-        
-        match = Match.objects.get(id=self.match_id, is_active=True)
-        message = Message.objects.create(
-            match=match,
-            sender=self.user,
-            content=content
-        )
-        
-        # Update match last interaction
-        match.last_interaction_at = timezone.now()
-        match.save(update_fields=['last_interaction_at'])
-        
-        return message
+        return membership.conversation_for(self.match_id, self.user.id) is not None
@@ -0,0 +1,321 @@
+"""
+Discovery candidate pools.
+
+Building a deck used to run ``ORDER BY RANDOM()`` over every profile on each
+request. Instead, each user gets a precomputed pool: a list of eligible
+candidate IDs ranked by compatibility score, with boosted profiles placed
+first. Decks are sliced from the pool, and swipes tombstone entries as they
+happen (one ``DiscoveryTombstone`` insert per swipe, never a rewrite of the
+pool), so serving a page only touches the IDs on that page. The pool is
+rebuilt when it expires, when the discovery filters change, or when a deck
+served from its top runs off the end before filling a page (``deck_page``).
+
+Clients page through a pool with an opaque cursor that pins the pool version
+and an offset into it, so a deck session sees one stable order.
+
+Distance filtering uses the geohash column on ``User`` (see api/geo.py): the
+viewer's radius is turned into a few indexed geohash range scans plus a
+bounding box, and only the survivors get an exact haversine check.
+"""
+import base64
+import binascii
+import json
+import logging
+import random
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import geo, preference_filter, scoring, seen
+from .models import DiscoveryPool, DiscoveryTombstone, User, UserPreference
+
+logger = logging.getLogger(__name__)
+
+
+def _pool_size():
+    return int(getattr(settings, 'DISCOVERY_POOL_SIZE', 1000))
+
+
+def _pool_ttl():
+    return timedelta(seconds=int(getattr(settings, 'DISCOVERY_POOL_TTL_SECONDS', 6 * 3600)))
+
+
+def _scoring_limit():
+    return int(getattr(settings, 'DISCOVERY_SCORING_LIMIT', 10000))
+
+
+def _parse_int(raw):
+    try:
+        return int(raw) if raw is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_discovery_filters(params, user=None):
+    """Normalize the discovery query params (minAge, maxAge, gender, maxDistance).
+
+    The distance filter only applies when ``user`` has coordinates; without a
+    maxDistance param it falls back to the saved ``max_distance_km``.
+    """
+    gender = (params.get('gender') or '').strip()
+    filters = {
+        'min_age': _parse_int(params.get('minAge')),
+        'max_age': _parse_int(params.get('maxAge')),
+        'gender': '' if gender.lower() == 'all' else gender,
+        'max_distance_km': None,
+        'origin': None,
+        'prefs_version': 0,
+    }
+    if user is None:
+        return filters
+
+    saved_distance, prefs_updated_at = (
+        UserPreference.objects.filter(user=user)
+        .values_list('max_distance_km', 'updated_at')
+        .first()
+    ) or (None, None)
+    if prefs_updated_at is not None:
+        # Editing preferences changes the pool's filter key, forcing a rebuild
+        filters['prefs_version'] = int(prefs_updated_at.timestamp())
+
+    if user.location_latitude is not None and user.location_longitude is not None:
+        max_distance = _parse_int(params.get('maxDistance'))
+        if max_distance is None:
+            max_distance = saved_distance
+        if max_distance is not None and max_distance > 0:
+            filters['max_distance_km'] = max_distance
+            filters['origin'] = (float(user.location_latitude), float(user.location_longitude))
+    return filters
+
+
+def _origin_precision():
+    return int(getattr(settings, 'DISCOVERY_ORIGIN_GEOHASH_PRECISION', 5))
+
+
+def build_filter_key(filters):
+    key = f"age:{filters['min_age']}-{filters['max_age']}|gender:{filters['gender'].lower()}"
+    if filters.get('origin') is not None:
+        # Moving to another ~5km cell invalidates the pool, small GPS jitter does not
+        cell = geo.encode(*filters['origin'], precision=_origin_precision())
+        key += f"|dist:{filters['max_distance_km']}@{cell}"
+    if filters.get('prefs_version'):
+        key += f"|prefs:{filters['prefs_version']}"
+    return key
+
+
+def _distance_q(origin, radius_km):
+    """Index-friendly prefilter for candidates within ``radius_km`` of ``origin``."""
+    lat, lon = origin
+    q = Q(location_geohash__isnull=False)
+    cells = geo.covering_cells(lat, lon, radius_km)
+    if cells:
+        cell_q = Q()
+        for cell in cells:
+            low, high = geo.cell_range(cell)
+            cell_q |= Q(location_geohash__gte=low, location_geohash__lt=high)
+        q &= cell_q
+    lat_min, lat_max, lon_min, lon_max = geo.bounding_box(lat, lon, radius_km)
+    q &= Q(location_latitude__gte=max(lat_min, -90.0), location_latitude__lte=min(lat_max, 90.0))
+    # Skip the longitude bounds when the box crosses the antimeridian; the cells already handle it
+    if lon_min >= -180.0 and lon_max <= 180.0:
+        q &= Q(location_longitude__gte=lon_min, location_longitude__lte=lon_max)
+    return q
+
+
+def eligible_candidates(user, filters):
+    """Queryset of users that may appear in ``user``'s deck, before shuffling."""
+    # Already swiped/liked profiles are dropped in build_pool via the seen filter (api/seen.py)
+    qs = User.objects.exclude(id=user.id)
+
+    min_age, max_age = filters['min_age'], filters['max_age']
+    # Only apply age filters if they are not the frontend defaults (18-99).
+    # This prevents excluding users who haven't set their DOB yet during onboarding.
+    age_override = (min_age is not None or max_age is not None) and not (min_age == 18 and max_age == 99)
+    if age_override:
+        today = timezone.now().date()
+        if min_age is not None:
+            qs = qs.filter(date_of_birth__lte=today - relativedelta(years=min_age))
+        if max_age is not None:
+            qs = qs.filter(date_of_birth__gte=today - relativedelta(years=(max_age + 1)))
+
+    if filters['gender']:
+        qs = qs.filter(gender__iexact=filters['gender'])
+
+    if filters.get('origin') is not None:
+        qs = qs.filter(_distance_q(filters['origin'], filters['max_distance_km']))
+
+    # Stored preferences, both ways; explicit gender/age params win for this request
+    return preference_filter.apply_preferences(
+        qs, user, override_gender=bool(filters['gender']), override_age=age_override
+    )
+
+
+def build_pool(user, filters):
+    """Rebuild ``user``'s pool: boosted candidates first, each group ranked by compatibility.
+
+    Candidate feature rows are streamed from the database and the non-boosted
+    side is reservoir-sampled down to ``DISCOVERY_SCORING_LIMIT``, so memory
+    stays bounded no matter how many profiles are eligible. The sample is then
+    scored in one vectorized pass (see api/scoring.py) and the best
+    ``DISCOVERY_POOL_SIZE`` are kept. Already seen candidates are dropped
+    here via the user's seen filter, and with a distance filter the
+    coordinates drive the exact check on prefiltered rows.
+    """
+    size = _pool_size()
+    limit = max(_scoring_limit(), size)
+    boosted, others = [], []
+    sampled = 0
+    origin, radius_km = filters.get('origin'), filters.get('max_distance_km')
+    started = timezone.now()
+    seen_ids = seen.load(user.id)
+    rows = eligible_candidates(user, filters).values_list(*scoring.FEATURE_FIELDS).iterator(chunk_size=5000)
+    for row in rows:
+        candidate_id, has_boost, lat, lon = row[:4]
+        if str(candidate_id) in seen_ids:
+            continue
+        if origin is not None and geo.haversine_km(origin[0], origin[1], lat, lon) > radius_km:
+            continue
+        if has_boost:
+            if len(boosted) < size:
+                boosted.append(row)
+            continue
+        sampled += 1
+        if len(others) < limit:
+            others.append(row)
+        else:
+            slot = random.randrange(sampled)
+            if slot < limit:
+                others[slot] = row
+
+    viewer = scoring.viewer_vector(user)
+    candidate_ids = (scoring.rank(user, boosted, viewer) + scoring.rank(user, others, viewer))[:size]
+
+    pool, _ = DiscoveryPool.objects.update_or_create(
+        user=user,
+        defaults={
+            'candidate_ids': candidate_ids,
+            'filter_key': build_filter_key(filters),
+            'built_at': timezone.now(),
+        },
+    )
+    # Candidates swiped before the seen filter was loaded are not in the new pool; a swipe
+    # that landed during the build keeps its tombstone
+    DiscoveryTombstone.objects.filter(user=user, created_at__lt=started).delete()
+    logger.info(f"Built discovery pool for user {user.id}: {len(boosted)} boosted, {len(candidate_ids)} total")
+    return pool
+
+
+def pool_version(pool):
+    return int(pool.built_at.timestamp() * 1_000_000)
+
+
+def get_pool(user, filters, version=None):
+    """Return ``user``'s pool for ``filters``, rebuilding it if stale or built for other filters.
+
+    When ``version`` names the current pool (a client is mid-session paging
+    through it), the TTL is not enforced so the session keeps a stable order.
+    """
+    pool = DiscoveryPool.objects.filter(user=user).first()
+    if pool is not None and pool.filter_key == build_filter_key(filters):
+        if version is not None and pool_version(pool) == version:
+            return pool
+        if pool.built_at > timezone.now() - _pool_ttl():
+            return pool
+    return build_pool(user, filters)
+
+
+def deck_page(user, filters, offset=0, limit=None, version=None):
+    """Return (pool, candidate_ids, next_offset) for one page of ``user``'s deck.
+
+    ``version`` and ``offset`` come from the client's cursor; a cursor for a
+    pool that has since been rebuilt starts the new one from the top. A page
+    served from the top that runs off the end of the pool short of ``limit``
+    means most of the pool has been swiped away, so the pool is rebuilt then
+    (a freshly built pool has no tombstones among its candidates).
+    """
+    limit = limit or settings.DISCOVERY_DECK_SIZE
+    pool = get_pool(user, filters, version=version)
+    if version is not None and pool_version(pool) != version:
+        offset = 0
+    candidate_ids, next_offset = take_page(pool, offset, limit)
+    if offset == 0 and len(candidate_ids) < min(limit, len(pool.candidate_ids)):
+        pool = build_pool(user, filters)
+        candidate_ids, next_offset = take_page(pool, 0, limit)
+    return pool, candidate_ids, next_offset
+
+
+def encode_cursor(pool, offset):
+    raw = json.dumps({'v': pool_version(pool), 'o': offset}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (version, offset) from an opaque cursor, or None if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        version, offset = int(data['v']), int(data['o'])
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeDecodeError):
+        return None
+    if offset < 0:
+        return None
+    return version, offset
+
+
+def take_page(pool, offset, limit):
+    """Return (candidate_ids, next_offset) for up to ``limit`` live candidates starting at ``offset``."""
+    page = []
+    position = offset
+    total = len(pool.candidate_ids)
+    while position < total and len(page) < limit:
+        # Look up tombstones for the next stretch of the pool only, not the whole pool
+        window = pool.candidate_ids[position:position + 2 * (limit - len(page))]
+        removed = set(
+            DiscoveryTombstone.objects.filter(user_id=pool.user_id, candidate_id__in=window)
+            .values_list('candidate_id', flat=True)
+        )
+        for candidate_id in window:
+            position += 1
+            if candidate_id not in removed:
+                page.append(candidate_id)
+                if len(page) == limit:
+                    break
+    return page, position
+
+
+def load_profiles(candidate_ids):
+    """Fetch users for ``candidate_ids`` in one query, preserving pool order."""
+    users = (
+        User.objects.filter(id__in=candidate_ids)
+        .prefetch_related('photos', 'interests')
+    )
+    by_id = {str(u.id): u for u in users}
+    return [by_id[cid] for cid in candidate_ids if cid in by_id]
+
+
+def remove_candidate(swiper_id, candidate_id):
+    """Tombstone ``candidate_id`` in ``swiper_id``'s pool after a swipe."""
+    remove_candidates(swiper_id, [candidate_id])
+
+
+def remove_candidates(swiper_id, candidate_ids):
+    """Tombstone several candidates in one insert (batch swipes).
+
+    Inserts skip existing rows, so concurrent swipes from several devices
+    or requests all land. Tombstones for candidates outside the pool are
+    harmless: pages only look up the IDs they serve.
+    """
+    DiscoveryTombstone.objects.bulk_create(
+        [DiscoveryTombstone(user_id=swiper_id, candidate_id=c) for c in dict.fromkeys(str(c) for c in candidate_ids)],
+        ignore_conflicts=True,
+    )
+
+
+def invalidate_pool(user):
+    DiscoveryPool.objects.filter(user=user).delete()
+    DiscoveryTombstone.objects.filter(user=user).delete()
@@ -0,0 +1,101 @@
+"""
+The event bus: everything pushed to a user's socket goes through here.
+
+A business action usually produces several events for the same user. A gift,
+for example, produces ``gift.sent`` plus a ``wallet.updated`` snapshot. Each
+event used to cost its own ``group_send``, and event types depended on the
+sender: payments sent ``notify`` while api sent ``match_notification`` and
+friends. ``MatchNotificationConsumer`` had no ``notify`` handler, so wallet
+events never reached the app.
+
+``send`` now delivers one versioned envelope per group, and every group in
+one call shares a single sync-to-async hop:
+
+    {"type": "notify", "v": 1, "events": [{...}, {...}]}
+
+Each event is the JSON object the client receives as one socket frame, e.g.
+``{"event": "wallet.updated", ...}`` or ``{"type": "match_notification",
+...}``. Events stored in the notification outbox also carry their ``seq``
+(see api/notifications.py). ``MatchNotificationConsumer.notify`` is the one
+handler that unpacks envelopes.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+
+# Optional channels import, as in payments (no-op without a channel layer)
+try:  # pragma: no cover - optional dep
+    from channels.layers import get_channel_layer
+except Exception:  # pragma: no cover
+    def get_channel_layer():
+        return None
+
+logger = logging.getLogger(__name__)
+
+ENVELOPE_VERSION = 1
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+def envelope(events):
+    return {'type': 'notify', 'v': ENVELOPE_VERSION, 'events': list(events)}
+
+
+def send(events_by_group):
+    """Push ``{group: [event, ...]}``, one group message per group. Best effort."""
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+    batches = [(group, events) for group, events in events_by_group.items() if events]
+    if not batches:
+        return
+
+    async def send_all():
+        for group, events in batches:
+            await channel_layer.group_send(group, envelope(events))
+
+    try:
+        async_to_sync(send_all)()
+    except Exception as e:
+        logger.error(f"Failed to push events to {', '.join(group for group, _ in batches)}: {e}")
+
+
+def send_to_users(events_by_user):
+    """``send`` addressed by user id."""
+    send({user_group(user_id): events for user_id, events in events_by_user.items()})
+
+
+def send_on_commit(events_by_user):
+    """``send_to_users`` once the surrounding transaction commits (right away outside one)."""
+    transaction.on_commit(lambda: send_to_users(events_by_user))
+
+
+def wallet_updated(wallet):
+    """Snapshot event for a payments Wallet."""
+    return {
+        'event': 'wallet.updated',
+        'coin_balance': str(wallet.coin_balance),
+        'balance_etb': str(wallet.balance_etb),
+        'hold_etb': str(wallet.hold_etb),
+    }
+
+
+def wallets_updated(user_ids):
+    """{user_id: ``wallet_updated`` event} for several users, from one ledger query."""
+    from payments import ledger
+
+    codes = [ledger.Code.COINS, ledger.Code.EARNINGS, ledger.Code.HOLD]
+    found = ledger.balances(list(user_ids), codes)
+    updates = {}
+    for user_id in user_ids:
+        coins, available, hold = (found[(user_id, code)] for code in codes)
+        updates[user_id] = {
+            'event': 'wallet.updated',
+            'coin_balance': str(int(coins)),
+            'balance_etb': str(available + hold),
+            'hold_etb': str(hold),
+        }
+    return updates
@@ -0,0 +1,146 @@
+"""
+A local stand-in for the Chapa API, for development and tests.
+
+Serves the endpoints api/chapa.py uses, under ``/v1``:
+
+    POST /v1/transaction/initialize    -> checkout_url on this server
+    GET  /v1/transaction/verify/<ref>  -> 'pending' until checkout, then 'success'
+    GET  /v1/banks
+    POST /v1/subaccount
+    GET  /checkout/<ref>                -> marks the transaction paid
+
+Run it with ``manage.py run_fake_chapa`` and set
+``CHAPA_BASE_URL=http://127.0.0.1:8765/v1``. Tests can start a
+``FakeChapaServer`` on port 0 in a thread, set ``delay`` to simulate a slow
+provider, or ``fail_next`` to make the next calls return an error status.
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BANKS = [
+    {'id': 946, 'slug': 'cbe', 'name': 'Commercial Bank of Ethiopia (CBE)', 'currency': 'ETB'},
+    {'id': 855, 'slug': 'telebirr', 'name': 'telebirr', 'currency': 'ETB'},
+    {'id': 128, 'slug': 'awash', 'name': 'Awash Bank', 'currency': 'ETB'},
+]
+
+
+class FakeChapaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=8765, delay=0.0):
+        super().__init__((host, port), _Handler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.transactions = {}  # tx_ref -> {'status', 'reference', 'amount', ...}
+        self.failures = []  # statuses to answer the next calls with
+        self.calls = []  # (method, path)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def fail_next(self, count=1, status=503):
+        with self.lock:
+            self.failures.extend([status] * count)
+
+    def complete(self, tx_ref, status='success'):
+        with self.lock:
+            self.transactions[tx_ref]['status'] = status
+
+    def handle_error(self, request, client_address):
+        # A client that gave up (timed out) has already closed the socket
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        """Serve in a daemon thread; returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _begin(self, method):
+        server = self.server
+        with server.lock:
+            server.calls.append((method, self.path))
+            failure = server.failures.pop(0) if server.failures else None
+        if server.delay:
+            time.sleep(server.delay)
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.body = json.loads(self.rfile.read(length) or b'{}')
+        if failure is not None:
+            self._reply(failure, {'status': 'failed', 'message': 'Injected failure'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._begin('GET'):
+            return
+        server = self.server
+        if self.path == '/v1/banks':
+            return self._reply(200, {'message': 'Banks retrieved', 'data': BANKS})
+        if self.path.startswith('/v1/transaction/verify/'):
+            tx_ref = self.path.rsplit('/', 1)[-1]
+            with server.lock:
+                tx = dict(server.transactions.get(tx_ref) or {})
+            if not tx:
+                return self._reply(404, {'status': 'failed', 'message': 'Invalid transaction or Transaction not found', 'data': None})
+            return self._reply(200, {'status': 'success', 'message': 'Payment details', 'data': tx})
+        if self.path.startswith('/checkout/'):
+            tx_ref = self.path.rsplit('/', 1)[-1]
+            with server.lock:
+                if tx_ref in server.transactions:
+                    server.transactions[tx_ref]['status'] = 'success'
+                    return self._reply(200, {'status': 'success'})
+            return self._reply(404, {'status': 'failed'})
+        self._reply(404, {'status': 'failed', 'message': 'Not found'})
+
+    def do_POST(self):
+        if not self._begin('POST'):
+            return
+        server = self.server
+        if self.path == '/v1/transaction/initialize':
+            tx_ref = self.body.get('tx_ref')
+            if not tx_ref or not self.body.get('amount'):
+                return self._reply(400, {'status': 'failed', 'message': 'tx_ref and amount are required'})
+            with server.lock:
+                if tx_ref in server.transactions:
+                    return self._reply(400, {'status': 'failed', 'message': 'Transaction reference has been used before'})
+                server.transactions[tx_ref] = {
+                    'tx_ref': tx_ref,
+                    'reference': f"AP{uuid.uuid4().hex[:10]}",
+                    'amount': self.body.get('amount'),
+                    'currency': self.body.get('currency', 'ETB'),
+                    'email': self.body.get('email'),
+                    'meta': self.body.get('meta'),
+                    'status': 'pending',
+                }
+            host, port = server.server_address[:2]
+            return self._reply(200, {
+                'status': 'success',
+                'message': 'Hosted Link',
+                'data': {'checkout_url': f"http://{host}:{port}/checkout/{tx_ref}"},
+            })
+        if self.path == '/v1/subaccount':
+            return self._reply(200, {'status': 'success', 'message': 'Subaccount created', 'data': {'subaccount_id': str(uuid.uuid4())}})
+        self._reply(404, {'status': 'failed', 'message': 'Not found'})
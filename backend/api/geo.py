@@ -0,0 +1,152 @@
+"""
+Geohash helpers for distance-filtered discovery.
+
+Every user with coordinates stores a geohash (see ``User.location_geohash``).
+A radius search then becomes a handful of indexed range scans over the
+geohash column (the cell under the viewer plus its neighbours), followed by
+an exact haversine check on the few rows that survive. This works on SQLite
+and Postgres alike, without PostGIS.
+"""
+import math
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+# Sorts after every geohash character, so [cell, cell + _UPPER) is a prefix range
+_UPPER = '{'
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+GEOHASH_PRECISION = 9
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    lat, lon = float(latitude), float(longitude)
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def decode_bounds(geohash):
+    """Return (lat_lo, lat_hi, lon_lo, lon_hi) for a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+
+def _cell_degrees(precision):
+    """(lat_degrees, lon_degrees) spanned by a cell of ``precision`` characters."""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def precision_for_radius(latitude, radius_km):
+    """Finest precision whose cells are at least ``radius_km`` wide and tall at ``latitude``.
+
+    Returns 0 when even single-character cells are too small, i.e. the radius
+    is continental and a cell prefilter would not narrow anything down.
+    """
+    cos_lat = max(math.cos(math.radians(float(latitude))), 0.01)
+    best = 0
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_deg, lon_deg = _cell_degrees(precision)
+        height_km = lat_deg * KM_PER_DEGREE_LAT
+        width_km = lon_deg * KM_PER_DEGREE_LAT * cos_lat
+        if min(height_km, width_km) < radius_km:
+            break
+        best = precision
+    return best
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash cells (3x3 block) that together cover the circle of ``radius_km`` around a point.
+
+    Cells are at least ``radius_km`` on a side, so the circle can never reach
+    past the immediate neighbours of the centre cell. Returns an empty list
+    when the radius is too large for any cell size to help.
+    """
+    precision = precision_for_radius(latitude, radius_km)
+    if precision == 0:
+        return []
+    lat, lon = float(latitude), float(longitude)
+    lat_lo, lat_hi, lon_lo, lon_hi = decode_bounds(encode(lat, lon, precision))
+    lat_step, lon_step = lat_hi - lat_lo, lon_hi - lon_lo
+    centre_lat, centre_lon = (lat_lo + lat_hi) / 2, (lon_lo + lon_hi) / 2
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        cell_lat = centre_lat + d_lat * lat_step
+        if not -90.0 < cell_lat < 90.0:
+            continue
+        for d_lon in (-1, 0, 1):
+            cell_lon = (centre_lon + d_lon * lon_step + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lon, precision))
+    return sorted(cells)
+
+
+def cell_range(cell):
+    """Inclusive-exclusive string range matching every geohash that starts with ``cell``."""
+    return cell, cell + _UPPER
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(lat_min, lat_max, lon_min, lon_max) enclosing the circle; longitude is not wrapped."""
+    lat, lon = float(latitude), float(longitude)
+    d_lat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = max(math.cos(math.radians(lat)), 0.01)
+    d_lon = min(radius_km / (KM_PER_DEGREE_LAT * cos_lat), 180.0)
+    return lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
@@ -0,0 +1,63 @@
+"""
+Keyset pagination for chat history.
+
+Message lists are read a page at a time off the conversation's ordering
+index (``Message`` is paged by its per-conversation ``seq``) instead of
+shipping the whole conversation:
+
+* no anchor: the newest ``limit`` messages;
+* ``before=<message id>``: the ``limit`` messages preceding that one
+  (scrolling back);
+* ``since=<message id>``: up to ``limit`` messages after that one (catch-up
+  after a reconnect).
+
+Each page is found with a descending (or, for ``since``, ascending) range
+scan that stops after ``limit`` rows, so opening a chat costs the same
+however long the conversation is. Pages are returned oldest first, the order
+the clients render in; a page shorter than ``limit`` means there is nothing
+more in that direction.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+
+def page_limit(params):
+    default = settings.CHAT_HISTORY_PAGE_SIZE
+    try:
+        limit = int(params.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+
+
+def _anchor_value(queryset, order_field, anchor_id):
+    try:
+        anchor = queryset.filter(id=anchor_id).values_list(order_field, flat=True).first()
+    except (DjangoValidationError, ValueError):
+        anchor = None
+    if anchor is None:
+        raise ValidationError({'error': 'Unknown message id'})
+    return anchor
+
+
+def page(queryset, order_field, params):
+    """One page of ``queryset`` (a single conversation) per ``before``/``since``/``limit`` in ``params``."""
+    limit = page_limit(params)
+    before, since = params.get('before'), params.get('since')
+    if before and since:
+        raise ValidationError({'error': 'Use either before or since, not both'})
+
+    if since:
+        anchor = _anchor_value(queryset, order_field, since)
+        newer = Q(**{f'{order_field}__gt': anchor}) | Q(**{order_field: anchor, 'id__gt': since})
+        return list(queryset.filter(newer).order_by(order_field, 'id')[:limit])
+
+    if before:
+        anchor = _anchor_value(queryset, order_field, before)
+        older = Q(**{f'{order_field}__lt': anchor}) | Q(**{order_field: anchor, 'id__lt': before})
+        queryset = queryset.filter(older)
+    rows = list(queryset.order_by(f'-{order_field}', '-id')[:limit])
+    rows.reverse()
+    return rows
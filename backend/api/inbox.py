@@ -0,0 +1,190 @@
+"""
+Materialized per-user inbox (``InboxEntry``).
+
+The chat list used to be built from ``Like`` rows with both users' photos
+prefetched, after which the client fetched messages per match just to show a
+preview. Each user now has one row per match carrying everything the list
+shows. Writes keep it current:
+
+* a new Match creates both users' entries;
+* a sent message updates both entries in one UPDATE (the recipient's unread
+  count is incremented in the same statement);
+* reading a conversation resets the reader's unread count;
+* profile/photo changes refresh the name and avatar on the entries that
+  show that user.
+
+``rebuild`` (and the ``rebuild_inbox`` command) recomputes entries from the
+chat store (run ``merge_chat_messages`` first so legacy ChatMessage rows are
+included).
+"""
+import base64
+import binascii
+import json
+import logging
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import InboxEntry, Like, Match, Message, UserPhoto, User
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 120
+
+
+def _preview(content):
+    content = ' '.join((content or '').split())
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def _avatar_path(user_id):
+    photo = (
+        UserPhoto.objects.filter(user_id=user_id)
+        .order_by('-is_avatar', 'upload_order')
+        .values_list('photo_url', flat=True)
+        .first()
+    )
+    return photo or ''
+
+
+def _summary(user_id):
+    name = User.objects.filter(id=user_id).values_list('first_name', flat=True).first() or ''
+    return {'other_user_name': name, 'other_user_photo': _avatar_path(user_id)}
+
+
+def _likes_by_liker(user1_id, user2_id):
+    return {
+        liker_id: like_id
+        for like_id, liker_id in Like.objects.filter(
+            liker_id__in=[user1_id, user2_id], liked_id__in=[user1_id, user2_id]
+        ).values_list('id', 'liker_id')
+    }
+
+
+def ensure_entries(match):
+    """Create both users' entries for ``match`` if missing."""
+    likes = _likes_by_liker(match.user1_id, match.user2_id)
+    entries = []
+    for owner_id, other_id in ((match.user1_id, match.user2_id), (match.user2_id, match.user1_id)):
+        entries.append(InboxEntry(
+            user_id=owner_id,
+            match_id=match.id,
+            like_id=likes.get(owner_id) or likes.get(other_id),
+            other_user_id=other_id,
+            last_activity_at=match.last_interaction_at or match.matched_at or timezone.now(),
+            is_active=match.is_active,
+            **_summary(other_id),
+        ))
+    InboxEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def _bump(match_id, sender_id, content, sent_at, unread_count):
+    updates = {
+        'last_message_preview': _preview(content),
+        'last_message_at': sent_at,
+        'last_message_sender_id': sender_id,
+        'last_activity_at': sent_at,
+        'unread_count': unread_count,
+    }
+    updated = InboxEntry.objects.filter(match_id=match_id).update(**updates)
+    if updated < 2:
+        # Matches created before the inbox existed get their entries lazily
+        match = Match.objects.filter(id=match_id).first()
+        if match is not None:
+            ensure_entries(match)
+            InboxEntry.objects.filter(match_id=match_id).update(**updates)
+
+
+def record_message(match_id, sender_id, content, sent_at):
+    """Bump both entries of ``match_id`` for a new message; one UPDATE for both rows."""
+    _bump(match_id, sender_id, content, sent_at, Case(
+        When(~Q(user_id=sender_id), then=F('unread_count') + 1),
+        default=F('unread_count'),
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def record_messages(match_id, messages):
+    """``record_message`` for several new messages of one conversation (oldest first), still one UPDATE."""
+    total = len(messages)
+    sent_by = Counter(message.sender_id for message in messages)
+    last = messages[-1]
+    _bump(match_id, last.sender_id, last.content, last.sent_at, Case(
+        *[When(user_id=sender_id, then=F('unread_count') + (total - sent)) for sender_id, sent in sent_by.items()],
+        default=F('unread_count') + total,
+        output_field=PositiveIntegerField(),
+    ))
+
+
+def mark_read(user_id, match):
+    """Mark everything the other user sent in ``match`` as read and zero ``user_id``'s unread count."""
+    now = timezone.now()
+    with transaction.atomic():
+        Message.objects.filter(match=match, read_at__isnull=True).exclude(sender_id=user_id).update(read_at=now)
+        InboxEntry.objects.filter(user_id=user_id, match=match).update(unread_count=0)
+
+
+def set_active(match):
+    InboxEntry.objects.filter(match=match).exclude(is_active=match.is_active).update(is_active=match.is_active)
+
+
+def refresh_user_summary(user_id):
+    """Re-denormalize ``user_id``'s name and avatar onto the entries that display them."""
+    InboxEntry.objects.filter(other_user_id=user_id).update(**_summary(user_id))
+
+
+def encode_cursor(entry):
+    """Opaque, URL-safe cursor for the page that ends at ``entry``."""
+    raw = json.dumps({'t': entry.last_activity_at.isoformat(), 'i': entry.id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (last_activity_at, entry_id) from an opaque cursor, or None if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        activity, entry_id = parse_datetime(data['t']), int(data['i'])
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeDecodeError):
+        return None
+    if activity is None:
+        return None
+    return activity, entry_id
+
+
+def _rebuild_match(match):
+    ensure_entries(match)
+    latest = None
+    if match.archived_at is None:
+        # Archived conversations keep the summary they had when they were archived
+        latest = Message.objects.filter(match=match).order_by('-sent_at', '-id').values_list('sender_id', 'content', 'sent_at').first()
+    for owner_id, other_id in ((match.user1_id, match.user2_id), (match.user2_id, match.user1_id)):
+        updates = {'is_active': match.is_active, **_summary(other_id)}
+        if latest:
+            sender_id, content, sent_at = latest
+            updates.update(
+                unread_count=Message.objects.filter(match=match, sender_id=other_id, read_at__isnull=True).count(),
+                last_message_preview=_preview(content),
+                last_message_at=sent_at,
+                last_message_sender_id=sender_id,
+                last_activity_at=sent_at,
+            )
+        InboxEntry.objects.filter(user_id=owner_id, match=match).update(**updates)
+
+
+def rebuild(user=None):
+    """Recompute inbox entries for every match (or only ``user``'s). Returns the number of matches."""
+    matches = Match.objects.all()
+    if user is not None:
+        matches = matches.filter(Q(user1=user) | Q(user2=user))
+    count = 0
+    for match in matches.iterator(chunk_size=500):
+        _rebuild_match(match)
+        count += 1
+    logger.info(f"Rebuilt inbox entries for {count} matches")
+    return count
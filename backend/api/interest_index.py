@@ -0,0 +1,129 @@
+"""
+Inverted index from interest to the users who have it, stored as bitmaps.
+
+Every user gets a dense ordinal (``UserOrdinal``) and every interest a bitmap
+(``InterestPosting``) with bit ``ordinal`` set for its members. "Who shares my
+interests" then unpacks the caller's few postings and sums them column-wise,
+instead of joining the interests through table once per candidate.
+Postings are kept in sync by ``m2m_changed`` on ``User.interests`` (see
+api/signals.py); ``rebuild_interest_index`` recreates them from scratch.
+"""
+import logging
+
+import numpy as np
+from django.db import transaction
+
+from .models import InterestPosting, User, UserOrdinal
+
+logger = logging.getLogger(__name__)
+
+
+def ordinals_for(user_ids):
+    """{str(user_id): ordinal}, assigning ordinals to users that do not have one yet."""
+    user_ids = {str(u) for u in user_ids}
+    if not user_ids:
+        return {}
+    ordinals = {str(u): o for u, o in UserOrdinal.objects.filter(user_id__in=user_ids).values_list('user_id', 'id')}
+    missing = user_ids - ordinals.keys()
+    if missing:
+        UserOrdinal.objects.bulk_create([UserOrdinal(user_id=u) for u in missing], ignore_conflicts=True)
+        ordinals.update(
+            (str(u), o) for u, o in UserOrdinal.objects.filter(user_id__in=missing).values_list('user_id', 'id')
+        )
+    return ordinals
+
+
+def _to_array(bits):
+    return np.frombuffer(bytes(bits or b''), dtype=np.uint8)
+
+
+def _set_bits(bits, ordinals, present):
+    array = _to_array(bits).copy()
+    ordinals = np.asarray(sorted(ordinals), dtype=np.int64)
+    if present and len(ordinals):
+        needed = int(ordinals[-1] >> 3) + 1
+        if needed > len(array):
+            array = np.concatenate([array, np.zeros(needed - len(array), dtype=np.uint8)])
+    ordinals = ordinals[(ordinals >> 3) < len(array)]
+    masks = np.left_shift(1, ordinals & 7).astype(np.uint8)
+    if present:
+        np.bitwise_or.at(array, ordinals >> 3, masks)
+    else:
+        np.bitwise_and.at(array, ordinals >> 3, ~masks)
+    return array
+
+
+def _update(interest_ids, user_ids, present):
+    ordinals = list(ordinals_for(user_ids).values())
+    if not ordinals or not interest_ids:
+        return
+    with transaction.atomic():
+        for interest_id in interest_ids:
+            posting, _ = InterestPosting.objects.select_for_update().get_or_create(interest_id=interest_id)
+            array = _set_bits(posting.bits, ordinals, present)
+            posting.bits = array.tobytes()
+            posting.member_count = int(np.unpackbits(array).sum())
+            posting.save(update_fields=['bits', 'member_count', 'updated_at'])
+
+
+def add(user_ids, interest_ids):
+    _update(interest_ids, user_ids, True)
+
+
+def remove(user_ids, interest_ids):
+    _update(interest_ids, user_ids, False)
+
+
+def rebuild():
+    """Recreate every posting from the interests through table."""
+    through = User.interests.through
+    pairs = list(through.objects.values_list('user_id', 'interest_id').iterator(chunk_size=5000))
+    ordinals = ordinals_for({user_id for user_id, _ in pairs})
+    members = {}
+    for user_id, interest_id in pairs:
+        members.setdefault(interest_id, []).append(ordinals[str(user_id)])
+    with transaction.atomic():
+        InterestPosting.objects.exclude(interest_id__in=members.keys()).delete()
+        for interest_id, interest_ordinals in members.items():
+            array = _set_bits(b'', interest_ordinals, True)
+            InterestPosting.objects.update_or_create(
+                interest_id=interest_id,
+                defaults={'bits': array.tobytes(), 'member_count': len(set(interest_ordinals))},
+            )
+    logger.info(f"Rebuilt interest index: {len(members)} interests, {len(ordinals)} users")
+    return len(members)
+
+
+def top_overlap(user, k):
+    """Up to ``k`` (user_id, shared_count) pairs for the users sharing the most interests with ``user``."""
+    interest_ids = list(user.interests.values_list('id', flat=True))
+    postings = [
+        _to_array(bits)
+        for bits in InterestPosting.objects.filter(interest_id__in=interest_ids).values_list('bits', flat=True)
+    ]
+    postings = [p for p in postings if len(p)]
+    if not postings:
+        return []
+
+    matrix = np.zeros((len(postings), max(len(p) for p in postings)), dtype=np.uint8)
+    for row, posting in enumerate(postings):
+        matrix[row, :len(posting)] = posting
+    counts = np.unpackbits(matrix, axis=1, bitorder='little').sum(axis=0, dtype=np.int32)
+
+    own = UserOrdinal.objects.filter(user=user).values_list('id', flat=True).first()
+    if own is not None and own < len(counts):
+        counts[own] = 0
+    candidates = int(np.count_nonzero(counts))
+    if candidates == 0:
+        return []
+    k = min(k, candidates)
+    top = np.argpartition(-counts, k - 1)[:k]
+    top = top[np.argsort(-counts[top], kind='stable')]
+
+    # Ordinals of deleted users have no row any more and drop out here
+    users_by_ordinal = dict(UserOrdinal.objects.filter(id__in=top.tolist()).values_list('id', 'user_id'))
+    return [
+        (str(users_by_ordinal[o]), int(counts[o]))
+        for o in top.tolist()
+        if o in users_by_ordinal
+    ]
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from api.models import UserWallet
+from payments import ledger
 
 User = get_user_model()
 
@@ -25,8 +26,7 @@ class Command(BaseCommand):
             wallet, created = UserWallet.objects.get_or_create(user=user)
             
             old_coins = wallet.coins
-            wallet.coins += coins
-            wallet.save()
+            ledger.transfer('demo_grant', (None, ledger.Code.COIN_ISSUE), (user.id, ledger.Code.APP_COINS), coins)
             
             self.stdout.write(
                 self.style.SUCCESS(
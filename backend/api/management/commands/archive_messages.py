@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import chat_store
+
+
+class Command(BaseCommand):
+    help = 'Move the messages of long-idle conversations into compressed monthly archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Idle days before archiving (default: CHAT_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many conversations')
+
+    def handle(self, *args, **options):
+        conversations, messages = chat_store.archive_inactive(days=options['days'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {messages} messages from {conversations} conversations'))
@@ -0,0 +1,117 @@
+import asyncio
+import random
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.channel_layers import BrokerChannelLayer, ChannelBroker
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark group_send fan-out on the channel layer: messages/sec and delivery latency '
+        'for user_<id> (one socket) and chat_<match_id> (two sockets) groups'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=['configured', 'memory', 'broker', 'redis'], default='configured')
+        parser.add_argument('--hosts', default='', help='Comma-separated hosts for broker/redis (default: CHANNEL_LAYER_HOSTS)')
+        parser.add_argument('--sockets', type=int, default=10000, help='Concurrent sockets (channels) to simulate')
+        parser.add_argument('--messages', type=int, default=20000, help='group_send calls per group type')
+        parser.add_argument('--concurrency', type=int, default=200, help='Concurrent senders')
+        parser.add_argument('--start-broker', action='store_true', help='Run a broker in-process (broker backend)')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    def make_layer(self, options, broker_port=None):
+        hosts = [h for h in options['hosts'].split(',') if h] or settings.CHANNEL_LAYER_HOSTS
+        backend = options['backend']
+        if backend == 'configured':
+            return get_channel_layer()
+        if backend == 'memory':
+            return InMemoryChannelLayer(capacity=settings.CHANNEL_LAYER_CAPACITY)
+        if backend == 'broker':
+            if broker_port is not None:
+                hosts = [f'127.0.0.1:{broker_port}']
+            return BrokerChannelLayer(hosts=hosts or None, capacity=settings.CHANNEL_LAYER_CAPACITY)
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            raise CommandError('channels_redis is not installed')
+        return RedisChannelLayer(hosts=hosts or ['redis://127.0.0.1:6379/0'], capacity=settings.CHANNEL_LAYER_CAPACITY)
+
+    async def run(self, options):
+        server = None
+        broker_port = None
+        if options['start_broker']:
+            server = await ChannelBroker().serve('127.0.0.1', 0)
+            broker_port = server.sockets[0].getsockname()[1]
+        layer = self.make_layer(options, broker_port)
+        if layer is None:
+            raise CommandError('No channel layer configured')
+
+        sockets = options['sockets']
+        channels = [await layer.new_channel() for _ in range(sockets)]
+        for i, channel in enumerate(channels):
+            await layer.group_add(f'user_{i}', channel)
+            await layer.group_add(f'chat_{i // 2}', channel)
+
+        latencies = []
+        state = {'expected': 0, 'done': asyncio.Event()}
+
+        async def socket(channel):
+            while True:
+                message = await layer.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+                if len(latencies) >= state['expected']:
+                    state['done'].set()
+
+        receivers = [asyncio.ensure_future(socket(channel)) for channel in channels]
+        try:
+            for label, groups, fanout in (
+                ('user_<id>', [f'user_{i}' for i in range(sockets)], 1),
+                ('chat_<match_id>', [f'chat_{i}' for i in range(sockets // 2)], 2),
+            ):
+                await self.bench(layer, label, groups, fanout, options, latencies, state)
+        finally:
+            for receiver in receivers:
+                receiver.cancel()
+            await layer.flush()
+            if hasattr(layer, 'close'):
+                await layer.close()
+            if server is not None:
+                server.close()
+
+    async def bench(self, layer, label, groups, fanout, options, latencies, state):
+        total = options['messages']
+        latencies.clear()
+        state['expected'] = total * fanout
+        state['done'].clear()
+        targets = [random.choice(groups) for _ in range(total)]
+
+        async def sender(chunk):
+            for group in chunk:
+                await layer.group_send(group, {'type': 'bench.message', 'sent': time.perf_counter()})
+
+        concurrency = max(1, options['concurrency'])
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(targets[i::concurrency]) for i in range(concurrency)))
+        try:
+            await asyncio.wait_for(state['done'].wait(), timeout=60)
+        except asyncio.TimeoutError:
+            self.stderr.write(f'{label}: timed out with {len(latencies)}/{state["expected"]} deliveries')
+        elapsed = time.perf_counter() - started
+
+        delivered = sorted(latencies)
+        if not delivered:
+            self.stderr.write(f'{label}: nothing delivered')
+            return
+        p50 = delivered[len(delivered) // 2] * 1000
+        p99 = delivered[min(len(delivered) - 1, int(len(delivered) * 0.99))] * 1000
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: {total} group_sends, {len(delivered)} deliveries to {options["sockets"]} sockets '
+            f'in {elapsed:.2f}s ({len(delivered) / elapsed:,.0f} msg/s), p50 {p50:.1f} ms, p99 {p99:.1f} ms'
+        ))
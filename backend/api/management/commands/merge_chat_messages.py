@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import chat_store
+
+
+class Command(BaseCommand):
+    help = 'Copy legacy ChatMessage rows into the unified Message store and number unsequenced messages (safe to re-run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = chat_store.merge_legacy(batch_size=options['batch_size'])
+        numbered = chat_store.assign_missing_seq()
+        self.stdout.write(self.style.SUCCESS(f'Merged {count} legacy chat messages, numbered {numbered} messages'))
@@ -0,0 +1,29 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api import inbox
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized inbox (InboxEntry) from matches and messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild the conversations of this user (id or username)')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            lookup = Q(username=options['user'])
+            try:
+                lookup |= Q(id=uuid.UUID(options['user']))
+            except ValueError:
+                pass
+            user = User.objects.filter(lookup).first()
+            if user is None:
+                self.stderr.write(self.style.ERROR(f"User {options['user']} not found"))
+                return
+        count = inbox.rebuild(user)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt inbox entries for {count} matches'))
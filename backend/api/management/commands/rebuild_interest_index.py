@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import interest_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the interest -> users bitmap index from User.interests'
+
+    def handle(self, *args, **options):
+        count = interest_index.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt postings for {count} interests'))
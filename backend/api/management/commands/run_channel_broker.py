@@ -0,0 +1,22 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api.channel_layers import ChannelBroker
+
+
+class Command(BaseCommand):
+    help = 'Run the pure-Python channel broker used by CHANNEL_LAYER_BACKEND=broker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6390)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.serve(options['host'], options['port']))
+
+    async def serve(self, host, port):
+        server = await ChannelBroker().serve(host, port)
+        self.stdout.write(self.style.SUCCESS(f'Channel broker listening on {host}:{port}'))
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.fake_chapa import FakeChapaServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake Chapa API (point CHAPA_BASE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before every response')
+
+    def handle(self, *args, **options):
+        server = FakeChapaServer(options['host'], options['port'], delay=options['delay'])
+        self.stdout.write(self.style.SUCCESS(f'Fake Chapa listening on {server.base_url}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
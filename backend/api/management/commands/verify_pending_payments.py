@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import payment_verification
+
+
+class Command(BaseCommand):
+    help = 'Retry verification of webhook-reported Chapa payments that never got a verdict (run via cron/scheduler)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None, help='Seconds since the webhook (default: CHAPA_VERIFY_SWEEP_AFTER)')
+        parser.add_argument('--max-attempts', type=int, default=None, help='Sweeps before giving up (default: CHAPA_VERIFY_MAX_ATTEMPTS)')
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        if older_than is None:
+            older_than = settings.CHAPA_VERIFY_SWEEP_AFTER
+        max_attempts = options['max_attempts'] or settings.CHAPA_VERIFY_MAX_ATTEMPTS
+        settled, dropped = payment_verification.sweep(timedelta(seconds=older_than), max_attempts)
+        self.stdout.write(self.style.SUCCESS(f'Settled {settled} pending payments, dropped {dropped}'))
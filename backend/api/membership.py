@@ -0,0 +1,82 @@
+"""
+Cached conversation membership for the chat endpoints and sockets.
+
+Every chat request starts by checking that the caller belongs to the
+conversation, which used to mean loading the Like, both users and the Match.
+``resolve`` answers that from the cache instead: conversation id (the Like
+id the REST endpoints use, or the Match id the socket uses) -> the Match id
+and the frozenset of its two participants' ids, kept for
+``CHAT_MEMBERSHIP_CACHE_TTL`` seconds.
+
+Only active conversations are cached, so a match formed or reactivated later
+is picked up on the next lookup. Unmatching (RemoveLikeView) deactivates the
+Match, and the signals in api/signals.py drop the entries under both Like
+ids and the Match id. Other workers only see that through a shared cache
+(``CACHE_URL``); with a process-local one an entry is kept for at most
+``LOCAL_CACHE_AUTH_TTL`` seconds (see api/cache_scope.py).
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from .models import Like, Match
+from . import cache_scope, pairs
+
+Conversation = namedtuple('Conversation', ['match_id', 'participants'])
+
+
+def _cache_key(conversation_id):
+    return f"chat_members:{conversation_id}"
+
+
+def _load(conversation_id):
+    try:
+        row = Match.objects.filter(id=conversation_id, is_active=True).values_list('id', 'user1_id', 'user2_id').first()
+        if row is None:
+            like = Like.objects.filter(id=conversation_id, status=Like.LikeStatus.MATCHED).values_list('liker_id', 'liked_id').first()
+            if like is None:
+                return None
+            user1_id, user2_id = pairs.order_pair(*like)
+            row = Match.objects.filter(user1_id=user1_id, user2_id=user2_id, is_active=True).values_list(
+                'id', 'user1_id', 'user2_id'
+            ).first()
+    except (ValidationError, ValueError):
+        return None
+    if row is None:
+        return None
+    match_id, user1_id, user2_id = row
+    return Conversation(str(match_id), frozenset((str(user1_id), str(user2_id))))
+
+
+def resolve(conversation_id):
+    """The active Conversation addressed by a Like or Match id, or None."""
+    key = _cache_key(conversation_id)
+    conversation = cache.get(key)
+    if conversation is None:
+        conversation = _load(conversation_id)
+        if conversation is not None:
+            cache.set(key, conversation, cache_scope.authorization_ttl(settings.CHAT_MEMBERSHIP_CACHE_TTL))
+    return conversation
+
+
+def conversation_for(conversation_id, user_id):
+    """The Conversation if ``user_id`` takes part in it, else None."""
+    conversation = resolve(conversation_id)
+    if conversation is None or str(user_id) not in conversation.participants:
+        return None
+    return conversation
+
+
+def invalidate_pair(user_a_id, user_b_id, match_id=None):
+    """Forget the pair's conversation under every id it can be addressed by."""
+    keys = [
+        _cache_key(like_id)
+        for like_id in Like.objects.filter(
+            liker_id__in=[user_a_id, user_b_id], liked_id__in=[user_a_id, user_b_id]
+        ).values_list('id', flat=True)
+    ]
+    if match_id is not None:
+        keys.append(_cache_key(match_id))
+    cache.delete_many(keys)
@@ -0,0 +1,120 @@
+"""
+Server-assigned, time-ordered 64-bit message ids.
+
+The chat socket broadcasts a message before it is written (see
+api/chat_writer.py), so its id cannot come from the database. Ids are
+generated in-process instead, snowflake style:
+
+    41 bits  milliseconds since 2020-01-01
+    10 bits  node id, unique among the running processes
+    12 bits  counter within the millisecond
+
+They sort by creation time, fit ``Message.id`` (a BigAutoField), and every
+writer of new messages uses them so they never collide with database
+sequence values.
+
+The node id is ``CHAT_NODE_ID`` when set (one per process). Otherwise each
+process leases a free one in the shared cache (``CACHE_URL``) for
+``CHAT_NODE_LEASE_TTL`` seconds and renews it while it keeps generating
+ids. Without a shared cache there is nothing to coordinate through, so the
+node id falls back to a hash of host name and pid, which is only safe for a
+single process; the chat store refuses a colliding id rather than drop the
+message (see api/chat_store.py).
+"""
+import binascii
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import cache_scope
+
+_EPOCH_MS = 1577836800000  # 2020-01-01T00:00:00Z
+_NODE_BITS = 10
+_COUNTER_BITS = 12
+
+
+def _default_node_id():
+    return binascii.crc32(f"{socket.gethostname()}:{os.getpid()}".encode()) % (1 << _NODE_BITS)
+
+
+def _lease_key(node_id):
+    return f"chat_node:{node_id}"
+
+
+class NodeLease:
+    """A node id held in the shared cache, renewed once half of ``CHAT_NODE_LEASE_TTL`` has passed."""
+
+    def __init__(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.node_id = None
+        self.renew_at = 0
+
+    def current(self):
+        """The leased node id; a lease lost meanwhile (e.g. the cache was flushed) is replaced."""
+        if time.monotonic() >= self.renew_at:
+            ttl = settings.CHAT_NODE_LEASE_TTL
+            if self.node_id is None or not self._renew(ttl):
+                self.node_id = self._acquire(ttl)
+            self.renew_at = time.monotonic() + ttl / 2
+        return self.node_id
+
+    def _acquire(self, ttl):
+        # Start from the hashed id so processes rarely probe the same keys
+        start = _default_node_id()
+        for offset in range(1 << _NODE_BITS):
+            node_id = (start + offset) % (1 << _NODE_BITS)
+            if cache.add(_lease_key(node_id), self.holder, ttl):
+                return node_id
+        raise RuntimeError('Every chat message node id is leased')
+
+    def _renew(self, ttl):
+        key = _lease_key(self.node_id)
+        return cache.get(key) == self.holder and cache.touch(key, ttl)
+
+
+class IdGenerator:
+    def __init__(self, node_id, lease=None):
+        self.node_id = node_id % (1 << _NODE_BITS)
+        self.lease = lease
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.last_ms = -1
+        self.counter = 0
+
+    def next_id(self):
+        with self.lock:
+            if self.lease is not None:
+                self.node_id = self.lease.current()
+            now = int(time.time() * 1000) - _EPOCH_MS
+            if now <= self.last_ms:
+                # Same millisecond, or the clock stepped back: keep counting from the last one
+                now = self.last_ms
+                self.counter = (self.counter + 1) % (1 << _COUNTER_BITS)
+                if self.counter == 0:
+                    now += 1
+            else:
+                self.counter = 0
+            self.last_ms = now
+            return (now << (_NODE_BITS + _COUNTER_BITS)) | (self.node_id << _COUNTER_BITS) | self.counter
+
+
+_generator = None
+
+
+def next_id():
+    global _generator
+    if _generator is None or _generator.pid != os.getpid():
+        # Forked workers must not share a node id with their parent
+        if settings.CHAT_NODE_ID is not None:
+            _generator = IdGenerator(settings.CHAT_NODE_ID)
+        elif cache_scope.is_shared():
+            lease = NodeLease()
+            _generator = IdGenerator(lease.current(), lease)
+        else:
+            _generator = IdGenerator(_default_node_id())
+    return _generator.next_id()
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_usersubaccount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoveryPool',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='discovery_pool', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('candidate_ids', models.JSONField(blank=True, default=list)),
+                ('removed_ids', models.JSONField(blank=True, default=list)),
+                ('filter_key', models.CharField(blank=True, default='', max_length=255)),
+                ('built_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
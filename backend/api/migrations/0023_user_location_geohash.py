@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:18
+
+from django.db import migrations, models
+
+
+def backfill_geohash(apps, schema_editor):
+    from api import geo
+
+    User = apps.get_model('api', 'User')
+    rows = (
+        User.objects.filter(location_latitude__isnull=False, location_longitude__isnull=False)
+        .values_list('id', 'location_latitude', 'location_longitude')
+        .iterator(chunk_size=2000)
+    )
+    batch = []
+    for user_id, lat, lon in rows:
+        batch.append(User(id=user_id, location_geohash=geo.encode(lat, lon)))
+        if len(batch) >= 2000:
+            User.objects.bulk_update(batch, ['location_geohash'])
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, ['location_geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_discoverypool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='location_geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
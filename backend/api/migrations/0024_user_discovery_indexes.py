@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_user_location_geohash'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['gender', 'date_of_birth'], name='api_user_gender_413b30_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['religion'], name='api_user_religio_c8a693_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['relationship_intent'], name='api_user_relatio_f814bb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['relationship_type'], name='api_user_relatio_d81560_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_user_discovery_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeenFilter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='seen_filter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bits', models.BinaryField()),
+                ('bit_count', models.PositiveIntegerField()),
+                ('hash_count', models.PositiveSmallIntegerField()),
+                ('capacity', models.PositiveIntegerField()),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
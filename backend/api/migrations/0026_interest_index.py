@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_postings(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    UserOrdinal = apps.get_model('api', 'UserOrdinal')
+    InterestPosting = apps.get_model('api', 'InterestPosting')
+    through = User.interests.through
+
+    pairs = list(through.objects.values_list('user_id', 'interest_id'))
+    UserOrdinal.objects.bulk_create([UserOrdinal(user_id=u) for u in {u for u, _ in pairs}])
+    ordinals = dict(UserOrdinal.objects.values_list('user_id', 'id'))
+    members = {}
+    for user_id, interest_id in pairs:
+        members.setdefault(interest_id, set()).add(ordinals[user_id])
+    postings = []
+    for interest_id, interest_ordinals in members.items():
+        bits = bytearray(max(interest_ordinals) // 8 + 1)
+        for ordinal in interest_ordinals:
+            bits[ordinal >> 3] |= 1 << (ordinal & 7)
+        postings.append(InterestPosting(interest_id=interest_id, bits=bytes(bits), member_count=len(interest_ordinals)))
+    InterestPosting.objects.bulk_create(postings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_seenfilter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterestPosting',
+            fields=[
+                ('interest', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='posting', serialize=False, to='api.interest')),
+                ('bits', models.BinaryField(default=bytes)),
+                ('member_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserOrdinal',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='index_ordinal', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(build_postings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_pair_states(apps, schema_editor):
+    Like = apps.get_model('api', 'Like')
+    Swipe = apps.get_model('api', 'Swipe')
+    Match = apps.get_model('api', 'Match')
+    PairState = apps.get_model('api', 'PairState')
+
+    flags = {}
+
+    def mark(liker_id, liked_id):
+        low, high = sorted([liker_id, liked_id], key=str)
+        state = flags.setdefault((low, high), [False, False])
+        state[0 if low == liker_id else 1] = True
+
+    for liker_id, liked_id in Like.objects.filter(status__in=['liked', 'matched']).values_list('liker_id', 'liked_id'):
+        mark(liker_id, liked_id)
+    for swiper_id, swiped_on_id in Swipe.objects.filter(swipe_type__in=['like', 'superlike']).values_list('swiper_id', 'swiped_on_id'):
+        mark(swiper_id, swiped_on_id)
+
+    matched_at = {(u1, u2): at for u1, u2, at in Match.objects.values_list('user1_id', 'user2_id', 'matched_at')}
+    now = timezone.now()
+    PairState.objects.bulk_create([
+        PairState(
+            user_low_id=low,
+            user_high_id=high,
+            low_likes_high=low_likes,
+            high_likes_low=high_likes,
+            matched_at=matched_at.get((low, high), now) if low_likes and high_likes else None,
+            updated_at=now,
+        )
+        for (low, high), (low_likes, high_likes) in flags.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_interest_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairState',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('low_likes_high', models.BooleanField(default=False)),
+                ('high_likes_low', models.BooleanField(default=False)),
+                ('matched_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pair_states_as_high', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pair_states_as_low', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_low', 'user_high'), name='unique_pair_state')],
+            },
+        ),
+        migrations.RunPython(backfill_pair_states, migrations.RunPython.noop),
+    ]
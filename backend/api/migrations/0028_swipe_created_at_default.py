@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_pairstate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='swipe',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
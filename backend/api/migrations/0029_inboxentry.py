@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_inbox(apps, schema_editor):
+    """Create both entries for every existing match; ``rebuild_inbox`` also folds in legacy ChatMessage rows."""
+    Match = apps.get_model('api', 'Match')
+    Like = apps.get_model('api', 'Like')
+    Message = apps.get_model('api', 'Message')
+    User = apps.get_model('api', 'User')
+    UserPhoto = apps.get_model('api', 'UserPhoto')
+    InboxEntry = apps.get_model('api', 'InboxEntry')
+
+    names = dict(User.objects.values_list('id', 'first_name'))
+    photos = {}
+    for user_id, photo in UserPhoto.objects.order_by('-is_avatar', 'upload_order').values_list('user_id', 'photo_url'):
+        photos.setdefault(user_id, photo)
+    likes = {(liker, liked): like_id for like_id, liker, liked in Like.objects.values_list('id', 'liker_id', 'liked_id')}
+
+    entries = []
+    for match in Match.objects.iterator(chunk_size=500):
+        last = Message.objects.filter(match_id=match.id).order_by('-sent_at', '-id').first()
+        unread = dict(
+            Message.objects.filter(match_id=match.id, read_at__isnull=True)
+            .order_by().values_list('sender_id').annotate(n=Count('id'))
+        )
+        for owner, other in ((match.user1_id, match.user2_id), (match.user2_id, match.user1_id)):
+            entries.append(InboxEntry(
+                user_id=owner,
+                match_id=match.id,
+                like_id=likes.get((owner, other)) or likes.get((other, owner)),
+                other_user_id=other,
+                other_user_name=names.get(other) or '',
+                other_user_photo=photos.get(other) or '',
+                last_message_preview=' '.join(last.content.split())[:120] if last else '',
+                last_message_at=last.sent_at if last else None,
+                last_message_sender_id=last.sender_id if last else None,
+                unread_count=unread.get(other, 0),
+                last_activity_at=(last.sent_at if last else None) or match.last_interaction_at or match.matched_at,
+                is_active=match.is_active,
+            ))
+    InboxEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_swipe_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('other_user_name', models.CharField(blank=True, default='', max_length=150)),
+                ('other_user_photo', models.CharField(blank=True, default='', max_length=512)),
+                ('last_message_preview', models.CharField(blank=True, default='', max_length=255)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_active', models.BooleanField(default=True)),
+                ('last_message_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('like', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.like')),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='api.match')),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'is_active', '-last_activity_at'], name='inbox_user_activity_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'match'), name='unique_inbox_entry')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_inboxentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['match', 'timestamp', 'id'], name='chatmessage_match_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['match', 'sent_at', 'id'], name='message_match_sent_idx'),
+        ),
+    ]
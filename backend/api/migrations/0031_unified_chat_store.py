@@ -0,0 +1,146 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models, transaction
+from django.db.models import Max
+
+
+BATCH_SIZE = 1000
+
+
+def _number_unsequenced(Match, Message, match_id):
+    # Continues after the highest seq already in the conversation, a batch at a time
+    last = Message.objects.filter(match_id=match_id).aggregate(m=Max('seq'))['m'] or 0
+    while True:
+        rows = list(Message.objects.filter(match_id=match_id, seq__isnull=True).order_by('sent_at', 'id')[:BATCH_SIZE])
+        if not rows:
+            break
+        for row in rows:
+            last += 1
+            row.seq = last
+        Message.objects.bulk_update(rows, ['seq'])
+    Match.objects.filter(id=match_id).update(last_seq=last)
+
+
+def merge_chat_messages(apps, schema_editor):
+    """Number existing messages per conversation and copy ChatMessage rows in.
+
+    Walks one conversation at a time (ChatMessage by its like, then the
+    unnumbered Message rows by match) and writes in batches, each conversation
+    in its own transaction, so memory stays bounded and the tables stay
+    writable;
+    ``merge_chat_messages`` picks up anything written by old app servers
+    afterwards.
+    """
+    Match = apps.get_model('api', 'Match')
+    Message = apps.get_model('api', 'Message')
+    ChatMessage = apps.get_model('api', 'ChatMessage')
+    Like = apps.get_model('api', 'Like')
+
+    like_id = None
+    while True:
+        remaining = ChatMessage.objects.order_by('match_id')
+        if like_id is not None:
+            remaining = remaining.filter(match_id__gt=like_id)
+        like_id = remaining.values_list('match_id', flat=True).first()
+        if like_id is None:
+            break
+        liker_id, liked_id = Like.objects.values_list('liker_id', 'liked_id').get(id=like_id)
+        user1_id, user2_id = sorted((liker_id, liked_id), key=str)
+        with transaction.atomic():
+            match_id = Match.objects.filter(user1_id=user1_id, user2_id=user2_id).values_list('id', flat=True).first()
+            if match_id is None:
+                match_id = Match.objects.create(user1_id=user1_id, user2_id=user2_id).id
+            chats = ChatMessage.objects.filter(match_id=like_id).order_by('timestamp', 'id')
+            after = None
+            while True:
+                page = chats if after is None else chats.filter(
+                    models.Q(timestamp__gt=after[0]) | models.Q(timestamp=after[0], id__gt=after[1])
+                )
+                batch = list(page[:BATCH_SIZE])
+                if not batch:
+                    break
+                after = (batch[-1].timestamp, batch[-1].id)
+                Message.objects.bulk_create([
+                    Message(
+                        match_id=match_id,
+                        sender_id=chat.sender_id,
+                        content=chat.content,
+                        sent_at=chat.timestamp,
+                        read_at=chat.timestamp if chat.is_read else None,
+                        legacy_chat_id=chat.id,
+                    )
+                    for chat in batch
+                ], ignore_conflicts=True)
+
+    # Numbered once every like's rows are in, so a conversation is in time order
+    while True:
+        match_id = Message.objects.filter(seq__isnull=True).order_by('match_id').values_list('match_id', flat=True).first()
+        if match_id is None:
+            break
+        with transaction.atomic():
+            _number_unsequenced(Match, Message, match_id)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0030_message_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('bucket', models.DateField()),
+                ('first_seq', models.PositiveBigIntegerField()),
+                ('last_seq', models.PositiveBigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('payload', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='legacy_chat_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sent_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('match', 'seq'), name='unique_message_seq'),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='match',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_archives', to='api.match'),
+        ),
+        migrations.AddConstraint(
+            model_name='messagearchive',
+            constraint=models.UniqueConstraint(fields=('match', 'bucket'), name='unique_message_archive_bucket'),
+        ),
+        migrations.RunPython(merge_chat_messages, migrations.RunPython.noop),
+    ]
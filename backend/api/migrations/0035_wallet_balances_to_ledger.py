@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_notification_outbox'),
+        ('payments', '0002_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='usersubaccount',
+            name='total_earnings_etb',
+        ),
+        migrations.RemoveField(
+            model_name='usersubaccount',
+            name='total_withdrawn_etb',
+        ),
+        migrations.RemoveField(
+            model_name='userwallet',
+            name='coins',
+        ),
+        migrations.RemoveField(
+            model_name='userwallet',
+            name='total_earned',
+        ),
+        migrations.RemoveField(
+            model_name='userwallet',
+            name='total_spent',
+        ),
+    ]
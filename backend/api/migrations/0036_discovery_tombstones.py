@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_removed_ids(apps, schema_editor):
+    DiscoveryPool = apps.get_model('api', 'DiscoveryPool')
+    DiscoveryTombstone = apps.get_model('api', 'DiscoveryTombstone')
+    for user_id, removed_ids in DiscoveryPool.objects.values_list('user_id', 'removed_ids').iterator():
+        DiscoveryTombstone.objects.bulk_create(
+            [DiscoveryTombstone(user_id=user_id, candidate_id=str(candidate_id)) for candidate_id in removed_ids or []],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_wallet_balances_to_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoveryTombstone',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('candidate_id', models.CharField(max_length=36)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discovery_tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'candidate_id'), name='unique_discovery_tombstone')],
+            },
+        ),
+        migrations.RunPython(copy_removed_ids, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='discoverypool',
+            name='removed_ids',
+        ),
+    ]
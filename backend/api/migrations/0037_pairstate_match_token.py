@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0036_discovery_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pairstate',
+            name='match_token',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0037_pairstate_match_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discoverytombstone',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_discoverytombstone_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingVerification',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('tx_ref', models.CharField(max_length=100, unique=True)),
+                ('kind', models.CharField(choices=[('premium', 'Premium'), ('coins', 'Coin purchase'), ('subscription', 'Subscription')], max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,8 +1,10 @@
 from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
+from django.utils.functional import cached_property
 import uuid
 from django.contrib.auth.models import AbstractUser # If you want to extend the default user
+from . import geo, message_ids
 
 # Use JSONField for list-like fields across environments for migration consistency
 ArrayField = models.JSONField
@@ -40,6 +42,8 @@ class User(AbstractUser): # Extending Django's User
     # Location - can be more detailed if needed (e.g., separate model or GeoDjango fields)
     location_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Derived from the coordinates on save; indexed for radius searches (see api/geo.py)
+    location_geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
     country = models.CharField(max_length=100, null=True, blank=True)
     city = models.CharField(max_length=100, null=True, blank=True)
 
@@ -113,6 +117,10 @@ class User(AbstractUser): # Extending Django's User
     created_at = models.DateTimeField(auto_now_add=True)
     terms_accepted_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Last time a socket of this user was seen alive (see api/presence.py)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+    # Last sequence number handed out in this user's notification outbox (see api/notifications.py)
+    notification_seq = models.PositiveBigIntegerField(default=0, editable=False)
 
     # Subscription perks
     has_boost = models.BooleanField(default=False)
@@ -125,9 +133,28 @@ class User(AbstractUser): # Extending Django's User
     # To use this custom user model, you need to set AUTH_USER_MODEL in settings.py
     # AUTH_USER_MODEL = 'api.User'
 
+    class Meta(AbstractUser.Meta):
+        # Columns compiled into the discovery predicate (see api/preference_filter.py)
+        indexes = [
+            models.Index(fields=['gender', 'date_of_birth']),
+            models.Index(fields=['religion']),
+            models.Index(fields=['relationship_intent']),
+            models.Index(fields=['relationship_type']),
+        ]
+
     def __str__(self):
         return self.username # or self.email
 
+    def save(self, *args, **kwargs):
+        if self.location_latitude is not None and self.location_longitude is not None:
+            self.location_geohash = geo.encode(self.location_latitude, self.location_longitude)
+        else:
+            self.location_geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'location_latitude', 'location_longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'location_geohash'}
+        super().save(*args, **kwargs)
+
     def update_profile_completeness_score(self):
         """Calculates and updates the profile completeness score."""
         # Compute based on filled fields
@@ -300,54 +327,31 @@ class Like(models.Model):
         return f"{self.liker.username} {self.status} {self.liked.username}"
 
     def check_for_mutual_match(self):
-        """Check if this like creates a mutual match and create Match if so"""
+        """Record this like in the pair state and create the Match if the pair is now mutual.
+
+        Returns ``(like, became_mutual)``: this like (now matched) or None if the
+        pair is not mutual, and whether this like is what made it mutual.
+        """
         import logging
-        logging.info(f"Checking mutual match for {self.liker.first_name} -> {self.liked.first_name}")
-        logging.info(f"Current like status: {self.status}")
-        
+        from . import pairs
+        logging.info(f"Checking mutual match for {self.liker_id} -> {self.liked_id}")
+
         if self.status != self.LikeStatus.LIKED:
             logging.info("Current like is not LIKED status, returning None")
-            return None
-        
-        # Check if the liked user also liked back
-        mutual_like = Like.objects.filter(
-            liker=self.liked,
-            liked=self.liker,
-            status=self.LikeStatus.LIKED
-        ).first()
-        
-        logging.info(f"Looking for mutual like: {self.liked.first_name} -> {self.liker.first_name}")
-        logging.info(f"Mutual like found: {mutual_like}")
-        
-        if mutual_like:
-            logging.info("Mutual like found! Creating match...")
-            # Create match
-            user1, user2 = sorted([self.liker, self.liked], key=lambda u: str(u.id))
-            match, created = Match.objects.get_or_create(
-                user1=user1,
-                user2=user2,
-                defaults={'matched_at': timezone.now()}
-            )
-            
-            logging.info(f"Match created: {created}, Match ID: {match.id if match else 'None'}")
-            
-            # Update both likes to matched status (regardless of whether match was just created)
-            if self.status != self.LikeStatus.MATCHED:
-                self.status = self.LikeStatus.MATCHED
-                self.save(update_fields=['status', 'updated_at'])
-                logging.info(f"Updated current like {self.id} to MATCHED status")
-            
-            if mutual_like.status != self.LikeStatus.MATCHED:
-                mutual_like.status = self.LikeStatus.MATCHED
-                mutual_like.save(update_fields=['status', 'updated_at'])
-                logging.info(f"Updated mutual like {mutual_like.id} to MATCHED status")
-            
-            logging.info("Both likes are now MATCHED status")
-            # Return the current like object (which is now matched)
-            return self
-        else:
+            return None, False
+
+        # One atomic upsert both records the like and tells us whether the other side likes back
+        is_mutual, became_mutual = pairs.set_like(self.liker_id, self.liked_id)
+        if not is_mutual:
             logging.info("No mutual like found")
-        return None
+            return None, False
+
+        # Also when the pair was already mutual (e.g. matched by swipes): create_match is
+        # idempotent and is what stores this Like as matched
+        match, created = pairs.create_match(self.liker_id, self.liked_id)
+        logging.info(f"Match created: {created}, Match ID: {match.id}, completed by this like: {became_mutual}")
+        self.status = self.LikeStatus.MATCHED
+        return self, became_mutual
 
 class Swipe(models.Model):
     class SwipeType(models.TextChoices):
@@ -360,7 +364,8 @@ class Swipe(models.Model):
     swiper = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='swipes_made', on_delete=models.CASCADE)
     swiped_on = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='swipes_received', on_delete=models.CASCADE)
     swipe_type = models.CharField(max_length=10, choices=SwipeType.choices, default=SwipeType.LIKE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add so batch ingestion can keep the client's swipe order (see SwipeBatchView)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         unique_together = ('swiper', 'swiped_on') # A user can only swipe once on another user
@@ -377,6 +382,10 @@ class Match(models.Model):
     matched_at = models.DateTimeField(auto_now_add=True)
     last_interaction_at = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    # Highest Message.seq handed out in this conversation
+    last_seq = models.PositiveBigIntegerField(default=0)
+    # Set while the conversation's messages live in MessageArchive (see api/chat_store.py)
+    archived_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('user1', 'user2') # Ensure unique pairs
@@ -389,23 +398,252 @@ class Match(models.Model):
         """Get the other user in this match"""
         return self.user2 if self.user1 == current_user else self.user1
 
+    @classmethod
+    def allocate_seq(cls, match_id, count=1):
+        """Reserve ``count`` consecutive sequence numbers in a conversation; returns the first.
+
+        The UPDATE row-locks the match until the surrounding transaction ends,
+        so concurrent senders get distinct, increasing numbers.
+        """
+        with transaction.atomic():
+            cls.objects.filter(id=match_id).update(last_seq=models.F('last_seq') + count)
+            last_seq = cls.objects.filter(id=match_id).values_list('last_seq', flat=True).get()
+        return last_seq - count + 1
+
+
+class PairState(models.Model):
+    """Canonical like state for an unordered pair of users.
+
+    Keyed by the ordered (user_low, user_high) pair (by string UUID, the same
+    order Match uses for user1/user2) and carrying both directions' like flags,
+    so a like is one atomic upsert that also reports whether the pair just
+    became mutual (see api/pairs.py). matched_at and match_token are set by
+    that upsert.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user_low = models.ForeignKey(User, related_name='pair_states_as_low', on_delete=models.CASCADE)
+    user_high = models.ForeignKey(User, related_name='pair_states_as_high', on_delete=models.CASCADE)
+    low_likes_high = models.BooleanField(default=False)
+    high_likes_low = models.BooleanField(default=False)
+    matched_at = models.DateTimeField(null=True, blank=True)
+    # Token of the upsert that made the pair mutual: that statement reads its own token back
+    match_token = models.UUIDField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_pair_state'),
+        ]
+
+    def __str__(self):
+        return f"Pair {self.user_low_id}/{self.user_high_id} ({self.low_likes_high}, {self.high_likes_low})"
+
+
+class DiscoveryPool(models.Model):
+    """Precomputed discovery candidates for a user.
+
+    candidate_ids is a ranked list of eligible user IDs (boosted users first),
+    built once and sliced page by page. Swipes don't rewrite the list; the swiped
+    ID gets a DiscoveryTombstone row so page offsets stay stable until the next rebuild.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='discovery_pool')
+    candidate_ids = models.JSONField(default=list, blank=True)
+    # Normalized discovery filters the pool was built with; a mismatch forces a rebuild
+    filter_key = models.CharField(max_length=255, blank=True, default='')
+    built_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Discovery pool for {self.user_id} ({len(self.candidate_ids)} candidates)"
+
+
+class DiscoveryTombstone(models.Model):
+    """A candidate swiped away from a user's discovery pool since it was built.
+
+    One row per swipe, inserted with ON CONFLICT DO NOTHING, so concurrent
+    swipes never overwrite each other and a swipe never reads the pool. A
+    rebuild deletes the rows written before it loaded the seen filter.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='discovery_tombstones')
+    candidate_id = models.CharField(max_length=36)  # str(User.id), as stored in DiscoveryPool.candidate_ids
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'candidate_id'], name='unique_discovery_tombstone'),
+        ]
+
+    def __str__(self):
+        return f"Tombstone {self.candidate_id} in {self.user_id}'s pool"
+
+
+class SeenFilter(models.Model):
+    """Bloom filter of the user IDs a user has already swiped on or liked.
+
+    Discovery drops candidates found here in memory instead of excluding the
+    whole swipe history in SQL. Bloom filters cannot forget, so undoing a
+    swipe deletes the row and it is rebuilt from history on next use.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='seen_filter')
+    bits = models.BinaryField()
+    bit_count = models.PositiveIntegerField()
+    hash_count = models.PositiveSmallIntegerField()
+    # Keys the filter was sized for, and keys added so far; past capacity it is rebuilt larger
+    capacity = models.PositiveIntegerField()
+    item_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Seen filter for {self.user_id} ({self.item_count}/{self.capacity})"
+
+
+class UserOrdinal(models.Model):
+    """Dense integer ID for a user, used as the bit position in interest bitmaps.
+
+    User primary keys are UUIDs, which cannot index a bitset; the auto-increment
+    id of this table can.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='index_ordinal')
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.id}"
+
+
+class InterestPosting(models.Model):
+    """Inverted index entry: bitmap of the UserOrdinal ids of users who have an interest.
+
+    Kept in sync with User.interests by m2m_changed signals (see api/interest_index.py).
+    """
+    interest = models.OneToOneField(Interest, on_delete=models.CASCADE, primary_key=True, related_name='posting')
+    bits = models.BinaryField(default=bytes)
+    member_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Posting for interest {self.interest_id} ({self.member_count} users)"
+
 
 class Message(models.Model):
+    """The chat store: every message of every conversation, append-only, keyed by Match."""
     id = models.BigAutoField(primary_key=True)
     match = models.ForeignKey(Match, related_name='messages', on_delete=models.CASCADE)
+    # Position in the conversation, 1, 2, 3, ... (see Match.allocate_seq)
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
     sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
     # receiver is implicitly the other user in the match
     content = models.TextField()
-    sent_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(default=timezone.now, editable=False)
     read_at = models.DateTimeField(null=True, blank=True)
+    # Id of the ChatMessage this row was merged from (see merge_chat_messages)
+    legacy_chat_id = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    # Sender-chosen id the chat socket uses to retry unacknowledged sends (see api/chat_writer.py)
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['sent_at']
+        indexes = [
+            # Keyset paging of a conversation's history (see api/history.py)
+            models.Index(fields=['match', 'sent_at', 'id'], name='message_match_sent_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['match', 'seq'], name='unique_message_seq'),
+            models.UniqueConstraint(fields=['sender', 'client_msg_id'], name='unique_message_client_id'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            if self.id is None:
+                self.id = message_ids.next_id()
+            if self.seq is None:
+                self.seq = Match.allocate_seq(self.match_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username} in match {self.match.id}"
 
 
+class MessageArchive(models.Model):
+    """One month of an archived conversation's messages, compressed.
+
+    Long-idle conversations are moved out of the Message table in monthly
+    buckets by ``archive_messages`` and restored transparently when opened
+    again (see api/chat_store.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    match = models.ForeignKey(Match, related_name='message_archives', on_delete=models.CASCADE)
+    bucket = models.DateField()  # first day of the month the messages were sent in
+    first_seq = models.PositiveBigIntegerField()
+    last_seq = models.PositiveBigIntegerField()
+    message_count = models.PositiveIntegerField()
+    payload = models.BinaryField()  # zlib-compressed JSON list of message rows
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['match', 'bucket'], name='unique_message_archive_bucket'),
+        ]
+
+    def __str__(self):
+        return f"Archive of match {self.match_id} for {self.bucket:%Y-%m} ({self.message_count} messages)"
+
+
+class InboxEntry(models.Model):
+    """One row per (user, match): the user's chat list, denormalized.
+
+    Holds the other user's summary, the last message and the unread count, so
+    the inbox is a single indexed range scan ordered by last activity. Kept up
+    to date on match creation, message send and read (see api/inbox.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, related_name='inbox_entries', on_delete=models.CASCADE)
+    match = models.ForeignKey(Match, related_name='inbox_entries', on_delete=models.CASCADE)
+    # The Like id chat endpoints address this conversation by (the user's own like when present)
+    like = models.ForeignKey(Like, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    other_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    other_user_name = models.CharField(max_length=150, blank=True, default='')
+    other_user_photo = models.CharField(max_length=512, blank=True, default='')
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_sender = models.ForeignKey(User, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'match'], name='unique_inbox_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'is_active', '-last_activity_at'], name='inbox_user_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"Inbox entry for {self.user_id} in match {self.match_id} ({self.unread_count} unread)"
+
+
+class NotificationOutbox(models.Model):
+    """A notification for one user, numbered per user so a reconnecting socket can resume.
+
+    The latest ``NOTIFICATION_OUTBOX_SIZE`` per user are kept (older ones are
+    trimmed periodically), and rows are deleted once the client acknowledges
+    them (see api/notifications.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, related_name='notifications_outbox', on_delete=models.CASCADE)
+    seq = models.PositiveBigIntegerField()
+    event = models.JSONField()  # the message the socket sends, e.g. {"type": "match_notification", ...}
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='unique_notification_seq'),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.seq} for {self.user_id}: {self.event.get('type')}"
+
+
 class ChatbotConversation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='chatbot_conversations', on_delete=models.CASCADE)
@@ -451,6 +689,9 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['match', 'timestamp', 'id'], name='chatmessage_match_ts_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.first_name} at {self.timestamp}"
@@ -479,18 +720,68 @@ class CoinPackage(models.Model):
         return self.coins + self.bonus_coins
 
 
+def _ledger_balances(user_ids, codes):
+    """{(user_id, code): balance} in one query.
+
+    The ledger is imported here, not at module level: payments.models builds
+    on the user model defined in this module.
+    """
+    from payments import ledger
+
+    return ledger.balances(list(user_ids), codes)
+
+
+def _ledger_balance(user_id, code):
+    return _ledger_balances([user_id], [code])[(user_id, code)]
+
+
 class UserWallet(models.Model):
-    """User's coin wallet"""
+    """User's coin wallet; the balances are ledger accounts (see payments/ledger.py)"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='coin_wallet')
-    coins = models.IntegerField(default=0)
-    total_spent = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Total ETB spent
-    total_earned = models.DecimalField(max_digits=12, decimal_places=2, default=0)  # Total ETB earned from gifts
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    LEDGER_CODES = ('app_coins', 'app_spent', 'gift_earnings')
     
     def __str__(self):
         return f"{self.user.username}'s wallet - {self.coins} coins"
 
+    @property
+    def coins(self):
+        return int(_ledger_balance(self.user_id, 'app_coins'))
+
+    @property
+    def total_spent(self):
+        """Total ETB spent"""
+        return _ledger_balance(self.user_id, 'app_spent')
+
+    @property
+    def total_earned(self):
+        """Total ETB earned from gifts"""
+        return _ledger_balance(self.user_id, 'gift_earnings')
+
+    @staticmethod
+    def _from_ledger(found, user_id):
+        return {
+            'coins': int(found[(user_id, 'app_coins')]),
+            'total_spent': found[(user_id, 'app_spent')],
+            'total_earned': found[(user_id, 'gift_earnings')],
+        }
+
+    @cached_property
+    def ledger_balances(self):
+        """coins / total_spent / total_earned from one query, read once (the properties above re-read)."""
+        return self._from_ledger(_ledger_balances([self.user_id], self.LEDGER_CODES), self.user_id)
+
+    @classmethod
+    def prefetch_ledger_balances(cls, wallets):
+        """Set ``ledger_balances`` on every wallet in ``wallets`` from one query."""
+        wallets = list(wallets)
+        found = _ledger_balances({wallet.user_id for wallet in wallets}, cls.LEDGER_CODES)
+        for wallet in wallets:
+            wallet.ledger_balances = cls._from_ledger(found, wallet.user_id)
+        return wallets
+
 
 class CoinPurchase(models.Model):
     """Records of coin purchases - payment provider to be integrated"""
@@ -559,6 +850,28 @@ class SubscriptionPurchase(models.Model):
         return f"{self.user.username} - {self.plan_name} for {self.amount_etb} ETB"
 
 
+class PendingVerification(models.Model):
+    """A Chapa payment a webhook reported, until its verification reaches a verdict.
+
+    Written before the webhook is acknowledged, so a worker that dies while
+    verifying in the background leaves the row behind; ``manage.py
+    verify_pending_payments`` retries those (see api/payment_verification.py).
+    """
+    KIND_CHOICES = [
+        ('premium', 'Premium'),
+        ('coins', 'Coin purchase'),
+        ('subscription', 'Subscription'),
+    ]
+    id = models.BigAutoField(primary_key=True)
+    tx_ref = models.CharField(max_length=100, unique=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Pending {self.kind} verification of {self.tx_ref} ({self.attempts} attempts)"
+
+
 class UserSubaccount(models.Model):
     """Chapa subaccount for receiving gift earnings"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -579,10 +892,6 @@ class UserSubaccount(models.Model):
     is_active = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
     
-    # Earnings tracking
-    total_earnings_etb = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
-    total_withdrawn_etb = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
-    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -592,10 +901,45 @@ class UserSubaccount(models.Model):
     def __str__(self):
         return f"{self.user.username}'s subaccount - {self.bank_name}"
     
+    # Earnings tracking (ledger accounts)
+    LEDGER_CODES = ('gift_earnings', 'withdrawn')
+
+    @property
+    def total_earnings_etb(self):
+        return _ledger_balance(self.user_id, 'gift_earnings')
+
+    @property
+    def total_withdrawn_etb(self):
+        return _ledger_balance(self.user_id, 'withdrawn')
+
     @property
     def available_balance(self):
         """Calculate available balance for withdrawal"""
-        return self.total_earnings_etb - self.total_withdrawn_etb
+        balances = self._from_ledger(_ledger_balances([self.user_id], self.LEDGER_CODES), self.user_id)
+        return balances['available_balance']
+
+    @staticmethod
+    def _from_ledger(found, user_id):
+        earned, withdrawn = found[(user_id, 'gift_earnings')], found[(user_id, 'withdrawn')]
+        return {
+            'total_earnings_etb': earned,
+            'total_withdrawn_etb': withdrawn,
+            'available_balance': earned - withdrawn,
+        }
+
+    @cached_property
+    def ledger_balances(self):
+        """total_earnings_etb / total_withdrawn_etb / available_balance from one query, read once."""
+        return self._from_ledger(_ledger_balances([self.user_id], self.LEDGER_CODES), self.user_id)
+
+    @classmethod
+    def prefetch_ledger_balances(cls, subaccounts):
+        """Set ``ledger_balances`` on every subaccount in ``subaccounts`` from one query."""
+        subaccounts = list(subaccounts)
+        found = _ledger_balances({subaccount.user_id for subaccount in subaccounts}, cls.LEDGER_CODES)
+        for subaccount in subaccounts:
+            subaccount.ledger_balances = cls._from_ledger(found, subaccount.user_id)
+        return subaccounts
 
 
 class GiftType(models.Model):
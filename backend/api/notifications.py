@@ -0,0 +1,72 @@
+"""
+Per-user notification outbox with replay on reconnect.
+
+Notifications used to be a best-effort ``group_send`` to ``user_<id>``, so
+anything sent while the app was closed or between reconnects was lost and
+the client polled PeopleWhoLikeMeView / MyMatchesView to catch up. Now
+``publish`` first stores the event as a ``NotificationOutbox`` row with the
+user's next sequence number and pushes it to the live socket after commit
+(through the event bus, api/events.py).
+
+The socket (``MatchNotificationConsumer``) tags every event with its ``seq``
+and sends them in order: a push that arrives ahead of an earlier one makes
+it replay the gap from the outbox first. The client acknowledges with
+``{"type": "ack", "seq": n}``, which deletes rows up to ``n`` (at most up
+to what that socket delivered), and reconnects with ``?since=<last seq>``
+(``0`` for everything still stored) to get everything newer replayed before
+live events. The outbox keeps the latest ``NOTIFICATION_OUTBOX_SIZE`` events
+per user; older ones are trimmed once every ``NOTIFICATION_OUTBOX_TRIM_EVERY``
+seqs rather than on each publish. A client that was away longer than that
+gets ``resync_required`` and refreshes once over REST.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import events
+from .models import NotificationOutbox, User
+
+
+def publish(user_id, event):
+    """Store ``event`` (a dict with a ``type``) in ``user_id``'s outbox and push it after commit; returns its seq."""
+    return publish_many(user_id, [event])[-1]
+
+
+def publish_many(user_id, items):
+    """``publish`` for several events at once: one seq allocation, one INSERT and one group message. Returns the seqs."""
+    count = len(items)
+    with transaction.atomic():
+        # Row-locks the user until commit, so seqs commit in order
+        User.objects.filter(id=user_id).update(notification_seq=F('notification_seq') + count)
+        last_seq = User.objects.filter(id=user_id).values_list('notification_seq', flat=True).get()
+        seqs = list(range(last_seq - count + 1, last_seq + 1))
+        NotificationOutbox.objects.bulk_create([
+            NotificationOutbox(user_id=user_id, seq=seq, event=event) for seq, event in zip(seqs, items)
+        ])
+        every = settings.NOTIFICATION_OUTBOX_TRIM_EVERY
+        if last_seq // every != (last_seq - count) // every:
+            NotificationOutbox.objects.filter(user_id=user_id, seq__lte=last_seq - settings.NOTIFICATION_OUTBOX_SIZE).delete()
+        # Already stored: if the push fails the client gets them on its next resume
+        events.send_on_commit({user_id: [{**event, 'seq': seq} for seq, event in zip(seqs, items)]})
+    return seqs
+
+
+def pending(user_id, since=None):
+    """Stored events after ``since`` as [(seq, event)], oldest first, and whether some were already dropped."""
+    rows = NotificationOutbox.objects.filter(user_id=user_id)
+    if since is not None:
+        rows = rows.filter(seq__gt=since)
+    stored = list(rows.order_by('seq').values_list('seq', 'event'))
+    missed = False
+    if since is not None:
+        if stored:
+            missed = stored[0][0] > since + 1
+        else:
+            # Everything after ``since`` may have been trimmed away
+            missed = User.objects.filter(id=user_id, notification_seq__gt=since).exists()
+    return stored, missed
+
+
+def acknowledge(user_id, seq):
+    """The client has everything up to ``seq``; drop it."""
+    return NotificationOutbox.objects.filter(user_id=user_id, seq__lte=seq).delete()[0]
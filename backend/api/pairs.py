@@ -0,0 +1,210 @@
+"""
+Pair state: one row per unordered pair of users carrying both like flags.
+
+``set_like``/``set_likes`` record one direction of a like as a single
+``INSERT ... ON CONFLICT DO UPDATE ... RETURNING`` statement. The database
+row lock on the pair serializes concurrent likes, so exactly one of two
+crossing likes observes "became mutual" and creates the Match, without a
+reverse lookup query first: the statement that sets ``matched_at`` also
+stores a token of its own, and only that statement gets its token back.
+"""
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import InboxEntry, Like, Match, PairState
+from . import inbox
+
+
+def order_pair(user_a_id, user_b_id):
+    """(low, high) in the order Match stores user1/user2."""
+    return (user_a_id, user_b_id) if str(user_a_id) < str(user_b_id) else (user_b_id, user_a_id)
+
+
+def _columns(liker_id, liked_id):
+    low, high = order_pair(liker_id, liked_id)
+    if str(low) == str(liker_id):
+        return low, high, 'low_likes_high', 'high_likes_low'
+    return low, high, 'high_likes_low', 'low_likes_high'
+
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+def _upsert_likes(liker_id, liked_ids, own, other, now, token):
+    """One upsert setting ``own`` on every (liker, liked) pair; all pairs share the same orientation.
+
+    A pair this statement makes mutual gets ``matched_at = now`` and ``match_token = token``.
+    """
+    qn = connection.ops.quote_name
+    table = qn(PairState._meta.db_table)
+    own_col, other_col, matched_col, token_col = qn(own), qn(other), qn('matched_at'), qn('match_token')
+    user_field = PairState._meta.get_field('user_low')
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    token = PairState._meta.get_field('match_token').get_db_prep_value(token, connection)
+
+    rows, params = [], []
+    for liked_id in liked_ids:
+        low, high = order_pair(liker_id, liked_id)
+        # The inserted row's match_token is never stored (a new row is not mutual); EXCLUDED carries it to the update
+        rows.append('(%s, %s, %s, %s, NULL, %s, %s)')
+        params += [
+            user_field.get_db_prep_value(low, connection),
+            user_field.get_db_prep_value(high, connection),
+            True,
+            False,
+            None,
+            stamp,
+        ]
+    sql = f"""
+        INSERT INTO {table} ({qn('user_low_id')}, {qn('user_high_id')}, {own_col}, {other_col}, {matched_col}, {token_col}, {qn('updated_at')})
+        VALUES {', '.join(rows)}
+        ON CONFLICT ({qn('user_low_id')}, {qn('user_high_id')}) DO UPDATE SET
+            {own_col} = EXCLUDED.{own_col},
+            {matched_col} = CASE
+                WHEN {table}.{matched_col} IS NULL AND {table}.{other_col} THEN EXCLUDED.{qn('updated_at')}
+                ELSE {table}.{matched_col}
+            END,
+            {token_col} = CASE
+                WHEN {table}.{matched_col} IS NULL AND {table}.{other_col} THEN %s
+                ELSE {table}.{token_col}
+            END,
+            {qn('updated_at')} = EXCLUDED.{qn('updated_at')}
+        RETURNING {qn('user_low_id')}, {qn('user_high_id')}, {matched_col}, {token_col}
+    """
+    params.append(token)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def set_likes(liker_id, liked_ids):
+    """Set ``liker_id``'s like flag towards each of ``liked_ids`` (distinct).
+
+    Returns ``{liked_id: (is_mutual, became_mutual)}``: whether both users now
+    like each other, and whether this very call is what made them mutual.
+    Issues at most two statements, one per pair orientation.
+    """
+    now = timezone.now()
+    token = uuid.uuid4()
+    liker = _as_uuid(liker_id)
+    by_orientation = {}
+    for liked_id in liked_ids:
+        _, _, own, other = _columns(liker, _as_uuid(liked_id))
+        by_orientation.setdefault((own, other), []).append(_as_uuid(liked_id))
+
+    results = {}
+    for (own, other), targets in by_orientation.items():
+        for low, high, matched_at, match_token in _upsert_likes(liker, targets, own, other, now, token):
+            low, high = _as_uuid(low), _as_uuid(high)
+            liked = high if low == liker else low
+            if matched_at is None:
+                results[liked] = (False, False)
+            else:
+                # (Compared in Python: SQLite mis-evaluates IS NULL inside an upsert's RETURNING.)
+                results[liked] = (True, match_token is not None and _as_uuid(match_token) == token)
+    return results
+
+
+def set_like(liker_id, liked_id):
+    """Single-pair ``set_likes``: one atomic upsert returning ``(is_mutual, became_mutual)``."""
+    return set_likes(liker_id, [liked_id])[_as_uuid(liked_id)]
+
+
+def clear_like(liker_id, liked_id):
+    """Drop ``liker_id``'s like towards ``liked_id`` (unlike, rewind). Never inserts a row."""
+    low, high, own, _ = _columns(liker_id, liked_id)
+    PairState.objects.filter(user_low_id=low, user_high_id=high).update(
+        **{own: False, 'matched_at': None, 'updated_at': timezone.now()}
+    )
+
+
+def clear_likes(liker_id, liked_ids):
+    """``clear_like`` for many targets, in at most two UPDATEs."""
+    low_side = [i for i in liked_ids if str(liker_id) < str(i)]
+    high_side = [i for i in liked_ids if str(liker_id) > str(i)]
+    now = timezone.now()
+    if low_side:
+        PairState.objects.filter(user_low_id=liker_id, user_high_id__in=low_side).update(
+            low_likes_high=False, matched_at=None, updated_at=now
+        )
+    if high_side:
+        PairState.objects.filter(user_high_id=liker_id, user_low_id__in=high_side).update(
+            high_likes_low=False, matched_at=None, updated_at=now
+        )
+
+
+def is_liked_by(liker_id, liked_id):
+    """Whether ``liker_id`` currently likes ``liked_id`` according to the pair state."""
+    low, high, own, _ = _columns(liker_id, liked_id)
+    return PairState.objects.filter(user_low_id=low, user_high_id=high, **{own: True}).exists()
+
+
+def get_match(user_a_id, user_b_id):
+    """The Match for a pair of users, or None."""
+    user1_id, user2_id = order_pair(user_a_id, user_b_id)
+    return Match.objects.filter(user1_id=user1_id, user2_id=user2_id).first()
+
+
+def create_match(user_a_id, user_b_id):
+    """Create (or reactivate) the Match for a mutual pair and mark both Likes matched.
+
+    Returns ``(match, created)``.
+    """
+    user1_id, user2_id = order_pair(user_a_id, user_b_id)
+    with transaction.atomic():
+        match, created = Match.objects.get_or_create(
+            user1_id=user1_id,
+            user2_id=user2_id,
+            defaults={'matched_at': timezone.now()},
+        )
+        if not created and not match.is_active:
+            match.is_active = True
+            match.save(update_fields=['is_active'])
+        Like.objects.filter(
+            liker_id__in=[user_a_id, user_b_id],
+            liked_id__in=[user_a_id, user_b_id],
+            status=Like.LikeStatus.LIKED,
+        ).update(status=Like.LikeStatus.MATCHED, updated_at=timezone.now())
+    return match, created
+
+
+def create_matches(user_id, other_ids):
+    """``create_match`` for every (user_id, other) pair with bulk statements.
+
+    Returns ``{other_id: (match, created)}``.
+    """
+    if not other_ids:
+        return {}
+    ordered = {_as_uuid(other): order_pair(_as_uuid(user_id), _as_uuid(other)) for other in other_ids}
+    pair_q = Q()
+    for user1_id, user2_id in ordered.values():
+        pair_q |= Q(user1_id=user1_id, user2_id=user2_id)
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {(m.user1_id, m.user2_id) for m in Match.objects.filter(pair_q)}
+        Match.objects.bulk_create(
+            [Match(user1_id=u1, user2_id=u2, matched_at=now) for u1, u2 in ordered.values() if (u1, u2) not in existing],
+            ignore_conflicts=True,
+        )
+        reactivated = list(Match.objects.filter(pair_q, is_active=False).values_list('id', flat=True))
+        Match.objects.filter(id__in=reactivated).update(is_active=True)
+        matches = {(m.user1_id, m.user2_id): m for m in Match.objects.filter(pair_q)}
+        Like.objects.filter(
+            Q(liker_id=user_id, liked_id__in=list(ordered)) | Q(liked_id=user_id, liker_id__in=list(ordered)),
+            status=Like.LikeStatus.LIKED,
+        ).update(status=Like.LikeStatus.MATCHED, updated_at=now)
+        # bulk_create skips post_save, so the inbox entries are created here
+        for pair, match in matches.items():
+            if pair not in existing:
+                inbox.ensure_entries(match)
+        if reactivated:
+            InboxEntry.objects.filter(match__in=reactivated).update(is_active=True)
+    return {
+        other: (matches[pair], pair not in existing)
+        for other, pair in ordered.items()
+        if pair in matches
+    }
@@ -0,0 +1,207 @@
+"""
+Confirming Chapa payments off the request thread.
+
+Webhooks and the clients' verify calls used to call Chapa's verify endpoint
+inline, so a slow provider held a worker for every attempt of every retry.
+The webhooks now ``enqueue`` the payment and acknowledge at once: a
+``PendingVerification`` row is written first and the matching function here
+runs through ``chapa.defer_once``. The verify views run the same function
+with the same arguments (so a webhook and a poll share one call) and wait at
+most ``CHAPA_REQUEST_DEADLINE`` seconds for it, answering "pending" if it is
+still running (it finishes in the background either way).
+
+Chapa does not redeliver an acknowledged webhook, so the row is only deleted
+once Chapa gives a verdict ("success" or "failed"). Rows left behind by a
+worker that died or a provider outage are retried by ``sweep``
+(``manage.py verify_pending_payments``, run from cron).
+
+Each function asks Chapa (with the client's full retry budget), applies the
+outcome and returns a ``Verification``: the provider's payment status
+(``None`` if Chapa's answer could not be used) and its details.
+"""
+import functools
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+import requests
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from payments import ledger
+from . import chapa
+from .models import CoinPurchase, PendingVerification, SubscriptionPurchase, User
+
+logger = logging.getLogger(__name__)
+
+Verification = namedtuple('Verification', ['status', 'details'])
+
+_VERDICTS = {'success', 'failed'}
+
+
+def _background(func):
+    # Runs on the chapa pool: that thread's connections are its own to clean up
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return wrapper
+
+
+def _settles(func):
+    # A verdict from Chapa ends a webhook's claim on the payment; anything else is left for the sweep
+    @functools.wraps(func)
+    def wrapper(tx_ref):
+        verification = func(tx_ref)
+        if verification.status in _VERDICTS:
+            PendingVerification.objects.filter(tx_ref=tx_ref).delete()
+        return verification
+    return wrapper
+
+
+def _fetch(tx_ref):
+    response = chapa.get_client().verify(tx_ref)
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if response.status_code != 200 or not isinstance(body, dict) or body.get('status') != 'success':
+        logger.error(f"Chapa verification of {tx_ref} failed: {response.status_code} {body}")
+        return Verification(None, body if body is not None else {'status_code': response.status_code})
+    data = body.get('data') or {}
+    return Verification(data.get('status'), data)
+
+
+def complete_coin_purchase(coin_purchase):
+    """Mark a purchase completed and credit its coins (and the ETB spent) through the ledger.
+
+    Returns False if it was already completed, e.g. by the webhook racing the
+    client's verify call, so the coins are credited once.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        if not CoinPurchase.objects.filter(pk=coin_purchase.pk).exclude(status='completed').update(status='completed', completed_at=now):
+            return False
+        coin_purchase.status = 'completed'
+        coin_purchase.completed_at = now
+        user_id = coin_purchase.user_id
+        ledger.post('coin_purchase', [
+            (None, ledger.Code.COIN_ISSUE, -coin_purchase.coins_purchased),
+            (user_id, ledger.Code.APP_COINS, coin_purchase.coins_purchased),
+            (None, ledger.Code.SALES, -coin_purchase.amount_etb),
+            (user_id, ledger.Code.APP_SPENT, coin_purchase.amount_etb),
+        ], reference=coin_purchase.pk)
+    return True
+
+
+@_background
+@_settles
+def verify_premium(tx_ref):
+    """Upgrade the user holding ``tx_ref`` to premium once Chapa confirms the payment."""
+    verification = _fetch(tx_ref)
+    if verification.status != 'success':
+        logger.warning(f"Premium payment {tx_ref} is {verification.status}")
+        return verification
+    for user in User.objects.filter(current_payment_tx_ref=tx_ref):
+        if not user.is_premium:
+            user.is_premium = True
+            # Clear if it matches the stored ref, to avoid stomping unrelated state
+            if user.current_payment_tx_ref == tx_ref:
+                user.current_payment_tx_ref = None
+            user.save()
+            logger.info(f"Granted premium access to user {user.id} for tx_ref {tx_ref}")
+    return verification
+
+
+@_background
+@_settles
+def verify_coin_purchase(tx_ref):
+    """Complete the coin purchase behind ``tx_ref`` once Chapa confirms it."""
+    verification = _fetch(tx_ref)
+    if verification.status == 'success':
+        coin_purchase = CoinPurchase.objects.filter(transaction_ref=tx_ref).first()
+        if coin_purchase is not None and complete_coin_purchase(coin_purchase):
+            logger.info(f"Coin purchase completed: {tx_ref}, user: {coin_purchase.user_id}, coins: {coin_purchase.coins_purchased}")
+    else:
+        logger.warning(f"Coin purchase {tx_ref} is {verification.status}")
+    return verification
+
+
+@_background
+@_settles
+def verify_subscription(tx_ref):
+    """Activate the subscription behind ``tx_ref`` once Chapa confirms it."""
+    verification = _fetch(tx_ref)
+    if verification.status != 'success':
+        logger.warning(f"Subscription payment {tx_ref} is {verification.status}")
+        return verification
+    with transaction.atomic():
+        subscription_purchase = SubscriptionPurchase.objects.select_for_update().filter(transaction_ref=tx_ref).first()
+        if subscription_purchase is None or subscription_purchase.status != 'pending':
+            return verification
+        user = subscription_purchase.user
+        now = timezone.now()
+        expires = now + timedelta(days=subscription_purchase.duration_days)
+
+        # Apply the subscription benefits based on plan code
+        if subscription_purchase.plan_code == 'BOOST':
+            user.has_boost = True
+            user.boost_expiry = expires
+        elif subscription_purchase.plan_code == 'LIKES_REVEAL':
+            user.can_see_likes = True
+            user.likes_reveal_expiry = expires
+        elif subscription_purchase.plan_code == 'AD_FREE':
+            user.ad_free = True
+            user.ad_free_expiry = expires
+        user.save()
+
+        subscription_purchase.status = 'completed'
+        subscription_purchase.completed_at = now
+        subscription_purchase.activated_at = now
+        subscription_purchase.expires_at = expires
+        subscription_purchase.save()
+    logger.info(f"Subscription activated: {tx_ref}, user: {user.username}, plan: {subscription_purchase.plan_code}")
+    return verification
+
+
+_VERIFIERS = {
+    'premium': verify_premium,
+    'coins': verify_coin_purchase,
+    'subscription': verify_subscription,
+}
+
+
+def enqueue(kind, tx_ref):
+    """Record that a webhook reported ``tx_ref``, then verify it in the background; returns the Future."""
+    PendingVerification.objects.get_or_create(tx_ref=tx_ref, defaults={'kind': kind})
+    return chapa.defer_once(_VERIFIERS[kind], tx_ref)
+
+
+def sweep(older_than, max_attempts):
+    """Verify, in this thread, the webhook-reported payments still pending after ``older_than``.
+
+    A payment that has had ``max_attempts`` sweeps without a verdict is
+    dropped with an error for manual follow-up. Returns (settled, dropped).
+    """
+    settled = dropped = 0
+    cutoff = timezone.now() - older_than
+    # Loaded up front: each verification closes this thread's connections when it is done
+    for pending in list(PendingVerification.objects.filter(created_at__lt=cutoff).order_by('id')):
+        if pending.attempts >= max_attempts:
+            logger.error(f"Giving up on verifying {pending.kind} payment {pending.tx_ref} after {pending.attempts} attempts")
+            pending.delete()
+            dropped += 1
+            continue
+        PendingVerification.objects.filter(pk=pending.pk).update(attempts=F('attempts') + 1)
+        try:
+            verification = _VERIFIERS[pending.kind](pending.tx_ref)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Sweep could not verify {pending.tx_ref}: {e!r}")
+            continue
+        if verification.status in _VERDICTS:
+            settled += 1
+    return settled, dropped
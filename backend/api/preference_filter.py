@@ -0,0 +1,179 @@
+"""
+Compiles a user's stored ``UserPreference`` into a single queryset predicate.
+
+Discovery used to ignore everything except the minAge/maxAge/gender query
+params, so profiles the viewer had explicitly ruled out were still loaded,
+serialized and shipped to the phone. ``apply_preferences`` narrows a candidate
+queryset with one predicate covering both directions:
+
+* forward: the candidate's gender, religion, relationship intent/type and age
+  satisfy the viewer's preferences (including the preferred age gap);
+* reverse: the viewer satisfies the candidate's own preferences, so people who
+  would never be shown the viewer are not shown to them either.
+
+Empty or missing preference lists, or lists naming "Everyone"/"Any"/"All",
+mean "no preference", the same in both directions. The list lookups use
+JSON containment where the database supports it (Postgres) and an exact match
+on the encoded JSON element elsewhere (SQLite).
+"""
+import json
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import UserPreference
+
+DEFAULT_AGE_MIN = 18
+DEFAULT_AGE_MAX = 99
+# Values some clients send to mean "no preference"
+_ANY = {'all', 'any', 'everyone'}
+# How they appear in stored lists; JSON containment is case-sensitive
+_ANY_SPELLINGS = sorted({spelling for value in _ANY for spelling in (value, value.title(), value.upper())})
+
+
+def _as_list(value):
+    """Preference lists are JSON; older clients sometimes stored a bare string."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    values = [v for v in value if v]
+    if any(str(v).lower() in _ANY for v in values):
+        return []
+    return values
+
+
+def _age_on(date_of_birth, today):
+    return today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+
+
+def _json_list_contains(field, value):
+    """Q matching rows whose JSON list ``field`` contains ``value`` (or is that bare string)."""
+    if connection.features.supports_json_field_contains:
+        return Q(**{f'{field}__contains': [value]}) | Q(**{field: value})
+    # SQLite stores the list as JSON text; match the encoded element, quotes included
+    alias = field.replace('__', '_') + '_text'
+    return Q(**{f'{alias}__contains': json.dumps(value)})
+
+
+def _json_list_annotations(fields):
+    """Text casts needed by ``_json_list_contains`` on databases without JSON containment."""
+    if connection.features.supports_json_field_contains:
+        return {}
+    return {field.replace('__', '_') + '_text': Cast(field, TextField()) for field in fields}
+
+
+def _no_preference(field):
+    """The candidate's preference list ``field`` is missing, empty or says "any" (as ``_as_list`` reads it)."""
+    q = Q(**{f'{field}__isnull': True}) | Q(**{field: []})
+    for spelling in _ANY_SPELLINGS:
+        q |= _json_list_contains(field, spelling)
+    return q
+
+
+def _accepts(field, value):
+    """The candidate's preference list ``field`` means "no preference" or includes ``value``."""
+    no_preference = _no_preference(field)
+    if not value:
+        return no_preference
+    return no_preference | _json_list_contains(field, value)
+
+
+def _accepts_religion(religion):
+    """Religion preferences live in two lists; either one may name the viewer's religion."""
+    no_preference = _no_preference('preferences__preferred_religion') & _no_preference('preferences__preferred_religion_match')
+    if not religion:
+        return no_preference
+    return (
+        no_preference
+        | _json_list_contains('preferences__preferred_religion', religion)
+        | _json_list_contains('preferences__preferred_religion_match', religion)
+    )
+
+
+def _dob_between(today, min_age=None, max_age=None):
+    q = Q()
+    if min_age is not None:
+        q &= Q(date_of_birth__lte=today - relativedelta(years=min_age))
+    if max_age is not None:
+        q &= Q(date_of_birth__gte=today - relativedelta(years=max_age + 1))
+    return q
+
+
+def forward_q(user, prefs, override_gender=False, override_age=False):
+    """Candidates that match ``user``'s own preferences.
+
+    ``override_gender``/``override_age`` skip dimensions the client already
+    filtered explicitly through query params for this request.
+    """
+    today = timezone.now().date()
+    q = Q()
+
+    genders = _as_list(prefs.preferred_gender)
+    if genders and not override_gender:
+        q &= Q(gender__in=genders)
+
+    religions = _as_list(prefs.preferred_religion) + _as_list(prefs.preferred_religion_match)
+    if religions:
+        q &= Q(religion__in=religions)
+
+    intents = _as_list(prefs.preferred_relationship_intent)
+    if intents:
+        q &= Q(relationship_intent__in=intents)
+
+    relationship_types = _as_list(prefs.preferred_relationship_type_match)
+    if relationship_types:
+        q &= Q(relationship_type__in=relationship_types)
+
+    # Same rule as the query params: the 18-99 default means "no age filter",
+    # so profiles without a date of birth are not dropped.
+    age_min, age_max = prefs.preferred_age_min, prefs.preferred_age_max
+    if not override_age and not (age_min in (None, DEFAULT_AGE_MIN) and age_max in (None, DEFAULT_AGE_MAX)):
+        q &= _dob_between(today, age_min, age_max)
+
+    if user.date_of_birth and (prefs.preferred_min_age_gap is not None or prefs.preferred_max_age_gap is not None):
+        # min gap: how many years younger they can be; max gap: how many years older
+        if prefs.preferred_min_age_gap is not None:
+            q &= Q(date_of_birth__lte=user.date_of_birth + relativedelta(years=prefs.preferred_min_age_gap))
+        if prefs.preferred_max_age_gap is not None:
+            q &= Q(date_of_birth__gte=user.date_of_birth - relativedelta(years=prefs.preferred_max_age_gap))
+    return q
+
+
+def reverse_q(user):
+    """Candidates whose own preferences accept ``user``. Candidates without preferences accept everyone."""
+    q = (
+        _accepts('preferences__preferred_gender', user.gender)
+        & _accepts('preferences__preferred_relationship_intent', user.relationship_intent)
+        & _accepts('preferences__preferred_relationship_type_match', user.relationship_type)
+        & _accepts_religion(user.religion)
+    )
+    if user.date_of_birth:
+        age = _age_on(user.date_of_birth, timezone.now().date())
+        q &= Q(preferences__preferred_age_min__lte=age) | Q(preferences__preferred_age_min__isnull=True)
+        q &= Q(preferences__preferred_age_max__gte=age) | Q(preferences__preferred_age_max__isnull=True)
+    return Q(preferences__isnull=True) | q
+
+
+REVERSE_LIST_FIELDS = (
+    'preferences__preferred_gender',
+    'preferences__preferred_relationship_intent',
+    'preferences__preferred_relationship_type_match',
+    'preferences__preferred_religion',
+    'preferences__preferred_religion_match',
+)
+
+
+def apply_preferences(qs, user, override_gender=False, override_age=False):
+    """Narrow a candidate queryset with ``user``'s preferences in both directions."""
+    prefs = UserPreference.objects.filter(user=user).first()
+    if prefs is not None:
+        qs = qs.filter(forward_q(user, prefs, override_gender=override_gender, override_age=override_age))
+    annotations = _json_list_annotations(REVERSE_LIST_FIELDS)
+    if annotations:
+        qs = qs.annotate(**annotations)
+    return qs.filter(reverse_q(user))
+
@@ -0,0 +1,159 @@
+"""
+Presence (online / last seen) and typing-indicator throttling.
+
+A user is online while at least one of their sockets is connected and
+heartbeating. Live state is a per-user connection counter in the cache that
+expires after ``PRESENCE_TTL`` seconds without a heartbeat, so a crashed
+worker cannot leave users online forever. The counter is only right when
+every socket process shares the cache (``CACHE_URL``); api/cache_scope.py
+refuses a multi-process channel layer without one. ``User.last_seen_at`` is
+written on disconnect and at most every ``PRESENCE_PERSIST_INTERVAL``
+seconds while connected, and cached alongside the counter.
+
+``TypingCoalescer`` sits in front of the chat room's ``typing`` broadcasts:
+repeated "still typing" events are refreshed at most every
+``CHAT_TYPING_REFRESH_INTERVAL`` seconds, state changes are rate limited to
+``CHAT_TYPING_EVENTS_PER_SECOND``, and a change that arrives while limited
+is held and sent later (only the latest state), so the other side always
+ends up with the right state.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import User
+
+_SEEN_TTL = 86400
+# Slack for float drift when a held event is retried after exactly retry_after()
+_EPSILON = 1e-6
+
+
+def _online_key(user_id):
+    return f"presence:online:{user_id}"
+
+
+def _seen_key(user_id):
+    return f"presence:seen:{user_id}"
+
+
+def _persist(user_id, now):
+    # update() rather than save(): no signals, no auto_now bump
+    User.objects.filter(id=user_id).update(last_seen_at=now)
+    cache.set(_seen_key(user_id), now, _SEEN_TTL)
+
+
+def connected(user_id):
+    key = _online_key(user_id)
+    if not cache.add(key, 1, settings.PRESENCE_TTL):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, settings.PRESENCE_TTL)
+    _persist(user_id, timezone.now())
+
+
+def heartbeat(user_id, last_persisted=None):
+    """Keep ``user_id`` online; returns when last_seen_at was last written (pass it back in)."""
+    key = _online_key(user_id)
+    if not cache.touch(key, settings.PRESENCE_TTL):
+        cache.add(key, 1, settings.PRESENCE_TTL)
+    now = timezone.now()
+    if last_persisted is None or (now - last_persisted).total_seconds() >= settings.PRESENCE_PERSIST_INTERVAL:
+        _persist(user_id, now)
+        return now
+    return last_persisted
+
+
+def disconnected(user_id):
+    """Returns whether the user is still online on another socket."""
+    key = _online_key(user_id)
+    try:
+        remaining = cache.decr(key)
+    except ValueError:
+        remaining = 0
+    if remaining <= 0:
+        cache.delete(key)
+    _persist(user_id, timezone.now())
+    return remaining > 0
+
+
+def is_online(user_id):
+    return bool(cache.get(_online_key(user_id)))
+
+
+def snapshot(user_ids):
+    """{user_id: {'is_online': bool, 'last_seen_at': datetime | None}} with one cache round trip."""
+    user_ids = list(user_ids)
+    keys = {}
+    for user_id in user_ids:
+        keys[_online_key(user_id)] = user_id
+        keys[_seen_key(user_id)] = user_id
+    cached = cache.get_many(keys)
+    result = {
+        user_id: {
+            'is_online': bool(cached.get(_online_key(user_id))),
+            'last_seen_at': cached.get(_seen_key(user_id)),
+        }
+        for user_id in user_ids
+    }
+    missing = [user_id for user_id, state in result.items() if state['last_seen_at'] is None]
+    if missing:
+        by_str = {str(user_id): user_id for user_id in missing}
+        for user_id, last_seen_at in User.objects.filter(id__in=missing).values_list('id', 'last_seen_at'):
+            result[by_str[str(user_id)]]['last_seen_at'] = last_seen_at
+    return result
+
+
+class TypingCoalescer:
+    """Decides which typing events of one sender reach the room (see module docstring)."""
+
+    def __init__(self, rate=None, refresh_interval=None, clock=time.monotonic):
+        self.rate = rate or settings.CHAT_TYPING_EVENTS_PER_SECOND
+        self.refresh_interval = refresh_interval or settings.CHAT_TYPING_REFRESH_INTERVAL
+        self.clock = clock
+        self.tokens = float(self.rate)
+        self.refilled_at = clock()
+        self.sent_state = False
+        self.sent_at = None
+        self.pending = None
+
+    def _refill(self, now):
+        self.tokens = min(float(self.rate), self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def offer(self, is_typing):
+        """True if ``is_typing`` should be broadcast now; otherwise it is dropped or held in ``pending``."""
+        now = self.clock()
+        is_typing = bool(is_typing)
+        if is_typing == self.sent_state and (
+            not is_typing or (self.sent_at is not None and now - self.sent_at < self.refresh_interval)
+        ):
+            # Nothing new for the room
+            self.pending = None
+            return False
+        self._refill(now)
+        if self.tokens < 1 - _EPSILON:
+            self.pending = is_typing
+            return False
+        self.tokens = max(0.0, self.tokens - 1)
+        self.sent_state, self.sent_at, self.pending = is_typing, now, None
+        return True
+
+    def retry_after(self):
+        """Seconds until a held event can go out."""
+        self._refill(self.clock())
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take_pending(self):
+        """The held state if it can be sent now, else None."""
+        if self.pending is None:
+            return None
+        state = self.pending
+        return state if self.offer(state) else None
+
+    def reset(self):
+        """The sender's message went out: clients clear the indicator on their own."""
+        self.sent_state, self.sent_at, self.pending = False, None, None
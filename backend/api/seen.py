@@ -0,0 +1,97 @@
+"""
+Per-user "already seen" sets for discovery.
+
+Excluding swiped profiles with ``exclude(id__in=<every swipe ever>)`` makes
+the discovery query grow with swipe history. Instead each user has a Bloom
+filter (``SeenFilter``) that swipes and likes are added to as they happen,
+and pool builds drop seen candidates in memory. A false positive only hides a
+fresh profile from one pool build, at a rate bounded by
+``DISCOVERY_SEEN_FILTER_ERROR_RATE``.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .bloom import BloomFilter
+from .models import Like, SeenFilter, Swipe
+
+logger = logging.getLogger(__name__)
+
+
+def _capacity():
+    return int(getattr(settings, 'DISCOVERY_SEEN_FILTER_CAPACITY', 2000))
+
+
+def _error_rate():
+    return float(getattr(settings, 'DISCOVERY_SEEN_FILTER_ERROR_RATE', 0.01))
+
+
+def _history_ids(user_id):
+    ids = {str(i) for i in Swipe.objects.filter(swiper_id=user_id).values_list('swiped_on_id', flat=True).iterator()}
+    ids.update(
+        str(i) for i in Like.objects.filter(liker_id=user_id)
+        .exclude(status=Like.LikeStatus.REMOVED)
+        .values_list('liked_id', flat=True)
+        .iterator()
+    )
+    return ids
+
+
+def rebuild(user_id):
+    """Rebuild ``user_id``'s filter from swipe/like history, sized with headroom for growth."""
+    ids = _history_ids(user_id)
+    capacity = max(_capacity(), len(ids) * 2)
+    bloom = BloomFilter.for_capacity(capacity, _error_rate())
+    for seen_id in ids:
+        bloom.add(seen_id)
+    SeenFilter.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'bits': bloom.to_bytes(),
+            'bit_count': bloom.bit_count,
+            'hash_count': bloom.hash_count,
+            'capacity': capacity,
+            'item_count': len(ids),
+        },
+    )
+    logger.info(f"Rebuilt seen filter for user {user_id}: {len(ids)} ids, capacity {capacity}")
+    return bloom
+
+
+def load(user_id):
+    """``user_id``'s seen filter, built from history on first use."""
+    row = SeenFilter.objects.filter(user_id=user_id).first()
+    if row is None:
+        return rebuild(user_id)
+    return BloomFilter(row.bit_count, row.hash_count, row.bits)
+
+
+def record(user_id, seen_ids):
+    """Add ``seen_ids`` to ``user_id``'s filter, if one has been built yet."""
+    with transaction.atomic():
+        row = SeenFilter.objects.select_for_update().filter(user_id=user_id).first()
+        if row is None:
+            # Built lazily from history, which already includes these
+            return
+        bloom = BloomFilter(row.bit_count, row.hash_count, row.bits)
+        added = 0
+        for seen_id in seen_ids:
+            seen_id = str(seen_id)
+            if seen_id not in bloom:
+                bloom.add(seen_id)
+                added += 1
+        if not added:
+            return
+        if row.item_count + added > row.capacity:
+            # Past capacity the false-positive rate climbs; resize from history
+            rebuild(user_id)
+            return
+        row.bits = bloom.to_bytes()
+        row.item_count += added
+        row.save(update_fields=['bits', 'item_count', 'updated_at'])
+
+
+def invalidate(user_id):
+    """Drop ``user_id``'s filter (e.g. after a swipe is undone); it is rebuilt on next use."""
+    SeenFilter.objects.filter(user_id=user_id).delete()
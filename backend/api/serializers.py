@@ -1,13 +1,16 @@
 from rest_framework import serializers
 from .models import (
-    User, UserPhoto, Interest, UserPreference, Swipe, Like, Message,
+    User, UserPhoto, Interest, UserPreference, Swipe, Like, Message, InboxEntry,
     ChatbotConversation, ChatbotMessage, ChatMessage,
     CoinPackage, UserWallet, CoinPurchase, GiftType, GiftTransaction, PlatformSettings
 )
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.utils.crypto import get_random_string
 from datetime import date
 
+from . import presence
+
 User = get_user_model()
 class InterestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -200,6 +203,8 @@ class UserSerializer(serializers.ModelSerializer):
     smokes = serializers.CharField(required=False, allow_null=True, allow_blank=True)
     
     interests = InterestSerializer(many=True, read_only=True)
+    # Live presence (see api/presence.py); list views pass a 'presence' snapshot in context
+    is_online = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -217,9 +222,16 @@ class UserSerializer(serializers.ModelSerializer):
             'is_premium',
             'has_boost', 'can_see_likes', 'ad_free',
             'boost_expiry', 'likes_reveal_expiry', 'ad_free_expiry',
-            'user_photos'  # This is correctly included
+            'user_photos',  # This is correctly included
+            'is_online', 'last_seen_at',
         ]
-        read_only_fields = ['id', 'last_login', 'is_active', 'date_joined', 'updated_at', 'profile_completeness_score']
+        read_only_fields = ['id', 'last_login', 'is_active', 'date_joined', 'updated_at', 'profile_completeness_score', 'last_seen_at']
+
+    def get_is_online(self, obj):
+        snapshot = self.context.get('presence')
+        if snapshot is not None and obj.id in snapshot:
+            return snapshot[obj.id]['is_online']
+        return presence.is_online(obj.id)
 
 
 class PotentialMatchSerializer(serializers.ModelSerializer):
@@ -321,13 +333,21 @@ class PeopleWhoLikeMeSerializer(serializers.ModelSerializer):
 
 class MessageSerializer(serializers.ModelSerializer):
     """Serializer for messages between matched users"""
+    # Generated ids exceed 2**53, so JavaScript clients get them as strings
+    id = serializers.CharField(read_only=True)
     sender_name = serializers.CharField(source='sender.first_name', read_only=True)
     sender_id = serializers.UUIDField(source='sender.id', read_only=True)
-    
+    # Fields the legacy /chat/ endpoint returned for ChatMessage
+    timestamp = serializers.DateTimeField(source='sent_at', read_only=True)
+    is_read = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
-        fields = ['id', 'content', 'sent_at', 'sender', 'sender_name', 'sender_id']
-        read_only_fields = ['id', 'sent_at', 'sender', 'sender_name', 'sender_id']
+        fields = ['id', 'seq', 'content', 'sent_at', 'timestamp', 'sender', 'sender_name', 'sender_id', 'is_read']
+        read_only_fields = ['id', 'seq', 'sent_at', 'sender', 'sender_name', 'sender_id']
+
+    def get_is_read(self, obj):
+        return obj.read_at is not None
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -340,6 +360,44 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp', 'sender', 'sender_name']
 
 
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """One conversation in the chat list, read straight from the denormalized inbox row"""
+    # Chat endpoints address conversations by Like id; match_id is the Match row
+    id = serializers.UUIDField(source='like_id', read_only=True)
+    match_id = serializers.UUIDField(read_only=True)
+    other_user = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = InboxEntry
+        fields = ['id', 'match_id', 'other_user', 'last_message', 'unread_count', 'last_activity_at']
+
+    def get_other_user(self, obj):
+        photo = None
+        if obj.other_user_photo:
+            url = default_storage.url(obj.other_user_photo)
+            request = self.context.get('request')
+            photo = request.build_absolute_uri(url) if request else url
+        state = self.context.get('presence', {}).get(obj.other_user_id) or {}
+        return {
+            'id': str(obj.other_user_id),
+            'first_name': obj.other_user_name,
+            'photo': photo,
+            'is_online': state.get('is_online', False),
+            'last_seen_at': serializers.DateTimeField().to_representation(state['last_seen_at'])
+            if state.get('last_seen_at') else None,
+        }
+
+    def get_last_message(self, obj):
+        if obj.last_message_at is None:
+            return None
+        return {
+            'content': obj.last_message_preview,
+            'sent_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+            'sender_id': str(obj.last_message_sender_id) if obj.last_message_sender_id else None,
+        }
+
+
 class ChatbotConversationSerializer(serializers.ModelSerializer):
     """Serializer for chatbot conversations"""
     class Meta:
@@ -369,6 +427,11 @@ class CoinPackageSerializer(serializers.ModelSerializer):
 
 class UserWalletSerializer(serializers.ModelSerializer):
     """Serializer for user wallet"""
+    # Ledger balances, one query per wallet (UserWallet.prefetch_ledger_balances for a list)
+    coins = serializers.IntegerField(read_only=True, source='ledger_balances.coins')
+    total_spent = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, source='ledger_balances.total_spent')
+    total_earned = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, source='ledger_balances.total_earned')
+
     class Meta:
         model = UserWallet
         fields = ['coins', 'total_spent', 'total_earned', 'created_at', 'updated_at']
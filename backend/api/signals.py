@@ -0,0 +1,135 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import ChatMessage, Like, Match, Message, Swipe, User, UserPhoto
+from . import discovery, inbox, interest_index, membership, pairs, seen, ws_auth
+
+
+@receiver(post_save, sender=Swipe)
+def remove_swiped_from_discovery_pool(sender, instance, **kwargs):
+    """Keep the swiper's precomputed deck in sync as swipes happen."""
+    discovery.remove_candidate(instance.swiper_id, instance.swiped_on_id)
+
+
+@receiver(post_save, sender=Swipe)
+def record_swipe_as_seen(sender, instance, **kwargs):
+    seen.record(instance.swiper_id, [instance.swiped_on_id])
+
+
+@receiver(post_save, sender=Like)
+def record_like_as_seen(sender, instance, **kwargs):
+    if instance.status != Like.LikeStatus.REMOVED:
+        seen.record(instance.liker_id, [instance.liked_id])
+
+
+@receiver(post_delete, sender=Swipe)
+def forget_undone_swipe(sender, instance, **kwargs):
+    """Bloom filters cannot remove keys, so a rewound or reset swipe drops the whole filter."""
+    seen.invalidate(instance.swiper_id)
+
+
+@receiver(post_save, sender=Swipe)
+def clear_pair_like_for_changed_swipe(sender, instance, created, **kwargs):
+    """A like swipe that is later changed to a dislike no longer counts as a like."""
+    if not created and instance.swipe_type == Swipe.SwipeType.DISLIKE:
+        pairs.clear_like(instance.swiper_id, instance.swiped_on_id)
+
+
+@receiver(post_delete, sender=Swipe)
+def clear_pair_like_for_undone_swipe(sender, instance, **kwargs):
+    if instance.swipe_type in (Swipe.SwipeType.LIKE, Swipe.SwipeType.SUPERLIKE):
+        pairs.clear_like(instance.swiper_id, instance.swiped_on_id)
+
+
+@receiver(post_save, sender=Like)
+def clear_pair_like_for_removed_like(sender, instance, **kwargs):
+    if instance.status == Like.LikeStatus.REMOVED:
+        pairs.clear_like(instance.liker_id, instance.liked_id)
+
+
+@receiver(post_delete, sender=Like)
+def clear_pair_like_for_deleted_like(sender, instance, **kwargs):
+    pairs.clear_like(instance.liker_id, instance.liked_id)
+
+
+@receiver(m2m_changed, sender=User.interests.through)
+def sync_interest_index(sender, instance, action, reverse, pk_set, **kwargs):
+    """Mirror User.interests changes (from either side of the relation) into the interest bitmaps."""
+    if action == 'pre_clear':
+        # pk_set is not provided for clears; remember what is about to go
+        if reverse:
+            instance._interest_index_cleared = list(instance.users.values_list('id', flat=True))
+        else:
+            instance._interest_index_cleared = list(instance.interests.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_interest_index_cleared', None)
+        action = 'post_remove'
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+
+    if reverse:
+        user_ids, interest_ids = pk_set, [instance.pk]
+    else:
+        user_ids, interest_ids = [instance.pk], pk_set
+    if action == 'post_add':
+        interest_index.add(user_ids, interest_ids)
+    else:
+        interest_index.remove(user_ids, interest_ids)
+
+
+@receiver(post_save, sender=Match)
+def sync_inbox_for_match(sender, instance, created, **kwargs):
+    if created:
+        inbox.ensure_entries(instance)
+    else:
+        inbox.set_active(instance)
+
+
+@receiver(post_save, sender=Match)
+def forget_deactivated_match_members(sender, instance, created, **kwargs):
+    """Unmatching (RemoveLikeView) must stop both users' chat access right away."""
+    if not instance.is_active:
+        membership.invalidate_pair(instance.user1_id, instance.user2_id, instance.id)
+
+
+@receiver(post_delete, sender=Match)
+def forget_deleted_match_members(sender, instance, **kwargs):
+    membership.invalidate_pair(instance.user1_id, instance.user2_id, instance.id)
+
+
+@receiver(post_save, sender=Message)
+def record_message_in_inbox(sender, instance, created, **kwargs):
+    if created:
+        inbox.record_message(instance.match_id, instance.sender_id, instance.content, instance.sent_at)
+
+
+@receiver(post_save, sender=ChatMessage)
+def record_chat_message_in_inbox(sender, instance, created, **kwargs):
+    """ChatMessage rows hang off the Like; the inbox is keyed by the pair's Match."""
+    if not created:
+        return
+    like = instance.match
+    match = pairs.get_match(like.liker_id, like.liked_id)
+    if match is not None:
+        inbox.record_message(match.id, instance.sender_id, instance.content, instance.timestamp)
+
+
+@receiver(post_save, sender=User)
+def refresh_inbox_name(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'first_name' not in update_fields):
+        return
+    inbox.refresh_user_summary(instance.id)
+
+
+@receiver(post_save, sender=UserPhoto)
+@receiver(post_delete, sender=UserPhoto)
+def refresh_inbox_photo(sender, instance, **kwargs):
+    inbox.refresh_user_summary(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Logout and token rotation delete the token; stop sockets authenticating with it."""
+    ws_auth.invalidate(instance.key)
@@ -1,3 +1,1284 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import math
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from payments import ledger
+from payments.idempotency import idempotent
+from payments.models import AuditLog, Gift, IdempotencyKey, LedgerAccount, LedgerEntry, LedgerTransaction
+from shebalove_project.asgi import application
+from . import (
+    channel_layers, chapa, chat_store, chat_writer, discovery, events, geo, inbox, interest_index, membership,
+    message_ids, notifications, pairs, preference_filter, presence, scoring, websocket_utils, ws_auth,
+)
+from .bloom import BloomFilter
+from .channel_layers import BrokerChannelLayer, ChannelBroker
+from .consumers import MatchNotificationConsumer
+from .fake_chapa import FakeChapaServer
+from .models import (
+    CoinPackage, CoinPurchase, DiscoveryPool, GiftTransaction, GiftType, Interest, Like, Match, Message,
+    NotificationOutbox, PendingVerification, Swipe, User, UserPreference, UserWallet,
+)
+from .serializers import UserWalletSerializer
+
+
+class ReversePreferenceTests(TestCase):
+    """A candidate's "Everyone"/"Any" preference accepts every viewer, as it does on the forward side."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='x', gender='Male', religion='Christian')
+
+    def candidate(self, name, **prefs):
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password='x', gender='Female')
+        UserPreference.objects.create(user=user, **prefs)
+        return user
+
+    def deck(self):
+        qs = User.objects.exclude(id=self.viewer.id)
+        return set(preference_filter.apply_preferences(qs, self.viewer).values_list('username', flat=True))
+
+    def test_any_spellings_mean_no_preference(self):
+        self.candidate('everyone', preferred_gender=['Everyone'])
+        self.candidate('any_lower', preferred_gender=['any'])
+        self.candidate('bare_all', preferred_gender='All')
+        self.candidate('religion_any', preferred_religion=['Any'], preferred_religion_match=[])
+        self.candidate('women_only', preferred_gender=['Female'])
+        self.candidate('no_prefs', preferred_gender=[])
+        self.assertEqual(self.deck(), {'everyone', 'any_lower', 'bare_all', 'religion_any', 'no_prefs'})
+
+
+class DistanceFilterTests(TestCase):
+    """The geohash prefilter plus the exact check keep exactly the candidates inside the radius."""
+
+    KM_PER_DEGREE = geo.EARTH_RADIUS_KM * math.pi / 180
+
+    def user(self, name, lat, lon):
+        return User.objects.create_user(
+            username=name, email=f'{name}@example.com', password='x', location_latitude=lat, location_longitude=lon,
+        )
+
+    def pool_names(self, viewer, km):
+        filters = discovery.parse_discovery_filters({'maxDistance': str(km)}, viewer)
+        pool = discovery.build_pool(viewer, filters)
+        return set(User.objects.filter(id__in=pool.candidate_ids).values_list('username', flat=True))
+
+    def test_radius_edge(self):
+        viewer = self.user('viewer', 9.0, 38.75)
+        self.user('inside', 9.0 + 9.9 / self.KM_PER_DEGREE, 38.75)
+        self.user('outside', 9.0 - 10.1 / self.KM_PER_DEGREE, 38.75)
+        User.objects.create_user(username='nowhere', email='nowhere@example.com', password='x')
+        self.assertEqual(self.pool_names(viewer, 10), {'inside'})
+
+    def test_neighbours_across_the_antimeridian(self):
+        viewer = self.user('viewer', 0.0, 179.99)
+        self.user('east', 0.0, -179.99)  # about 2 km away, on the other side of the date line
+        self.user('west', 0.0, 179.0)  # about 110 km away
+        self.assertEqual(self.pool_names(viewer, 10), {'east'})
+        # Found through a prefilter cell from the far side, not by scanning
+        east_hash = geo.encode(0.0, -179.99)
+        self.assertTrue(any(east_hash.startswith(cell) for cell in geo.covering_cells(0.0, 179.99, 10)))
+
+
+class ScoringTests(TestCase):
+    """Pools are ordered boosted first, then by compatibility."""
+
+    def setUp(self):
+        self.interests = [Interest.objects.create(name=f'i{i}') for i in range(3)]
+        self.viewer = self.user('viewer', relationship_intent='Long-term relationship', religion='Atheist')
+        self.viewer.interests.set(self.interests)
+
+    def user(self, name, **fields):
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+        User.objects.filter(id=user.id).update(**fields)
+        user.refresh_from_db()
+        return user
+
+    def names(self, ids):
+        by_id = dict(User.objects.filter(id__in=ids).values_list('id', 'username'))
+        return [by_id[uid] for uid in map(uuid.UUID, ids)]
+
+    def test_best_match_ranks_first(self):
+        strong = self.user('strong', relationship_intent='Long-term relationship', religion='Atheist')
+        strong.interests.set(self.interests)
+        self.user('medium', relationship_intent='Long-term relationship')
+        self.user('weak', relationship_intent='Casual dating', religion='Agnostic')
+        rows = list(User.objects.exclude(id=self.viewer.id).values_list(*scoring.FEATURE_FIELDS))
+        self.assertEqual(self.names(scoring.rank(self.viewer, rows)), ['strong', 'medium', 'weak'])
+
+    def test_undisclosed_values_never_match(self):
+        User.objects.filter(id=self.viewer.id).update(religion='Prefer not to say')
+        self.viewer.refresh_from_db()
+        self.user('same', religion='Prefer not to say')
+        self.user('other', religion='Agnostic')
+        rows = list(User.objects.exclude(id=self.viewer.id).order_by('username').values_list(*scoring.FEATURE_FIELDS))
+        no_jitter = mock.Mock(random=lambda n: np.zeros(n))
+        other, same = scoring.score(scoring.viewer_vector(self.viewer), scoring.build_features(rows), rng=no_jitter)
+        self.assertAlmostEqual(other, same, places=4)  # recency differs by the moments between the two inserts
+
+    def test_boosted_candidates_come_first(self):
+        strong = self.user('strong', relationship_intent='Long-term relationship', religion='Atheist')
+        strong.interests.set(self.interests)
+        self.user('boosted', has_boost=True)
+        pool = discovery.build_pool(self.viewer, discovery.parse_discovery_filters({}, self.viewer))
+        self.assertEqual(self.names(pool.candidate_ids), ['boosted', 'strong'])
+
+
+class SeenFilterTests(TestCase):
+    """Swiped profiles stay out of rebuilt pools; unswiped ones are wrongly hidden only at the configured rate."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='x')
+        self.candidates = [
+            User.objects.create_user(username=f'c{i}', email=f'c{i}@example.com', password='x') for i in range(3)
+        ]
+        self.filters = discovery.parse_discovery_filters({}, self.viewer)
+
+    def pool_ids(self):
+        return set(discovery.build_pool(self.viewer, self.filters).candidate_ids)
+
+    def test_swipes_are_excluded_from_later_builds(self):
+        self.assertEqual(len(self.pool_ids()), 3)  # builds the filter from (empty) history
+        Swipe.objects.create(swiper=self.viewer, swiped_on=self.candidates[0], swipe_type='dislike')
+        Like.objects.create(liker=self.viewer, liked=self.candidates[1])
+        self.assertEqual(self.pool_ids(), {str(self.candidates[2].id)})
+
+    def test_undone_swipe_brings_the_profile_back(self):
+        swipe = Swipe.objects.create(swiper=self.viewer, swiped_on=self.candidates[0], swipe_type='dislike')
+        self.assertNotIn(str(self.candidates[0].id), self.pool_ids())
+        swipe.delete()
+        self.assertIn(str(self.candidates[0].id), self.pool_ids())
+
+    def test_false_positive_rate_stays_near_the_target(self):
+        bloom = BloomFilter.for_capacity(2000, 0.01)
+        for i in range(2000):
+            bloom.add(f'seen-{i}')
+        self.assertTrue(all(f'seen-{i}' in bloom for i in range(2000)))
+        false_positives = sum(f'fresh-{i}' in bloom for i in range(20000))
+        self.assertLess(false_positives / 20000, 0.02)
+
+
+class InterestIndexTests(TestCase):
+    """Shared-interest counts come from intersecting the interest bitmaps, kept in sync with User.interests."""
+
+    def setUp(self):
+        self.interests = [Interest.objects.create(name=f'i{i}') for i in range(4)]
+        self.viewer = self.user('viewer', 0, 1, 2)
+        # Enough members that ordinals span several bytes of each bitmap
+        for i in range(10):
+            self.user(f'filler{i}', 3)
+
+    def user(self, name, *interest_indexes):
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+        user.interests.set([self.interests[i] for i in interest_indexes])
+        return user
+
+    def overlap(self):
+        names = dict(User.objects.values_list('id', 'username'))
+        return [(names[uuid.UUID(user_id)], count) for user_id, count in interest_index.top_overlap(self.viewer, 10)]
+
+    def test_counts_shared_interests_best_first(self):
+        self.user('some', 1)
+        self.user('all', 0, 1, 2, 3)
+        self.assertEqual(self.overlap(), [('all', 3), ('some', 1)])
+
+    def test_removed_interests_drop_out(self):
+        some = self.user('some', 1)
+        cleared = self.user('cleared', 0, 2)
+        some.interests.remove(self.interests[1])
+        cleared.interests.clear()
+        self.assertEqual(self.overlap(), [])
+
+    def test_rebuild_agrees_with_incremental_updates(self):
+        self.user('some', 1)
+        self.user('all', 0, 1, 2, 3)
+        incremental = self.overlap()
+        interest_index.rebuild()
+        self.assertEqual(self.overlap(), incremental)
+
+
+class DiscoveryPoolTests(TestCase):
+    """Swipes hide candidates from the pool until a rebuild's seen filter covers them."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='x')
+        self.candidates = [
+            User.objects.create_user(username=f'c{i}', email=f'c{i}@example.com', password='x') for i in range(3)
+        ]
+        self.filters = discovery.parse_discovery_filters({}, self.viewer)
+
+    def test_swipe_during_build_keeps_its_tombstone(self):
+        swiped = self.candidates[0]
+        load = discovery.seen.load
+
+        def load_then_swipe(user_id):
+            loaded = load(user_id)
+            discovery.remove_candidate(self.viewer.id, swiped.id)
+            return loaded
+
+        with mock.patch.object(discovery.seen, 'load', side_effect=load_then_swipe):
+            pool = discovery.build_pool(self.viewer, self.filters)
+
+        self.assertIn(str(swiped.id), pool.candidate_ids)
+        page, _ = discovery.take_page(pool, 0, 10)
+        self.assertNotIn(str(swiped.id), page)
+        self.assertEqual(len(page), 2)
+
+    def test_tombstones_outside_the_pool_do_not_rebuild_it(self):
+        pool, page, _ = discovery.deck_page(self.viewer, self.filters, limit=10)
+        self.assertEqual(len(page), 3)
+        outsider = User.objects.create_user(username='late', email='late@example.com', password='x')
+        discovery.remove_candidates(self.viewer.id, [outsider.id, self.candidates[0].id])
+
+        again, page, _ = discovery.deck_page(self.viewer, self.filters, limit=1)
+        self.assertEqual(discovery.pool_version(again), discovery.pool_version(pool))
+        self.assertEqual(len(page), 1)
+
+    def test_deck_that_runs_dry_rebuilds_the_pool(self):
+        pool, _, _ = discovery.deck_page(self.viewer, self.filters, limit=10)
+        discovery.remove_candidates(self.viewer.id, [c.id for c in self.candidates[:2]])
+        late = User.objects.create_user(username='late', email='late@example.com', password='x')
+
+        rebuilt, page, _ = discovery.deck_page(self.viewer, self.filters, limit=10)
+        self.assertNotEqual(discovery.pool_version(rebuilt), discovery.pool_version(pool))
+        self.assertIn(str(late.id), page)
+
+
+class DiscoveryDeckTests(TestCase):
+    """The deck endpoint pages through one pinned pool and rejects cursors it did not issue."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='x')
+        for i in range(5):
+            User.objects.create_user(username=f'c{i}', email=f'c{i}@example.com', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.viewer)
+
+    def page(self, **params):
+        response = self.api.get('/api/discovery/deck/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']], response.data['next_cursor']
+
+    def cursor(self, data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+    def test_pages_cover_the_pool_once(self):
+        first, cursor = self.page(limit=2)
+        second, cursor = self.page(limit=2, cursor=cursor)
+        # A swipe between pages drops the profile from later pages without shifting them
+        pool = DiscoveryPool.objects.get(user=self.viewer)
+        discovery.remove_candidate(self.viewer.id, pool.candidate_ids[4])
+        third, cursor = self.page(limit=2, cursor=cursor)
+        self.assertIsNone(cursor)
+        self.assertEqual(first + second + third, [str(cid) for cid in pool.candidate_ids[:4]])
+
+    def test_tampered_cursors_are_rejected(self):
+        for cursor in ('not-a-cursor!', self.cursor({'v': 1}), self.cursor({'v': 1, 'o': -3}), self.cursor([1, 2])):
+            response = self.api.get('/api/discovery/deck/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_cursor_for_a_replaced_pool_starts_from_the_top(self):
+        first, _ = self.page(limit=2)
+        again, _ = self.page(limit=2, cursor=self.cursor({'v': 1, 'o': 4}))
+        self.assertEqual(again, first)
+
+
+class PairLikeTests(TestCase):
+    """Only the like that completes a pair reports it as newly mutual."""
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+
+    def test_became_mutual_is_reported_once_per_match(self):
+        self.assertEqual(pairs.set_like(self.a.id, self.b.id), (False, False))
+        self.assertEqual(pairs.set_like(self.b.id, self.a.id), (True, True))
+        self.assertEqual(pairs.set_like(self.a.id, self.b.id), (True, False))
+        self.assertEqual(pairs.set_like(self.b.id, self.a.id), (True, False))
+        pairs.clear_like(self.a.id, self.b.id)
+        self.assertEqual(pairs.set_like(self.a.id, self.b.id), (True, True))
+
+
+class LikeMatchTests(TestCase):
+    """A like on an already mutual pair is stored as matched and does not notify again."""
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def like(self, liker, liked):
+        with mock.patch('api.websocket_utils.send_match_notification') as notify:
+            response = self.client_for(liker).post('/api/matches/like/', {'liked': str(liked.id)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data, notify.call_count
+
+    def test_like_after_swipe_match(self):
+        for swiper, profile in ((self.a, self.b), (self.b, self.a)):
+            self.client_for(swiper).post('/api/swipes/', {'profile': str(profile.id), 'swipe_type': 'like'}, format='json')
+        data, notified = self.like(self.a, self.b)
+        self.assertEqual((data['status'], data['mutual_match'], notified), ('matched', True, 0))
+        self.assertEqual(Like.objects.get(pk=data['like_id']).status, Like.LikeStatus.MATCHED)
+        self.assertIsNotNone(membership.conversation_for(data['like_id'], self.a.id))
+
+    def test_like_after_unmatch(self):
+        self.like(self.b, self.a)
+        data, notified = self.like(self.a, self.b)
+        self.assertEqual(notified, 2)
+        response = self.client_for(self.a).post('/api/matches/remove-like/', {'like_id': str(data['like_id'])}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(membership.conversation_for(data['like_id'], self.a.id))
+
+        data, notified = self.like(self.a, self.b)
+        self.assertEqual((data['status'], notified), ('matched', 2))
+        self.assertEqual(Like.objects.get(pk=data['like_id']).status, Like.LikeStatus.MATCHED)
+        self.assertIsNotNone(membership.conversation_for(data['like_id'], self.a.id))
+
+
+class PresenceTests(TestCase):
+    """A user stays online until their last socket closes, and typing events are coalesced."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='u', email='u@example.com', password='x')
+        self.other = User.objects.create_user(username='o', email='o@example.com', password='x')
+
+    def test_online_until_the_last_socket_disconnects(self):
+        presence.connected(self.user.id)
+        presence.connected(self.user.id)
+        self.assertTrue(presence.disconnected(self.user.id))
+        self.assertTrue(presence.is_online(self.user.id))
+        self.assertFalse(presence.disconnected(self.user.id))
+        self.assertFalse(presence.is_online(self.user.id))
+        # A stray disconnect (e.g. after the counter expired) does not go negative
+        self.assertFalse(presence.disconnected(self.user.id))
+        presence.connected(self.user.id)
+        self.assertTrue(presence.is_online(self.user.id))
+
+    def test_heartbeat_restores_an_expired_counter(self):
+        presence.connected(self.user.id)
+        cache.delete(f'presence:online:{self.user.id}')
+        presence.heartbeat(self.user.id)
+        self.assertTrue(presence.is_online(self.user.id))
+
+    def test_snapshot_reads_last_seen_from_the_cache_or_the_database(self):
+        presence.connected(self.user.id)
+        when = timezone.now() - timedelta(days=1)
+        User.objects.filter(id=self.other.id).update(last_seen_at=when)
+        with self.assertNumQueries(1):  # only the user the cache knows nothing about
+            snap = presence.snapshot([self.user.id, self.other.id])
+        self.assertTrue(snap[self.user.id]['is_online'])
+        self.assertIsNotNone(snap[self.user.id]['last_seen_at'])
+        self.assertEqual(snap[self.other.id], {'is_online': False, 'last_seen_at': when})
+
+    def test_typing_burst_sends_once_and_the_latest_held_state_later(self):
+        now = [0.0]
+        typing = presence.TypingCoalescer(rate=2, refresh_interval=3, clock=lambda: now[0])
+        sent = 0
+        for keystroke in range(50):
+            now[0] = keystroke / 50
+            sent += typing.offer(True)
+        self.assertEqual(sent, 1)
+        self.assertEqual([typing.offer(False), typing.offer(True), typing.offer(False)], [True, True, False])
+        self.assertIs(typing.pending, False)
+        now[0] += typing.retry_after()
+        self.assertIs(typing.take_pending(), False)
+
+
+class LikeListPresenceTests(TestCase):
+    """Like lists read everyone's presence in one snapshot, not one cache lookup per profile."""
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.me = User.objects.create_user(username='me', email='me@example.com', password='x', can_see_likes=True)
+        self.others = [User.objects.create_user(username=f'o{i}', email=f'o{i}@example.com', password='x') for i in range(3)]
+        for other in self.others:
+            Like.objects.create(liker=self.me, liked=other)
+            Like.objects.create(liker=other, liked=self.me)
+        presence.connected(self.others[0].id)
+        self.api = APIClient()
+        self.api.force_authenticate(self.me)
+
+    def get(self, url):
+        with mock.patch('api.serializers.presence.is_online', side_effect=AssertionError('per-user lookup')):
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_people_i_like(self):
+        online = {row['liked']['username']: row['liked']['is_online'] for row in self.get('/api/matches/people-i-like/')}
+        self.assertEqual(online, {'o0': True, 'o1': False, 'o2': False})
+
+    def test_people_who_like_me(self):
+        data = self.get('/api/matches/people-who-like-me/')
+        online = {row['user_profile']['username']: row['user_profile']['is_online'] for row in data['results']}
+        self.assertEqual((data['count'], online), (3, {'o0': True, 'o1': False, 'o2': False}))
+
+
+class SwipeBatchTests(TestCase):
+    """A batch answers item by item in request order: bad items are rejected, the rest are applied together."""
+
+    def setUp(self):
+        self.me = User.objects.create_user(username='me', email='me@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+        self.c = User.objects.create_user(username='c', email='c@example.com', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.me)
+
+    def post(self, swipes):
+        response = self.api.post('/api/swipes/batch/', {'swipes': swipes}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_partial_rejects_keep_request_order(self):
+        results = self.post([
+            {'profile': str(self.b.id), 'swipe_type': 'like'},
+            {'profile': 'not-a-uuid', 'swipe_type': 'like'},
+            {'profile': str(self.me.id), 'swipe_type': 'like'},
+            {'profile': str(self.c.id), 'swipe_type': 'dislike'},
+            {'profile': str(uuid.uuid4()), 'swipe_type': 'like'},
+            {'profile': str(self.c.id), 'swipe_type': 'shrug'},
+            {'profile': str(self.c.id), 'swipe_type': 'superlike'},
+            {'profile': str(self.b.id), 'swipe_type': 'like', 'client_ts': '2024-02-30T10:00:00Z'},
+        ])
+        self.assertEqual([r['index'] for r in results], list(range(8)))
+        self.assertEqual(
+            [r['status'] for r in results],
+            ['ok', 'error', 'error', 'superseded', 'error', 'error', 'ok', 'error'],
+        )
+        swipes = dict(Swipe.objects.filter(swiper=self.me).values_list('swiped_on__username', 'swipe_type'))
+        self.assertEqual(swipes, {'b': 'like', 'c': 'superlike'})
+
+    def test_like_back_in_a_batch_matches(self):
+        pairs.set_like(self.b.id, self.me.id)
+        first, second = self.post([
+            {'profile': str(self.b.id), 'swipe_type': 'like'},
+            {'profile': str(self.c.id), 'swipe_type': 'like'},
+        ])
+        self.assertEqual((first['match'], first['is_new_match']), (True, True))
+        self.assertTrue(Match.objects.filter(id=first['match_id']).exists())
+        self.assertEqual((second['match'], 'match_id' in second), (False, False))
+
+    def test_client_clock_ahead_of_ours_is_clamped(self):
+        before = timezone.now()
+        past = (before - timedelta(hours=1)).isoformat()
+        future = (before + timedelta(days=1)).isoformat()
+        self.post([
+            {'profile': str(self.b.id), 'swipe_type': 'dislike', 'client_ts': past},
+            {'profile': str(self.c.id), 'swipe_type': 'dislike', 'client_ts': future},
+        ])
+        at = dict(Swipe.objects.filter(swiper=self.me).values_list('swiped_on__username', 'created_at'))
+        self.assertLess(at['b'], before)
+        self.assertLessEqual(at['c'], timezone.now())
+
+
+class InboxTests(TestCase):
+    """Inbox rows track the last message and each side's unread count as messages are sent and read."""
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x', first_name='Abebe')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x', first_name='Bethel')
+        pairs.set_like(self.a.id, self.b.id)
+        pairs.set_like(self.b.id, self.a.id)
+        self.match, _ = pairs.create_match(self.a.id, self.b.id)
+
+    def inbox(self, user, **params):
+        api = APIClient()
+        api.force_authenticate(user)
+        response = api.get('/api/matches/inbox/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_unread_counts_per_side(self):
+        chat_store.append(self.match, self.a, 'hi')
+        chat_store.append(self.match, self.a, 'are you there?')
+        chat_store.append(self.match, self.b, 'yes')
+        (a_row,), (b_row,) = self.inbox(self.a)['results'], self.inbox(self.b)['results']
+        self.assertEqual((a_row['unread_count'], b_row['unread_count']), (1, 2))
+        self.assertEqual(b_row['other_user']['first_name'], 'Abebe')
+
+        api = APIClient()
+        api.force_authenticate(self.b)
+        self.assertEqual(api.post(f'/api/matches/{self.match.id}/read/').status_code, 200)
+        (a_row,), (b_row,) = self.inbox(self.a)['results'], self.inbox(self.b)['results']
+        self.assertEqual((a_row['unread_count'], b_row['unread_count']), (1, 0))
+        self.assertFalse(Message.objects.filter(match=self.match, sender=self.a, read_at__isnull=True).exists())
+
+    def test_rebuild_agrees_with_incremental_counts(self):
+        chat_store.append(self.match, self.a, 'hi')
+        chat_store.append(self.match, self.b, 'hello')
+        chat_store.append(self.match, self.b, 'how are you?')
+        before = {row['match_id']: row['unread_count'] for row in self.inbox(self.a)['results']}
+        inbox.rebuild(self.a)
+        self.assertEqual({row['match_id']: row['unread_count'] for row in self.inbox(self.a)['results']}, before)
+        self.assertEqual(before, {str(self.match.id): 2})
+
+    def test_pages_follow_last_activity(self):
+        others = []
+        for i in range(3):
+            other = User.objects.create_user(username=f'o{i}', email=f'o{i}@example.com', password='x')
+            pairs.set_like(self.a.id, other.id)
+            pairs.set_like(other.id, self.a.id)
+            match, _ = pairs.create_match(self.a.id, other.id)
+            chat_store.append(match, other, f'message {i}')
+            others.append(str(other.id))
+        first = self.inbox(self.a, limit=2)
+        second = self.inbox(self.a, limit=2, before=first['next_cursor'])
+        ids = [row['other_user']['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, others[::-1] + [str(self.b.id)])
+        self.assertIsNone(second['next_cursor'])
+
+
+class MessageHistoryTests(TestCase):
+    """History pages are keyset ranges on seq, oldest first, with short pages at either end."""
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+        pairs.set_like(self.a.id, self.b.id)
+        pairs.set_like(self.b.id, self.a.id)
+        self.match, _ = pairs.create_match(self.a.id, self.b.id)
+        self.messages = [chat_store.append(self.match, self.a, f'm{i}') for i in range(1, 8)]
+        self.api = APIClient()
+        self.api.force_authenticate(self.b)
+
+    def get(self, **params):
+        return self.api.get(f'/api/matches/{self.match.id}/messages/', params)
+
+    def seqs(self, **params):
+        response = self.get(**params)
+        self.assertEqual(response.status_code, 200)
+        return [row['seq'] for row in response.data]
+
+    def test_scrolling_back_and_catching_up(self):
+        self.assertEqual(self.seqs(limit=3), [5, 6, 7])
+        self.assertEqual(self.seqs(limit=3, before=self.messages[4].id), [2, 3, 4])
+        self.assertEqual(self.seqs(limit=3, before=self.messages[1].id), [1])
+        self.assertEqual(self.seqs(limit=3, since=self.messages[1].id), [3, 4, 5])
+        self.assertEqual(self.seqs(limit=3, since=self.messages[6].id), [])
+
+    def test_bad_anchors_are_rejected(self):
+        self.assertEqual(self.get(before=self.messages[1].id, since=self.messages[2].id).status_code, 400)
+        self.assertEqual(self.get(before='12345').status_code, 400)
+        self.assertEqual(self.get(since='not-an-id').status_code, 400)
+
+    @override_settings(CHAT_HISTORY_MAX_PAGE_SIZE=4)
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.seqs(limit=100), [4, 5, 6, 7])
+        self.assertEqual(self.seqs(limit='lots'), [4, 5, 6, 7])
+
+
+class AppendBatchTests(TestCase):
+    """The chat socket's batched writes survive concurrent retries and failing conversations."""
+
+    def setUp(self):
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+        self.c = User.objects.create_user(username='c', email='c@example.com', password='x')
+        self.ab, _ = pairs.create_match(self.a.id, self.b.id)
+        self.ac, _ = pairs.create_match(self.a.id, self.c.id)
+
+    def test_retry_stored_concurrently_is_returned_not_raised(self):
+        # Another worker stored the retry after append_batch looked for it
+        earlier = Message.objects.create(match=self.ab, sender=self.a, content='hi', client_msg_id='c1')
+        retry = chat_writer.prepare(self.ab.id, self.a, 'hi', 'c1')
+        fresh = chat_writer.prepare(self.ab.id, self.a, 'there', 'c2')
+        self.assertEqual([row.id for row in chat_store._insert_batch(str(self.ab.id), [retry, fresh])], [earlier.id, fresh.id])
+        self.assertEqual(Message.objects.filter(sender=self.a, client_msg_id='c1').count(), 1)
+
+    def test_failing_conversation_does_not_fail_the_others(self):
+        allocate_seq = Match.allocate_seq
+
+        def fail_for_ac(match_id, count=1):
+            if str(match_id) == str(self.ac.id):
+                raise RuntimeError('boom')
+            return allocate_seq(match_id, count)
+
+        messages = [chat_writer.prepare(self.ab.id, self.a, 'to b', 'c1'), chat_writer.prepare(self.ac.id, self.a, 'to c', 'c2')]
+        with mock.patch.object(Match, 'allocate_seq', side_effect=fail_for_ac), self.assertLogs('api.chat_store', 'ERROR'):
+            stored, failed = chat_store.append_batch(messages)
+        self.assertEqual(stored.id, messages[0].id)
+        self.assertIsInstance(failed, RuntimeError)
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['to b'])
+
+    def test_id_collision_fails_instead_of_dropping_the_message(self):
+        # Two processes minted the same id
+        earlier = Message.objects.create(match=self.ac, sender=self.c, content='from c', client_msg_id='c1')
+        clash = chat_writer.prepare(self.ab.id, self.a, 'to b', 'c1')
+        clash.id = earlier.id
+        with self.assertLogs('api.chat_store', 'ERROR'):
+            [result] = chat_store.append_batch([clash])
+        self.assertIsInstance(result, IntegrityError)
+        self.assertFalse(Message.objects.filter(match=self.ab).exists())
+
+
+class NodeLeaseTests(SimpleTestCase):
+    """Processes lease distinct message id nodes and replace a lease they lost."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_leases_are_distinct(self):
+        self.assertNotEqual(message_ids.NodeLease().current(), message_ids.NodeLease().current())
+
+    def test_lost_lease_is_replaced(self):
+        lease = message_ids.NodeLease()
+        node_id = lease.current()
+        cache.set(f'chat_node:{node_id}', 'another process')
+        lease.renew_at = 0
+        self.assertNotEqual(lease.current(), node_id)
+
+
+@override_settings(WS_TOKEN_CACHE_TTL=60, LOCAL_CACHE_AUTH_TTL=5)
+class WsTokenCacheTests(TestCase):
+    """Socket tokens resolve from the cache until they expire or the token is deleted."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='u', email='u@example.com', password='x')
+        self.token = Token.objects.create(user=self.user)
+
+    def later(self, seconds):
+        now = time.time() + seconds
+        return mock.patch('django.core.cache.backends.locmem.time.time', return_value=now)
+
+    def test_reconnects_skip_the_database_until_expiry(self):
+        self.assertEqual(ws_auth._resolve(self.token.key), self.user)
+        User.objects.filter(id=self.user.id).update(is_active=False)  # no signal reaches the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(ws_auth._resolve(self.token.key), self.user)
+        # A process-local cache holds a grant for LOCAL_CACHE_AUTH_TTL, not WS_TOKEN_CACHE_TTL
+        with self.later(6):
+            self.assertIsNone(ws_auth._resolve(self.token.key))
+
+    def test_unknown_tokens_are_cached_for_the_full_ttl(self):
+        self.assertIsNone(ws_auth._resolve('f' * 40))
+        with self.later(30), self.assertNumQueries(0):
+            self.assertIsNone(ws_auth._resolve('f' * 40))
+        with self.later(61), self.assertNumQueries(1):
+            self.assertIsNone(ws_auth._resolve('f' * 40))
+
+    def test_deleted_token_stops_resolving_at_once(self):
+        key = self.token.key
+        self.assertEqual(ws_auth._resolve(key), self.user)
+        self.token.delete()
+        self.assertIsNone(ws_auth._resolve(key))
+
+
+class ChannelBrokerTests(SimpleTestCase):
+    """Broker layers in different processes share groups and deliver to each other's channels."""
+
+    def run_with_broker(self, scenario):
+        async def run():
+            broker = ChannelBroker()
+            server = await broker.serve('127.0.0.1', 0)
+            hosts = [f"127.0.0.1:{server.sockets[0].getsockname()[1]}"]
+            a, b = BrokerChannelLayer(hosts=hosts), BrokerChannelLayer(hosts=hosts)
+            try:
+                return await scenario(broker, a, b)
+            finally:
+                await a.close()
+                await b.close()
+                server.close()
+        return async_to_sync(run)()
+
+    @staticmethod
+    async def until(condition):
+        # Each layer talks to the broker over its own connection; wait for the broker to catch up
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('broker never reached the expected state')
+
+    def test_group_send_reaches_members_in_both_processes(self):
+        async def scenario(broker, a, b):
+            members = [(a, await a.new_channel()), (b, await b.new_channel()), (b, await b.new_channel())]
+            for layer, channel in members:
+                await layer.group_add('chat_1', channel)
+            await self.until(lambda: len(broker.groups.get('chat_1', ())) == 3)
+            with mock.patch('api.channel_layers.write_frame', wraps=channel_layers.write_frame) as write:
+                await a.group_send('chat_1', {'type': 'chat.message', 'n': 1})
+                received = [await asyncio.wait_for(layer.receive(channel), 2) for layer, channel in members]
+            deliveries = [call.args[1] for call in write.call_args_list if call.args[1][0] == 'deliver']
+            return received, deliveries
+
+        received, deliveries = self.run_with_broker(scenario)
+        self.assertEqual([message['n'] for message in received], [1, 1, 1])
+        # One frame per member process, not one per channel
+        self.assertEqual(sorted(len(frame[1]) for frame in deliveries), [1, 2])
+
+    def test_discarded_channel_stops_receiving(self):
+        async def scenario(broker, a, b):
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('chat_1', ca)
+            await b.group_add('chat_1', cb)
+            await b.group_discard('chat_1', cb)
+            await self.until(lambda: list(broker.groups.get('chat_1', ())) == [ca])
+            await b.group_send('chat_1', {'type': 'chat.message'})
+            await asyncio.wait_for(a.receive(ca), 2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(b.receive(cb), 0.2)
+
+        self.run_with_broker(scenario)
+
+    def test_send_to_a_channel_in_another_process(self):
+        async def scenario(broker, a, b):
+            ca = await a.new_channel()
+            # Receiving connects a's process to the broker, which then routes its channels to it
+            receiving = asyncio.ensure_future(a.receive(ca))
+            await self.until(lambda: a.client_id in broker.clients)
+            await b.send(ca, {'type': 'direct'})
+            return await asyncio.wait_for(receiving, 2)
+
+        self.assertEqual(self.run_with_broker(scenario), {'type': 'direct'})
+
+    def test_closed_layer_leaves_its_groups(self):
+        async def scenario(broker, a, b):
+            ca, cb = await a.new_channel(), await b.new_channel()
+            await a.group_add('chat_1', ca)
+            await b.group_add('chat_1', cb)
+            await self.until(lambda: len(broker.groups.get('chat_1', ())) == 2)
+            await b.close()
+            await self.until(lambda: list(broker.groups.get('chat_1', ())) == [ca])
+            self.assertNotIn(b.client_id, broker.clients)
+
+        self.run_with_broker(scenario)
+
+
+class MembershipCacheTests(TestCase):
+    """Cached chat membership answers without queries and is dropped as soon as the pair unmatches."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        self.b = User.objects.create_user(username='b', email='b@example.com', password='x')
+        self.outsider = User.objects.create_user(username='c', email='c@example.com', password='x')
+        Like.objects.create(liker=self.a, liked=self.b).check_for_mutual_match()
+        Like.objects.create(liker=self.b, liked=self.a).check_for_mutual_match()
+        self.like = Like.objects.get(liker=self.a, liked=self.b)
+        self.match = Match.objects.get()
+        self.ids = [self.like.id, Like.objects.get(liker=self.b, liked=self.a).id, self.match.id]
+
+    def test_every_conversation_id_resolves_from_the_cache(self):
+        for conversation_id in self.ids:
+            self.assertEqual(membership.resolve(conversation_id).match_id, str(self.match.id))
+        with self.assertNumQueries(0):
+            for conversation_id in self.ids:
+                self.assertIsNotNone(membership.conversation_for(conversation_id, self.b.id))
+                self.assertIsNone(membership.conversation_for(conversation_id, self.outsider.id))
+
+    def test_unmatch_revokes_access_under_every_id(self):
+        for conversation_id in self.ids:
+            membership.resolve(conversation_id)
+        api = APIClient()
+        api.force_authenticate(self.a)
+        response = api.post('/api/matches/remove-like/', {'like_id': str(self.like.id)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        for conversation_id in self.ids:
+            self.assertIsNone(membership.resolve(conversation_id))
+        api.force_authenticate(self.b)
+        self.assertEqual(api.get(f'/api/matches/{self.match.id}/messages/').data, [])
+
+    def test_deleted_match_is_forgotten(self):
+        membership.resolve(self.match.id)
+        self.match.delete()
+        self.assertIsNone(membership.resolve(self.match.id))
+
+    def test_rematch_is_picked_up(self):
+        # Inactive conversations are never cached, so reactivating needs no invalidation
+        Match.objects.filter(id=self.match.id).update(is_active=False)
+        self.assertIsNone(membership.resolve(self.match.id))
+        Match.objects.filter(id=self.match.id).update(is_active=True)
+        self.assertIsNotNone(membership.resolve(self.match.id))
+
+
+class ChatSocketTests(TransactionTestCase):
+    """The chat socket stores and acknowledges messages."""
+
+    def test_message_without_client_msg_id_is_stored(self):
+        a = User.objects.create_user(username='a', email='a@example.com', password='x')
+        b = User.objects.create_user(username='b', email='b@example.com', password='x')
+        match, _ = pairs.create_match(a.id, b.id)
+        token = Token.objects.create(user=a)
+
+        async def send():
+            socket = ApplicationCommunicator(application, {
+                'type': 'websocket', 'path': f'/ws/chat/{match.id}/', 'query_string': f'token={token.key}'.encode(),
+                'headers': [], 'subprotocols': [],
+            })
+            await socket.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await socket.receive_output(5))['type'], 'websocket.accept')
+            await socket.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'chat_message', 'content': 'hello'})})
+            events = {}
+            while 'message_ack' not in events:
+                event = json.loads((await socket.receive_output(5))['text'])
+                events[event['type']] = event
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await socket.wait(5)
+            return events
+
+        events = async_to_sync(send)()
+        ack = events['message_ack']
+        self.assertEqual(events['chat_message']['message']['client_msg_id'], ack['client_msg_id'])
+        self.assertEqual(Message.objects.get(id=ack['id']).content, 'hello')
+
+
+class EventEnvelopeTests(TestCase):
+    """Events go out as one versioned envelope per group; the socket unpacks only versions it knows."""
+
+    def setUp(self):
+        self.layer = mock.Mock(group_send=mock.AsyncMock())
+        patcher = mock.patch('api.events.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.consumer = MatchNotificationConsumer()
+        self.sent = []
+
+        async def send(text_data):
+            self.sent.append(json.loads(text_data))
+        self.consumer.send = send
+
+    def test_one_envelope_per_group(self):
+        events.send_to_users({1: [{'event': 'gift.sent'}, {'event': 'wallet.updated'}], 2: [{'event': 'x'}], 3: []})
+        self.assertEqual([call.args for call in self.layer.group_send.await_args_list], [
+            ('user_1', {'type': 'notify', 'v': events.ENVELOPE_VERSION,
+                        'events': [{'event': 'gift.sent'}, {'event': 'wallet.updated'}]}),
+            ('user_2', {'type': 'notify', 'v': events.ENVELOPE_VERSION, 'events': [{'event': 'x'}]}),
+        ])
+
+    def test_send_on_commit_waits_for_the_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            events.send_on_commit({1: [{'event': 'x'}]})
+            self.layer.group_send.assert_not_awaited()
+        self.layer.group_send.assert_awaited_once()
+
+    def test_consumer_unpacks_a_current_envelope_in_order(self):
+        async_to_sync(self.consumer.notify)(events.envelope([{'event': 'a'}, {'event': 'b'}]))
+        self.assertEqual(self.sent, [{'event': 'a'}, {'event': 'b'}])
+
+    def test_consumer_accepts_pre_envelope_messages(self):
+        async_to_sync(self.consumer.notify)({'type': 'notify', 'payload': {'event': 'wallet.updated'}})
+        self.assertEqual(self.sent, [{'event': 'wallet.updated'}])
+
+    def test_consumer_drops_unknown_versions(self):
+        with self.assertLogs('api.consumers', 'WARNING'):
+            async_to_sync(self.consumer.notify)({**events.envelope([{'event': 'a'}]), 'v': events.ENVELOPE_VERSION + 1})
+        self.assertEqual(self.sent, [])
+
+
+class NotificationOrderTests(TransactionTestCase):
+    """The notification socket delivers seqs in order and only acknowledges what it delivered."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='u', email='u@example.com', password='x')
+        self.consumer = MatchNotificationConsumer()
+        self.consumer.user = self.user
+        self.consumer.delivered_seq = 0
+        self.sent = []
+
+        async def send(text_data):
+            self.sent.append(json.loads(text_data))
+        self.consumer.send = send
+
+    def test_push_ahead_of_its_predecessor_replays_the_gap(self):
+        first, second = notifications.publish_many(self.user.id, [{'type': 'like'}, {'type': 'match'}])
+        async_to_sync(self.consumer.send_event)(second, {'type': 'match'})
+        async_to_sync(self.consumer.send_event)(first, {'type': 'like'})
+        self.assertEqual([event['seq'] for event in self.sent], [first, second])
+
+    def test_ack_stops_at_the_delivered_seq(self):
+        first, second = notifications.publish_many(self.user.id, [{'type': 'like'}, {'type': 'match'}])
+        async_to_sync(self.consumer.send_event)(first, {'type': 'like'})
+        async_to_sync(self.consumer.receive)(json.dumps({'type': 'ack', 'seq': second}))
+        self.assertEqual(list(NotificationOutbox.objects.values_list('seq', flat=True)), [second])
+
+    @override_settings(NOTIFICATION_OUTBOX_SIZE=3, NOTIFICATION_OUTBOX_TRIM_EVERY=5)
+    def test_outbox_is_trimmed_every_few_publishes(self):
+        for _ in range(4):
+            notifications.publish(self.user.id, {'type': 'like'})
+        self.assertEqual(NotificationOutbox.objects.count(), 4)
+        notifications.publish(self.user.id, {'type': 'like'})
+        self.assertEqual(list(NotificationOutbox.objects.order_by('seq').values_list('seq', flat=True)), [3, 4, 5])
+
+    def test_failed_publish_leaves_the_callers_transaction_usable(self):
+        with transaction.atomic():
+            with mock.patch.object(NotificationOutbox.objects, 'bulk_create', side_effect=IntegrityError('outbox')):
+                with self.assertLogs('api.websocket_utils', 'ERROR'):
+                    websocket_utils.send_like_notification(self.user.id, {'id': 'x'})
+            User.objects.filter(id=self.user.id).update(first_name='still writable')
+        self.assertEqual(User.objects.get(id=self.user.id).first_name, 'still writable')
+
+
+def start_fake_chapa(test):
+    server = FakeChapaServer(port=0)
+    server.start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return server
+
+
+class ChapaClientTests(SimpleTestCase):
+    """Retries and the request-path deadline, against the local fake Chapa."""
+
+    def setUp(self):
+        self.server = start_fake_chapa(self)
+        self.chapa = chapa.ChapaClient(base_url=self.server.base_url, secret_key='test')
+        self.chapa.initialize({'tx_ref': 'tx-1', 'amount': '100'})
+
+    def calls(self, method, prefix):
+        return sum(1 for m, path in self.server.calls if m == method and path.startswith(prefix))
+
+    def test_get_retries_transient_errors(self):
+        self.server.fail_next(1)
+        with self.assertLogs('api.chapa', 'WARNING'):
+            response = self.chapa.verify('tx-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls('GET', '/v1/transaction/verify/'), 2)
+
+    def test_post_that_reached_chapa_is_not_repeated(self):
+        self.server.fail_next(1)
+        response = self.chapa.initialize({'tx_ref': 'tx-2', 'amount': '100'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.calls('POST', '/v1/transaction/initialize'), 2)  # tx-1 in setUp, then tx-2 once
+
+    def test_deadline_bounds_the_whole_call(self):
+        self.server.delay = 1.0
+        started = time.monotonic()
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.chapa.verify('tx-1', deadline=0.3)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+
+class ChapaPaymentViewTests(TransactionTestCase):
+    """Coin purchase, verify and webhook views against the local fake Chapa."""
+
+    def setUp(self):
+        self.server = start_fake_chapa(self)
+        override = override_settings(CHAPA_BASE_URL=self.server.base_url)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='x')
+        self.package = CoinPackage.objects.create(name='Starter', coins=100, price_etb=Decimal('50.00'))
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def purchase(self):
+        response = self.api.post('/api/coins/purchase/', {'package_id': str(self.package.id)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['checkout_url'].startswith('http://127.0.0.1:'))
+        return response.data['tx_ref']
+
+    def test_verify_credits_a_paid_purchase(self):
+        tx_ref = self.purchase()
+        self.server.complete(tx_ref)
+        response = self.api.post('/api/coins/verify-payment/', {'tx_ref': tx_ref}, format='json')
+        self.assertEqual((response.status_code, response.data['status']), (200, 'completed'))
+        self.assertEqual(response.data['new_balance'], 100)
+
+    def test_webhook_acknowledges_before_verifying(self):
+        tx_ref = self.purchase()
+        self.server.complete(tx_ref)
+        self.server.delay = 0.5
+        started = time.monotonic()
+        response = APIClient().post('/api/chapa/webhook/', {'tx_ref': tx_ref, 'status': 'success'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(PendingVerification.objects.filter(tx_ref=tx_ref).exists())
+        chapa.drain(timeout=10)
+        self.assertEqual(CoinPurchase.objects.get(transaction_ref=tx_ref).status, 'completed')
+        self.assertEqual(ledger.balance(self.user.id, ledger.Code.APP_COINS), 100)
+        self.assertFalse(PendingVerification.objects.exists())
+
+    def test_sweep_verifies_what_a_lost_worker_left_pending(self):
+        paid, unpaid = self.purchase(), self.purchase()
+        self.server.complete(paid)
+        # Webhooks recorded, then the worker died before verifying
+        PendingVerification.objects.create(tx_ref=paid, kind='coins')
+        PendingVerification.objects.create(tx_ref=unpaid, kind='coins')
+
+        call_command('verify_pending_payments', older_than=0, stdout=StringIO())
+        self.assertEqual(CoinPurchase.objects.get(transaction_ref=paid).status, 'completed')
+        self.assertEqual(ledger.balance(self.user.id, ledger.Code.APP_COINS), 100)
+        # Chapa still reports the other one pending: kept for the next sweep
+        self.assertEqual(list(PendingVerification.objects.values_list('tx_ref', 'attempts')), [(unpaid, 1)])
+
+        call_command('verify_pending_payments', older_than=0, max_attempts=1, stdout=StringIO())
+        self.assertFalse(PendingVerification.objects.exists())
+        self.assertEqual(CoinPurchase.objects.get(transaction_ref=unpaid).status, 'pending')
+
+
+@override_settings(LEDGER_EARNINGS_SHARDS=4)
+class LedgerTests(TestCase):
+    """Every post balances per currency, never overdraws a user, and the books reconcile."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='u', email='u@example.com', password='x')
+        ledger.transfer('coin_purchase', (None, ledger.Code.COIN_ISSUE), (self.user.id, ledger.Code.COINS), 100)
+
+    def test_unbalanced_post_is_refused(self):
+        with self.assertRaises(ValueError):
+            ledger.post('gift', [(self.user.id, ledger.Code.COINS, -10), (None, ledger.Code.GIFT_PAYOUT, 10)])
+        self.assertEqual(LedgerTransaction.objects.count(), 1)
+
+    def test_overdraft_rolls_back_every_leg(self):
+        with self.assertRaises(ledger.InsufficientFunds) as raised:
+            ledger.post('gift', [
+                (self.user.id, ledger.Code.COINS, -150), (None, ledger.Code.COIN_SPEND, 150),
+                (None, ledger.Code.GIFT_PAYOUT, Decimal('-5.00')), (self.user.id, ledger.Code.EARNINGS, Decimal('5.00')),
+            ])
+        self.assertEqual((raised.exception.code, raised.exception.amount), (ledger.Code.COINS, Decimal('150.00')))
+        self.assertEqual(ledger.balance(self.user.id, ledger.Code.COINS), 100)
+        self.assertEqual(ledger.balance(self.user.id, ledger.Code.EARNINGS), 0)
+        self.assertEqual(LedgerTransaction.objects.count(), 1)
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_entries_record_the_balance_they_leave(self):
+        ledger.transfer('gift', (self.user.id, ledger.Code.COINS), (None, ledger.Code.COIN_SPEND), 30)
+        ledger.transfer('gift', (self.user.id, ledger.Code.COINS), (None, ledger.Code.COIN_SPEND), 30)
+        entries = LedgerEntry.objects.filter(account__user=self.user).order_by('id')
+        self.assertEqual([(e.amount, e.balance_after) for e in entries], [(100, 100), (-30, 70), (-30, 40)])
+
+    def test_system_balance_is_snapshot_plus_tail(self):
+        later = timezone.now() + timedelta(minutes=10)
+        with mock.patch('payments.ledger.timezone.now', return_value=later):
+            self.assertEqual(ledger.snapshot(), 2)
+        ledger.transfer('coin_purchase', (None, ledger.Code.COIN_ISSUE), (self.user.id, ledger.Code.COINS), 50)
+        self.assertEqual(ledger.balance(None, ledger.Code.COIN_ISSUE), -150)
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_reconcile_reports_a_balance_the_entries_do_not_explain(self):
+        LedgerAccount.objects.filter(user=self.user, code=ledger.Code.COINS).update(balance=Decimal('120.00'))
+        self.assertEqual(ledger.reconcile(), [f"account {self.user.id}:{ledger.Code.COINS} holds 120.00, entries say 100.00"])
+
+
+class LedgerShardTests(TestCase):
+    """A debit on a sharded account spends the balance of every shard."""
+
+    def setUp(self):
+        self.creator = User.objects.create_user(username='creator', email='creator@example.com', password='x')
+        for _ in range(20):
+            ledger.transfer('gift', (None, ledger.Code.GIFT_PAYOUT), (self.creator.id, ledger.Code.EARNINGS), Decimal('1.50'))
+
+    def test_withdrawal_folds_every_shard(self):
+        self.assertGreater(LedgerAccount.objects.filter(user=self.creator, code=ledger.Code.EARNINGS).count(), 1)
+        ledger.transfer('withdrawal', (self.creator.id, ledger.Code.EARNINGS), (self.creator.id, ledger.Code.HOLD), Decimal('30.00'))
+        self.assertEqual(set(LedgerAccount.objects.filter(user=self.creator, code=ledger.Code.EARNINGS).values_list('balance', flat=True)), {0})
+        self.assertEqual(ledger.balance(self.creator.id, ledger.Code.HOLD), Decimal('30.00'))
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.transfer('withdrawal', (self.creator.id, ledger.Code.EARNINGS), (self.creator.id, ledger.Code.HOLD), Decimal('0.01'))
+        self.assertEqual(ledger.reconcile(), [])
+
+
+class WalletBalanceQueryTests(TestCase):
+    """Wallet balances are read from the ledger in one query per wallet, or per list."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'w{i}', email=f'w{i}@example.com', password='x') for i in range(3)]
+        for user in self.users:
+            ledger.post('coin_purchase', [
+                (None, ledger.Code.COIN_ISSUE, -40),
+                (user.id, ledger.Code.APP_COINS, 40),
+                (None, ledger.Code.SALES, Decimal('-20.00')),
+                (user.id, ledger.Code.APP_SPENT, Decimal('20.00')),
+            ])
+        self.wallets = [UserWallet.objects.create(user=user) for user in self.users]
+
+    def test_serializer_reads_the_ledger_once(self):
+        wallet = UserWallet.objects.get(pk=self.wallets[0].pk)
+        with self.assertNumQueries(1):
+            data = UserWalletSerializer(wallet).data
+        self.assertEqual((data['coins'], data['total_spent'], data['total_earned']), (40, '20.00', '0.00'))
+
+    def test_list_prefetch_reads_the_ledger_once(self):
+        wallets = list(UserWallet.objects.filter(pk__in=[w.pk for w in self.wallets]))
+        with self.assertNumQueries(1):
+            UserWallet.prefetch_ledger_balances(wallets)
+            data = UserWalletSerializer(wallets, many=True).data
+        self.assertEqual([row['coins'] for row in data], [40, 40, 40])
+
+
+class IdempotentViewTests(TestCase):
+    """Idempotency keys replay final responses, release the key otherwise and never re-run an abandoned claim."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='payer', email='payer@example.com', password='x')
+        self.runs = 0
+        test = self
+
+        class GrantView(APIView):
+            @idempotent
+            def post(self, request):
+                test.runs += 1
+                if request.data.get('n') != 1:
+                    return Response({'detail': 'n must be 1'}, status=400)
+                return Response({'ok': True}, status=201)
+
+        self.view = GrantView.as_view()
+
+    def post(self, n=1, key='k1'):
+        request = APIRequestFactory().post('/grant/', {'n': n}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, self.user)
+        return self.view(request)
+
+    def test_repeat_is_replayed_without_running_the_view(self):
+        self.assertEqual(self.post().status_code, 201)
+        response = self.post()
+        self.assertEqual((response.status_code, response['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(self.runs, 1)
+
+    def test_client_error_releases_the_key(self):
+        self.assertEqual(self.post(n=2).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post().status_code, 201)
+
+    def test_abandoned_claim_is_not_run_again(self):
+        self.assertEqual(self.post().status_code, 201)
+        # As if the worker had died before storing the response
+        IdempotencyKey.objects.update(response_status=None, response_body=None, locked_until=timezone.now() - timedelta(seconds=1))
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('Retry-After', response)
+        self.assertEqual(self.runs, 1)
+
+
+class SendGiftConcurrencyTests(TransactionTestCase):
+    """Parallel gift sends from one wallet must never spend the same coins twice."""
+
+    senders = 100
+    coin_cost = 10
+    starting_coins = 500  # enough for half of the sends
+
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', email='sender@example.com', password='x')
+        self.receiver = User.objects.create_user(username='receiver', email='receiver@example.com', password='x')
+        self.gift = GiftType.objects.create(name='Rose', icon='R', coin_cost=self.coin_cost, etb_value=Decimal('10.00'))
+        UserWallet.objects.create(user=self.sender)
+        ledger.transfer('dev_grant', (None, ledger.Code.COIN_ISSUE), (self.sender.id, ledger.Code.APP_COINS), self.starting_coins)
+
+    def _send(self, barrier, statuses):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+        try:
+            barrier.wait()
+            response = client.post('/api/gifts/send/', {
+                'receiver_id': str(self.receiver.id),
+                'gift_type_id': str(self.gift.id),
+                'quantity': 1,
+            }, format='json')
+            statuses.append(response.status_code)
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def test_no_double_spend_under_parallel_senders(self):
+        barrier = threading.Barrier(self.senders)
+        statuses = []
+        threads = [threading.Thread(target=self._send, args=(barrier, statuses)) for _ in range(self.senders)]
+        with self.assertLogs('django.request', 'WARNING'):  # the 400s
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(statuses), self.senders)
+        self.assertEqual(set(statuses) - {200, 400}, set())
+        sent = statuses.count(200)
+        affordable = self.starting_coins // self.coin_cost
+        self.assertEqual(sent, affordable)
+        self.assertEqual(GiftTransaction.objects.filter(sender=self.sender).count(), sent)
+        self.assertEqual(UserWallet.objects.get(user=self.sender).coins, self.starting_coins - sent * self.coin_cost)
+        share = GiftTransaction.objects.filter(sender=self.sender).first().receiver_share_etb
+        self.assertEqual(ledger.balance(self.receiver.id, ledger.Code.GIFT_EARNINGS), share * sent)
+        self.assertEqual(ledger.reconcile(), [])
+
+
+@override_settings(PAYMENTS_BYPASS=False)
+class GiftShowerTests(TestCase):
+    """A gift shower settles as one transaction: every gift goes out, or none does."""
+
+    def setUp(self):
+        cache.clear()  # shower throttle
+        self.sender = User.objects.create_user(username='sender', email='sender@example.com', password='x')
+        self.recipients = [User.objects.create_user(username=f'r{i}', email=f'r{i}@example.com', password='x') for i in range(2)]
+        self.gift = Gift.objects.create(name='Rose', coins=10, value_etb=Decimal('10.00'))
+        ledger.transfer('dev_grant', (None, ledger.Code.COIN_ISSUE), (self.sender.id, ledger.Code.COINS), 100)
+        self.api = APIClient()
+        self.api.force_authenticate(self.sender)
+
+    def shower(self, quantities):
+        return self.api.post('/api/gifts/shower/', {'items': [
+            {'recipient_id': str(recipient.id), 'gift_id': self.gift.id, 'quantity': quantity}
+            for recipient, quantity in zip(self.recipients, quantities)
+        ]}, format='json')
+
+    def assertNothingMoved(self):
+        self.assertEqual(ledger.balance(self.sender.id, ledger.Code.COINS), 100)
+        self.assertFalse(self.gift.transactions.exists())
+        self.assertFalse(LedgerTransaction.objects.filter(kind='gift_shower').exists())
+        self.assertEqual(ledger.balances([r.id for r in self.recipients], [ledger.Code.EARNINGS]), {
+            (r.id, ledger.Code.EARNINGS): 0 for r in self.recipients
+        })
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_shower_debits_once_and_credits_each_recipient(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.shower([3, 2])
+        self.assertEqual((response.status_code, response.data['gifts_sent']), (200, 5))
+        self.assertEqual(ledger.balance(self.sender.id, ledger.Code.COINS), 50)
+        payout = self.gift.transactions.first().creator_payout
+        for recipient, quantity in zip(self.recipients, [3, 2]):
+            self.assertEqual(ledger.balance(recipient.id, ledger.Code.EARNINGS), payout * quantity)
+        self.assertEqual(LedgerTransaction.objects.filter(kind='gift_shower').count(), 1)
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_failure_after_posting_rolls_back_the_whole_shower(self):
+        with mock.patch.object(AuditLog.objects, 'bulk_create', side_effect=RuntimeError('audit')), \
+                mock.patch('payments.views.events.send_on_commit') as send, self.assertLogs('django.request', 'ERROR'):
+            response = self.shower([3, 2])
+        self.assertEqual(response.status_code, 500)
+        send.assert_not_called()
+        self.assertNothingMoved()
+        self.assertTrue(AuditLog.objects.filter(user=self.sender, event='GIFT_SEND_FAILED').exists())
+
+    def test_overdraft_at_posting_rolls_back_the_gift_rows(self):
+        # Coins spent elsewhere between the balance check and the debit
+        with mock.patch('payments.views.Wallet.coin_balance', new_callable=mock.PropertyMock, return_value=1000), \
+                self.assertLogs('django.request', 'WARNING'):
+            response = self.shower([8, 4])
+        self.assertEqual(response.status_code, 400)
+        self.assertNothingMoved()
+
+    def test_unknown_recipient_is_rejected_before_anything_is_written(self):
+        self.recipients[1] = User(id=uuid.uuid4())
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.shower([1, 1]).status_code, 404)
+        self.assertNothingMoved()
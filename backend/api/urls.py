@@ -5,13 +5,17 @@ from .views import (
     UserRegistrationView, 
     CustomLoginView, 
     CurrentUserView, 
+    LogoutView,
     UserPreferenceView, 
     UserPhotoViewSet, 
     InterestListView, 
+    SharedInterestsView,
     SwipeCreateView, 
+    SwipeBatchView,
     RewindSwipeView,
     MatchListView,
     PotentialMatchView,
+    DiscoveryDeckView,
     CityListView,
     GoogleLoginView,
     ChatbotView,
@@ -27,6 +31,8 @@ from .views import (
     PeopleILikeView,
     PeopleWhoLikeMeView,
     MyMatchesView,
+    InboxView,
+    MarkConversationReadView,
     RemoveLikeView,
     MatchDetailView,
     SendMessageView,
@@ -63,6 +69,7 @@ urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='user-register'),
     path('login/', CustomLoginView.as_view(), name='user-login'),
     path('auth/google/', GoogleLoginView.as_view(), name='google-login'),
+    path('auth/logout/', LogoutView.as_view(), name='logout'),
     # Dev-only login bypass endpoint (requires DEBUG or GOOGLE_AUTH_BYPASS or PAYMENTS_BYPASS)
     path('dev/login/', DevLoginView.as_view(), name='dev-login'),
     # Subscriptions
@@ -72,11 +79,14 @@ urlpatterns = [
     path('user/me/', CurrentUserView.as_view(), name='current-user'),
     path('user/preferences/', UserPreferenceView.as_view(), name='user-preference-detail'),
     path('interests/', InterestListView.as_view(), name='interest-list'),
+    path('interests/shared/', SharedInterestsView.as_view(), name='shared-interests'),
     path('swipes/', SwipeCreateView.as_view(), name='swipe-create'),
+    path('swipes/batch/', SwipeBatchView.as_view(), name='swipe-batch'),
     path('rewind/', RewindSwipeView.as_view(), name='rewind-swipe'),
     path('matches/', MatchListView.as_view(), name='match-list'),
     path('reset-swipes/', ResetSwipesView.as_view(), name='reset-swipes'),
     path('potential-matches/', PotentialMatchView.as_view(), name='potential-match-list'),
+    path('discovery/deck/', DiscoveryDeckView.as_view(), name='discovery-deck'),
     path('cities/', CityListView.as_view(), name='city-list'),
     path('chatbot/', ChatbotView.as_view(), name='chatbot'),
     path('initialize-payment/', InitializePaymentView.as_view(), name='initialize-payment'),
@@ -87,10 +97,12 @@ urlpatterns = [
     path('matches/people-i-like/', PeopleILikeView.as_view(), name='people-i-like'),
     path('matches/people-who-like-me/', PeopleWhoLikeMeView.as_view(), name='people-who-like-me'),
     path('matches/my-matches/', MyMatchesView.as_view(), name='my-matches'),
+    path('matches/inbox/', InboxView.as_view(), name='inbox'),
     path('matches/remove-like/', RemoveLikeView.as_view(), name='remove-like'),
     path('matches/<uuid:pk>/', MatchDetailView.as_view(), name='match-detail'),
     path('matches/<uuid:match_id>/send-message/', SendMessageView.as_view(), name='send-message'),
     path('matches/<uuid:match_id>/messages/', MatchMessagesView.as_view(), name='match-messages'),
+    path('matches/<uuid:match_id>/read/', MarkConversationReadView.as_view(), name='mark-conversation-read'),
     
     # Real-time chat endpoints
     path('chat/<uuid:match_id>/messages/', ChatMessagesView.as_view(), name='chat-messages'),
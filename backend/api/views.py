@@ -1,12 +1,14 @@
 from django.shortcuts import render
-from django.db.models import Q, Count, Case, When, IntegerField, FloatField, Value, F, OuterRef, Subquery
+from django.db.models import Q, Count, FloatField, F, OuterRef, Subquery
 from django.db.models.functions import ExtractYear, Now, Coalesce, Abs, Cast, Replace
 from django.db.models import CharField
+from django.db import transaction
 # from django.contrib.gis.geos import Point # Commented out to avoid GDAL dependency for now
 # from django.contrib.gis.measure import D # For distance # Commented out
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import timedelta
-from dateutil.relativedelta import relativedelta
 from geopy.distance import geodesic # Import geopy
 from django.contrib.auth import authenticate
 from django.views.decorators.csrf import csrf_exempt
@@ -35,6 +37,7 @@ import json
 from rest_framework import status, generics, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
 from django.http import HttpResponse
@@ -47,33 +50,22 @@ from .serializers import (
     UserRegistrationSerializer, UserSerializer, UserPreferenceSerializer, 
     UserPhotoSerializer, InterestSerializer, SwipeSerializer, 
     PotentialMatchSerializer, LikeSerializer, LikeCreateSerializer, 
-    PeopleWhoLikeMeSerializer, ChatbotConversationSerializer, 
-    ChatbotMessageSerializer, ChatMessageSerializer,
+    PeopleWhoLikeMeSerializer, InboxEntrySerializer, ChatbotConversationSerializer, 
+    ChatbotMessageSerializer, MessageSerializer,
     CoinPackageSerializer, UserWalletSerializer,
     CoinPurchaseSerializer, GiftTypeSerializer, GiftTransactionSerializer, SendGiftSerializer
 )
 from .models import (
-    User, UserPreference, UserPhoto, Interest, Swipe, Like, Match, Message, 
-    ChatbotConversation, ChatbotMessage, ChatMessage,
-    CoinPackage, UserWallet, CoinPurchase, GiftType, GiftTransaction, PlatformSettings
+    User, UserPreference, UserPhoto, Interest, Swipe, Like, Match, Message, InboxEntry,
+    ChatbotConversation, ChatbotMessage,
+    CoinPackage, UserWallet, CoinPurchase, GiftType, GiftTransaction, PlatformSettings, UserSubaccount
 )
+from . import chapa, chat_store, discovery, history, inbox, interest_index, membership, pairs, payment_verification, presence, seen
+from .payment_verification import complete_coin_purchase
+from payments import ledger
+from payments.idempotency import idempotent
 # User = get_user_model()
 
-# --- Matchmaking Configuration ---
-# Rebalanced weights to include popularity and implicit preferences
-W_INTERESTS = 0.20
-W_AGE = 0.20
-W_LOCATION = 0.20
-W_RELIGION = 0.10 # Explicit preference
-W_GENDER = 0.05
-W_POPULARITY = 0.15
-W_IMPLICIT_PREFS = 0.10 # New weight for learned preferences
-
-# Normalization constants
-MAX_COMMON_INTERESTS = 5  # Max interests to consider for full score
-MAX_DISTANCE_KM = 100.0  # Max distance for score calculation
-MAX_LIKES_FOR_SCORE = 50 # A user with 50 likes in the last 30 days gets the max popularity score
-
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
@@ -394,6 +386,16 @@ class DevLoginView(APIView):
         data = UserSerializer(user, context={'request': request}).data
         return Response({"token": token.key, "user": data}, status=status.HTTP_200_OK)
 
+class LogoutView(APIView):
+    """Delete the caller's auth token; open WebSockets using it stop re-authenticating"""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        request.auth.delete()
+        return Response({'status': 'logged out'}, status=status.HTTP_200_OK)
+
+
 class CurrentUserView(generics.RetrieveUpdateAPIView):
     authentication_classes = [TokenAuthentication]
     serializer_class = UserSerializer
@@ -538,24 +540,19 @@ class SwipeCreateView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         swipe = serializer.save()
 
-        # After saving the swipe, check if it resulted in a match
-        if swipe.swipe_type == 'like':
-            # Check for a mutual like from the other user
-            if Swipe.objects.filter(swiper=swipe.swiped_on, swiped_on=swipe.swiper, swipe_type='like').exists():
+        # After saving the swipe, record it in the pair state; the upsert reports a new match directly
+        if swipe.swipe_type in (Swipe.SwipeType.LIKE, Swipe.SwipeType.SUPERLIKE):
+            is_mutual, became_mutual = pairs.set_like(swipe.swiper_id, swipe.swiped_on_id)
+            if became_mutual:
                 # It's a match!
-                user1, user2 = sorted([swipe.swiper, swipe.swiped_on], key=lambda u: u.id)
-                match, created = Match.objects.get_or_create(user1=user1, user2=user2)
-                
-                if created:
-                    # Return the new match data
-                    match_serializer = LikeSerializer(match, context={'request': request})
-                    return Response({'match': True, 'is_new_match': True, 'data': match_serializer.data}, status=status.HTTP_201_CREATED)
-                else:
-                    # A match already existed
-                    return Response({'match': True, 'is_new_match': False}, status=status.HTTP_200_OK)
-            else:
-                # A 'like' swipe that did not result in a match
-                return Response({'match': False, 'is_new_match': False}, status=status.HTTP_200_OK)
+                match, _ = pairs.create_match(swipe.swiper_id, swipe.swiped_on_id)
+                match_serializer = LikeSerializer(match, context={'request': request})
+                return Response({'match': True, 'is_new_match': True, 'data': match_serializer.data}, status=status.HTTP_201_CREATED)
+            if is_mutual:
+                # A match already existed
+                return Response({'match': True, 'is_new_match': False}, status=status.HTTP_200_OK)
+            # A 'like' swipe that did not result in a match
+            return Response({'match': False, 'is_new_match': False}, status=status.HTTP_200_OK)
 
         # For 'pass' swipes or any other type
         return Response({'match': False, 'is_new_match': False}, status=status.HTTP_200_OK)
@@ -564,70 +561,197 @@ class SwipeCreateView(generics.CreateAPIView):
  
 
 
+class SwipeBatchView(APIView):
+    """
+    Apply an ordered batch of queued swipes in one request.
+
+    Body: {"swipes": [{"profile": <uuid>, "swipe_type": "like"|"dislike"|"superlike",
+    "client_ts": <ISO 8601, optional>}, ...]}. Valid items are written in one
+    transaction with bulk statements; if a profile appears more than once the
+    last item wins. Returns one result per item, in request order, including
+    any matches the batch created.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    LIKE_TYPES = (Swipe.SwipeType.LIKE, Swipe.SwipeType.SUPERLIKE)
+
+    def _parse_item(self, user, item, now):
+        if not isinstance(item, dict):
+            return None, 'Each swipe must be an object'
+        try:
+            profile_id = uuid.UUID(str(item.get('profile')))
+        except ValueError:
+            return None, 'Invalid profile id'
+        if profile_id == user.id:
+            return None, 'You cannot swipe on yourself.'
+        swipe_type = item.get('swipe_type')
+        if swipe_type not in Swipe.SwipeType.values:
+            return None, 'Invalid swipe_type'
+        swiped_at = now
+        if item.get('client_ts'):
+            try:
+                # parse_datetime raises on well-formed but impossible dates (e.g. Feb 30)
+                swiped_at = parse_datetime(str(item['client_ts']))
+            except ValueError:
+                swiped_at = None
+            if swiped_at is None:
+                return None, 'Invalid client_ts'
+            if timezone.is_naive(swiped_at):
+                swiped_at = timezone.make_aware(swiped_at)
+            # Never trust a client clock that runs ahead of ours
+            swiped_at = min(swiped_at, now)
+        return (profile_id, swipe_type, swiped_at), None
+
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        items = request.data.get('swipes')
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'swipes must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.SWIPE_BATCH_MAX_SIZE:
+            return Response(
+                {'error': f'At most {settings.SWIPE_BATCH_MAX_SIZE} swipes per batch'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        now = timezone.now()
+        results = [None] * len(items)
+        parsed = {}
+        for index, item in enumerate(items):
+            value, error = self._parse_item(user, item, now)
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error}
+            else:
+                parsed[index] = value
+
+        existing = set(User.objects.filter(id__in={v[0] for v in parsed.values()}).values_list('id', flat=True))
+        latest = {}  # profile -> (index, swipe_type, swiped_at); later items win
+        for index, (profile_id, swipe_type, swiped_at) in parsed.items():
+            if profile_id not in existing:
+                results[index] = {'index': index, 'status': 'error', 'error': 'The profile you tried to swipe on does not exist.'}
+                continue
+            latest[profile_id] = (index, swipe_type, swiped_at)
+
+        liked = [p for p, (_, t, _) in latest.items() if t in self.LIKE_TYPES]
+        disliked = [p for p, (_, t, _) in latest.items() if t not in self.LIKE_TYPES]
+        pair_results, matches = {}, {}
+        with transaction.atomic():
+            Swipe.objects.bulk_create(
+                [
+                    Swipe(swiper=user, swiped_on_id=p, swipe_type=t, created_at=at)
+                    for p, (_, t, at) in latest.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['swiper', 'swiped_on'],
+                update_fields=['swipe_type', 'created_at'],
+            )
+            if disliked:
+                pairs.clear_likes(user.id, disliked)
+            if liked:
+                pair_results = pairs.set_likes(user.id, liked)
+                matches = pairs.create_matches(user.id, [p for p, (_, became) in pair_results.items() if became])
+
+        # bulk_create skips post_save, so sync the discovery pool and seen filter here
+        if latest:
+            discovery.remove_candidates(user.id, list(latest))
+            seen.record(user.id, list(latest))
+
+        for profile_id, (index, swipe_type, _) in latest.items():
+            is_mutual, became_mutual = pair_results.get(profile_id, (False, False))
+            result = {
+                'index': index,
+                'status': 'ok',
+                'profile': str(profile_id),
+                'swipe_type': swipe_type,
+                'match': is_mutual,
+                'is_new_match': became_mutual,
+            }
+            if profile_id in matches:
+                result['match_id'] = str(matches[profile_id][0].id)
+            results[index] = result
+        for index, (profile_id, _, _) in parsed.items():
+            if results[index] is None:
+                results[index] = {'index': index, 'status': 'superseded', 'profile': str(profile_id)}
+
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
 class PotentialMatchView(generics.ListAPIView):
     """
     View to list potential matches for the authenticated user.
-    Applies discovery filters from query parameters.
+    Applies discovery filters from query parameters and serves the deck
+    from the user's precomputed discovery pool (see api/discovery.py).
     """
     serializer_class = PotentialMatchSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
 
-    def get_queryset(self):
-        user = self.request.user
+    def list(self, request, *args, **kwargs):
+        filters = discovery.parse_discovery_filters(request.query_params, request.user)
+        _, candidate_ids, _ = discovery.deck_page(request.user, filters)
+        profiles = discovery.load_profiles(candidate_ids)
+        serializer = self.get_serializer(profiles, many=True)
+        return Response(serializer.data)
 
-        # --- 1. Initial Filtering: Exclude self and swiped users ---
-        swiped_user_ids = Swipe.objects.filter(swiper=user).values_list('swiped_on_id', flat=True)
-        potential_matches_qs = User.objects.exclude(id=user.id).exclude(id__in=swiped_user_ids)
 
-        # --- 2. Exclude users with no photos (re-enable this for production) ---
-        # potential_matches_qs = potential_matches_qs.annotate(num_photos=Count('photos')).filter(num_photos__gt=0)
+class DiscoveryDeckView(APIView):
+    """
+    Cursor-paginated discovery deck.
 
-        # --- 3. Apply Discovery Filters from Query Params ---
-        filters = self.request.query_params
-        min_age_raw = filters.get('minAge')
-        max_age_raw = filters.get('maxAge')
-        gender = filters.get('gender')
+    Returns at most ``limit`` profiles plus an opaque ``next_cursor``. The
+    cursor pins the pool version, so every page of a session comes from the
+    same stable order. No COUNT is run, and each request touches only its
+    own page, however large the pool is.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
 
-        # Parse age values safely
+    def get(self, request, *args, **kwargs):
         try:
-            min_age = int(min_age_raw) if min_age_raw is not None else None
-        except (ValueError, TypeError):
-            min_age = None
+            limit = int(request.query_params.get('limit', settings.DISCOVERY_DECK_SIZE))
+        except (TypeError, ValueError):
+            limit = settings.DISCOVERY_DECK_SIZE
+        limit = max(1, min(limit, settings.DISCOVERY_DECK_MAX_PAGE_SIZE))
+
+        raw_cursor = request.query_params.get('cursor')
+        cursor = discovery.decode_cursor(raw_cursor)
+        if raw_cursor and cursor is None:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters = discovery.parse_discovery_filters(request.query_params, request.user)
+        version, offset = cursor if cursor else (None, 0)
+        # A cursor for a pool rebuilt since it was issued starts the new one from the top
+        pool, candidate_ids, next_offset = discovery.deck_page(request.user, filters, offset, limit, version=version)
+        profiles = discovery.load_profiles(candidate_ids)
+        has_more = next_offset < len(pool.candidate_ids)
+        return Response({
+            'results': PotentialMatchSerializer(profiles, many=True, context={'request': request}).data,
+            'next_cursor': discovery.encode_cursor(pool, next_offset) if has_more else None,
+        })
+
+
+class SharedInterestsView(APIView):
+    """
+    Users who share the most interests with the authenticated user, best first.
+    Served from the interest bitmap index (see api/interest_index.py).
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
         try:
-            max_age = int(max_age_raw) if max_age_raw is not None else None
-        except (ValueError, TypeError):
-            max_age = None
-
-        # Only apply age filters if they are not the frontend defaults (18-99).
-        # This prevents excluding users who haven't set their DOB yet during onboarding.
-        if not (min_age == 18 and max_age == 99):
-            today = timezone.now().date()
-            if min_age is not None:
-                latest_birth_date = today - relativedelta(years=min_age)
-                potential_matches_qs = potential_matches_qs.filter(date_of_birth__lte=latest_birth_date)
-            if max_age is not None:
-                earliest_birth_date = today - relativedelta(years=(max_age + 1))
-                potential_matches_qs = potential_matches_qs.filter(date_of_birth__gte=earliest_birth_date)
-
-        if gender and gender.lower() != 'all':
-            potential_matches_qs = potential_matches_qs.filter(gender__iexact=gender)
-
-        # --- 4. Final Step: Prioritize boosted users, then random ---
-        boost_score = Case(
-            When(has_boost=True, then=Value(1)),
-            default=Value(0),
-            output_field=IntegerField(),
-        )
-        return potential_matches_qs.annotate(boost_score=boost_score).order_by('-boost_score', '?')
+            limit = int(request.query_params.get('limit', settings.SHARED_INTERESTS_PAGE_SIZE))
+        except (TypeError, ValueError):
+            limit = settings.SHARED_INTERESTS_PAGE_SIZE
+        limit = max(1, min(limit, settings.SHARED_INTERESTS_PAGE_SIZE))
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        # --- Debugging ---
-        print(f"[DEBUG] Found {queryset.count()} potential matches with filters: {request.query_params}")
-        # --- End Debugging ---
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        ranked = interest_index.top_overlap(request.user, limit)
+        profiles = discovery.load_profiles([user_id for user_id, _ in ranked])
+        shared = dict(ranked)
+        data = PotentialMatchSerializer(profiles, many=True, context={'request': request}).data
+        for profile, item in zip(profiles, data):
+            item['shared_interests_count'] = shared[str(profile.id)]
+        return Response(data)
 
 
 class ChatbotView(APIView):
@@ -718,11 +842,6 @@ class InitializePaymentView(APIView):
             }
         }
 
-        headers = {
-            'Authorization': f"Bearer {os.environ.get('CHAPA_SECRET_KEY')}",
-            'Content-Type': 'application/json'
-        }
-
         # Avoid logging secrets directly
         sk = os.environ.get('CHAPA_SECRET_KEY', '')
         logging.info(f"Using Chapa Secret Key: {'***' + sk[-4:] if sk else 'MISSING'}") # Masked
@@ -730,8 +849,7 @@ class InitializePaymentView(APIView):
         try:
             logging.info(f"Initializing Chapa payment for user {user.id} with tx_ref: {tx_ref}")
             logging.info(f"Chapa payload: {payload}")
-            url = 'https://api.chapa.co/v1/transaction/initialize'
-            response = requests.post(url, headers=headers, json=payload, timeout=(10, 20)) # (connect, read)
+            response = chapa.initialize(payload)
             response.raise_for_status() 
             data = response.json()
             logging.debug(f"Chapa response: {data}")
@@ -787,37 +905,11 @@ class ChapaWebhookView(APIView):
             return Response({'error': 'Invalid webhook data'}, status=status.HTTP_400_BAD_REQUEST)
 
         if status_from_webhook == 'success':
-            # Verify the transaction again with Chapa's API as a security measure
-            headers = {
-                'Authorization': f"Bearer {os.environ.get('CHAPA_SECRET_KEY')}",
-            }
-            verification_url = f'https://api.chapa.co/v1/transaction/verify/{tx_ref}'
-            
-            try:
-                logging.info(f"Verifying Chapa transaction for tx_ref: {tx_ref}")
-                response = requests.get(verification_url, headers=headers, timeout=(10, 20)) # (connect, read)
-                response.raise_for_status()
-                verification_data = response.json()
-
-                if verification_data.get('data', {}).get('status') == 'success':
-                    # Find the user associated with the transaction
-                    try:
-                        user = User.objects.get(current_payment_tx_ref=tx_ref)
-                    except User.DoesNotExist:
-                        logging.error(f"Webhook received for tx_ref {tx_ref}, but no user found with this ref.")
-                        return Response(status=status.HTTP_404_NOT_FOUND)
-
-                    if not user.is_premium:
-                        user.is_premium = True
-                        user.current_payment_tx_ref = None # Clear the ref after successful payment
-                        user.save()
-                        logging.info(f"Successfully granted premium access to user {user.id} for tx_ref: {tx_ref}")
-                    return Response(status=status.HTTP_200_OK)
-                else:
-                    logging.warning(f"Webhook verification for tx_ref {tx_ref} resulted in status: {verification_data.get('data', {}).get('status')}")
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Webhook verification failed for tx_ref: {tx_ref}. Error: {e}")
-                return Response({'error': 'Verification request failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if not User.objects.filter(current_payment_tx_ref=tx_ref).exists():
+                logging.error(f"Webhook received for tx_ref {tx_ref}, but no user found with this ref.")
+                return Response(status=status.HTTP_404_NOT_FOUND)
+            # Verified with Chapa's API as a security measure, in the background: recorded, then acknowledged
+            payment_verification.enqueue('premium', tx_ref)
 
         return Response({'status': 'webhook received'}, status=status.HTTP_200_OK)
 
@@ -832,26 +924,15 @@ def check_match(request, profile_id):
         return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
     # Check if the other user has already liked the current user
-    mutual_swipe = Swipe.objects.filter(
-        swiper=swiped_on, 
-        swiped_on=swiper,
-        swipe_type__in=[Swipe.SwipeType.LIKE, Swipe.SwipeType.SUPERLIKE]
-    ).exists()
-
-    if mutual_swipe:
-        # It's a match! Create a Match instance.
-        # Ensure user1 and user2 are ordered to prevent duplicates (user1.id < user2.id)
-        user1, user2 = sorted([swiper, swiped_on], key=lambda u: str(u.id))
-        match, created = Match.objects.get_or_create(user1=user1, user2=user2)
-
+    if pairs.is_liked_by(swiped_on.id, swiper.id):
+        # It's a match! Create (or fetch) the Match instance for the pair.
+        match, created = pairs.create_match(swiper.id, swiped_on.id)
+        serializer = LikeSerializer(match, context={'request': request})
         if created:
             # A new match was created
-            serializer = LikeSerializer(match, context={'request': request})
             return Response({'match': True, 'is_new_match': True, 'data': serializer.data}, status=status.HTTP_201_CREATED)
-        else:
-            # A match already existed
-            serializer = LikeSerializer(match, context={'request': request})
-            return Response({'match': True, 'is_new_match': False, 'data': serializer.data}, status=status.HTTP_200_OK)
+        # A match already existed
+        return Response({'match': True, 'is_new_match': False, 'data': serializer.data}, status=status.HTTP_200_OK)
 
     return Response({'match': False}, status=status.HTTP_200_OK)
 
@@ -898,6 +979,8 @@ class ResetSwipesView(APIView):
         count, _ = Swipe.objects.filter(swiper=user).delete()
         # Also delete any matches the user is part of, as they are now invalid
         Match.objects.filter(Q(user1=user) | Q(user2=user)).delete()
+        # Swiped profiles are eligible again, so the discovery pool must be rebuilt
+        discovery.invalidate_pool(user)
         return Response({'message': f'Successfully deleted {count} swipes and all related matches.'}, status=status.HTTP_200_OK)
 
 
@@ -946,34 +1029,20 @@ class VerifyPaymentView(APIView):
         )
 
         if tx_ref:
-            headers = {
-                'Authorization': f"Bearer {os.environ.get('CHAPA_SECRET_KEY')}",
-            }
-            verification_url = f'https://api.chapa.co/v1/transaction/verify/{tx_ref}'
-
             try:
                 logging.info(f"[VerifyPaymentView] Attempting direct verification for tx_ref: {tx_ref}")
-                resp = requests.get(verification_url, headers=headers, timeout=(10, 20))
-                resp.raise_for_status()
-                verification_data = resp.json()
-
-                if verification_data.get('data', {}).get('status') == 'success':
-                    # Upgrade the user and clear the stored tx_ref
-                    if not user.is_premium:
-                        user.is_premium = True
-                        # Clear if it matches current stored ref to avoid stomping unrelated state
-                        if getattr(user, 'current_payment_tx_ref', None) == tx_ref:
-                            user.current_payment_tx_ref = None
-                        user.save()
-                        logging.info(f"[VerifyPaymentView] Upgraded user {user.id} to premium after direct verification of {tx_ref}")
+                # Same call as the webhook's, so the two share one verification
+                verification = chapa.defer_once(payment_verification.verify_premium, tx_ref).result(
+                    timeout=settings.CHAPA_REQUEST_DEADLINE
+                )
+                # Premium goes to the user holding tx_ref, so only report success if that is this user
+                if verification.status == 'success' and User.objects.filter(pk=user.pk, is_premium=True).exists():
                     return Response({'status': 'success', 'message': 'Account is premium.'}, status=status.HTTP_200_OK)
-                else:
-                    st = verification_data.get('data', {}).get('status')
-                    logging.warning(f"[VerifyPaymentView] Direct verification for {tx_ref} returned status: {st}")
-                    return Response({'status': 'pending', 'message': f'Awaiting webhook/verification. Provider status: {st or "unknown"}.'}, status=status.HTTP_202_ACCEPTED)
-            except requests.exceptions.RequestException as e:
-                logging.error(f"[VerifyPaymentView] Direct verification failed for tx_ref {tx_ref}: {e}")
-                # Network/timeout/errors -> allow frontend to retry shortly
+                logging.warning(f"[VerifyPaymentView] Direct verification for {tx_ref} returned status: {verification.status}")
+                return Response({'status': 'pending', 'message': f'Awaiting webhook/verification. Provider status: {verification.status or "unknown"}.'}, status=status.HTTP_202_ACCEPTED)
+            except (FutureTimeout, requests.exceptions.RequestException) as e:
+                # Still running (it completes in the background) or failed: the frontend retries shortly
+                logging.error(f"[VerifyPaymentView] Direct verification failed for tx_ref {tx_ref}: {e!r}")
                 return Response({'status': 'pending', 'message': 'Verification request failed. Please retry shortly.'}, status=status.HTTP_202_ACCEPTED)
 
         # No tx_ref provided and user not yet premium -> allow frontend to retry while waiting for webhook
@@ -1107,14 +1176,7 @@ class SubscribePlanView(APIView):
         try:
             logging.info(f"Chapa subscription payload: {chapa_payload}")
             
-            chapa_response = requests.post(
-                'https://api.chapa.co/v1/transaction/initialize',
-                json=chapa_payload,
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
+            chapa_response = chapa.initialize(chapa_payload)
             
             logging.info(f"Chapa subscription response status: {chapa_response.status_code}")
             logging.info(f"Chapa subscription response body: {chapa_response.text}")
@@ -1204,7 +1266,7 @@ class LikeUserView(APIView):
             like = serializer.save()
             # Check for mutual match
             logging.info(f"Calling check_for_mutual_match for like: {like.id}")
-            match = like.check_for_mutual_match()
+            match, became_mutual = like.check_for_mutual_match()
             logging.info(f"Mutual match result: {match}")
             
             response_data = {
@@ -1218,27 +1280,19 @@ class LikeUserView(APIView):
             if match:
                 response_data['match_data'] = LikeSerializer(match, context={'request': request}).data
                 
-                # Send real-time notifications to both users (disabled for now)
-                # from .websocket_utils import send_match_notification
-                # from .serializers import UserSerializer
-                
-                # match_data = LikeSerializer(match, context={'request': request}).data
-                # user1_data = UserSerializer(like.liker, context={'request': request}).data
-                # user2_data = UserSerializer(like.liked, context={'request': request}).data
-                
-                # Notify both users about the match
-                # send_match_notification(like.liker.id, {
-                #     'id': str(match.id),
-                #     'other_user': user2_data,
-                #     'matched_at': match.matched_at.isoformat()
-                # })
-                # send_match_notification(like.liked.id, {
-                #     'id': str(match.id),
-                #     'other_user': user1_data,
-                #     'matched_at': match.matched_at.isoformat()
-                # })
-                
-                logging.info(f"Mutual match created between {like.liker.first_name} and {like.liked.first_name}")
+                if became_mutual:
+                    # Notify both users once per match; stored in their outboxes if they are offline
+                    from .websocket_utils import send_match_notification
+                    for user, other_user in ((like.liker, like.liked), (like.liked, like.liker)):
+                        send_match_notification(user.id, {
+                            'id': str(like.id),
+                            'other_user': {'id': str(other_user.id), 'first_name': other_user.first_name},
+                        })
+                    logging.info(f"Mutual match created between {like.liker.first_name} and {like.liked.first_name}")
+            elif like.liked.can_see_likes:
+                # Subscribers see who liked them as it happens
+                from .websocket_utils import send_like_notification
+                send_like_notification(like.liked.id, {'id': str(like.liker.id), 'first_name': like.liker.first_name})
                 
             return Response(response_data, status=status.HTTP_201_CREATED)
             
@@ -1262,7 +1316,14 @@ class PeopleILikeView(generics.ListAPIView):
         return Like.objects.filter(
             liker=self.request.user,
             status__in=[Like.LikeStatus.LIKED, Like.LikeStatus.MATCHED]
-        ).select_related('liked').prefetch_related('liked__photos')
+        ).select_related('liker', 'liked').prefetch_related('liker__photos', 'liked__photos')
+
+    def list(self, request, *args, **kwargs):
+        likes = list(self.get_queryset())
+        # One cache round trip for everyone's presence instead of one per user
+        context = self.get_serializer_context()
+        context['presence'] = presence.snapshot({request.user.id} | {like.liked_id for like in likes})
+        return Response(self.get_serializer_class()(likes, many=True, context=context).data)
 
 
 class PeopleWhoLikeMeView(generics.ListAPIView):
@@ -1278,19 +1339,23 @@ class PeopleWhoLikeMeView(generics.ListAPIView):
         ).select_related('liker').prefetch_related('liker__photos')
     
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
+        likes = list(self.get_queryset())
         
         # Add subscription upsell info for non-subscribers
         response_data = {
-            'count': queryset.count(),
+            'count': len(likes),
             'has_subscription': request.user.can_see_likes,
             'results': []
         }
         
-        if not request.user.can_see_likes and queryset.count() > 0:
-            response_data['upsell_message'] = f"You have {queryset.count()} people who liked you! Subscribe to see who they are."
+        if not request.user.can_see_likes and likes:
+            response_data['upsell_message'] = f"You have {len(likes)} people who liked you! Subscribe to see who they are."
         
-        serializer = self.get_serializer(queryset, many=True)
+        context = self.get_serializer_context()
+        if request.user.can_see_likes:
+            # Revealed profiles carry presence: one cache round trip for all of them
+            context['presence'] = presence.snapshot({like.liker_id for like in likes})
+        serializer = self.get_serializer_class()(likes, many=True, context=context)
         response_data['results'] = serializer.data
         
         return Response(response_data)
@@ -1311,6 +1376,75 @@ class MyMatchesView(generics.ListAPIView):
             'liker__photos', 'liked__photos'
         ).order_by('-updated_at')
 
+    def list(self, request, *args, **kwargs):
+        likes = list(self.get_queryset())
+        # One cache round trip for everyone's presence instead of one per user
+        user_ids = {u for like in likes for u in (like.liker_id, like.liked_id)}
+        context = self.get_serializer_context()
+        context['presence'] = presence.snapshot(user_ids)
+        return Response(self.get_serializer_class()(likes, many=True, context=context).data)
+
+
+class InboxView(APIView):
+    """
+    The current user's conversations, most recent activity first, with the last
+    message and unread count. Served from InboxEntry (see api/inbox.py).
+    Page with ``?before=<cursor>`` using ``next_cursor`` from the previous page.
+    """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', settings.INBOX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            limit = settings.INBOX_PAGE_SIZE
+        limit = max(1, min(limit, settings.INBOX_PAGE_SIZE))
+
+        entries = InboxEntry.objects.filter(user=request.user, is_active=True)
+        before = request.query_params.get('before')
+        if before:
+            position = inbox.decode_cursor(before)
+            if position is None:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            activity, entry_id = position
+            entries = entries.filter(
+                Q(last_activity_at__lt=activity) | Q(last_activity_at=activity, id__lt=entry_id)
+            )
+        page = list(entries.order_by('-last_activity_at', '-id')[:limit + 1])
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = inbox.encode_cursor(page[-1])
+        return Response({
+            'results': InboxEntrySerializer(page, many=True, context={
+                'request': request,
+                'presence': presence.snapshot({entry.other_user_id for entry in page}),
+            }).data,
+            'next_cursor': next_cursor,
+        })
+
+
+class MarkConversationReadView(APIView):
+    """Mark a conversation (addressed by Like id, as the chat endpoints do, or Match id) as read"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+
+    def post(self, request, match_id, *args, **kwargs):
+        user = request.user
+        match = Match.objects.filter(id=match_id).first()
+        if match is None:
+            like = Like.objects.filter(id=match_id, status=Like.LikeStatus.MATCHED).first()
+            match = pairs.get_match(like.liker_id, like.liked_id) if like else None
+        if match is None:
+            return Response({'error': 'Match not found'}, status=status.HTTP_404_NOT_FOUND)
+        if user.id not in (match.user1_id, match.user2_id):
+            return Response({'error': 'You are not part of this match'}, status=status.HTTP_403_FORBIDDEN)
+
+        inbox.mark_read(user.id, match)
+        return Response({'status': 'read'})
+
 
 class RemoveLikeView(APIView):
     """Remove/undo a like"""
@@ -1379,34 +1513,22 @@ class SendMessageView(APIView):
         try:
             user = request.user
             # The match_id is actually a like_id in our system
-            like = Like.objects.get(
-                id=match_id,
-                status=Like.LikeStatus.MATCHED
-            )
+            conversation = membership.resolve(match_id)
+            if conversation is None:
+                return Response({'error': 'Match not found'}, status=status.HTTP_404_NOT_FOUND)
             
             # Verify user is part of this match
-            if user not in [like.liker, like.liked]:
+            if str(user.id) not in conversation.participants:
                 return Response({'error': 'You are not part of this match'}, status=status.HTTP_403_FORBIDDEN)
             
-            # Get the corresponding Match object
-            user1, user2 = sorted([like.liker, like.liked], key=lambda u: str(u.id))
-            match = Match.objects.get(user1=user1, user2=user2)
+            match = Match.objects.get(id=conversation.match_id)
             
             content = request.data.get('content', '').strip()
             if not content:
                 return Response({'error': 'Message content is required'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Create message
-            from .models import Message
-            message = Message.objects.create(
-                match=match,
-                sender=user,
-                content=content
-            )
-            
-            # Update match last interaction
-            match.last_interaction_at = timezone.now()
-            match.save(update_fields=['last_interaction_at'])
+            # Create message (also bumps the match's last interaction)
+            message = chat_store.append(match, user, content)
             
             # Send real-time notification to the other user (disabled for now)
             # from .websocket_utils import send_message_notification
@@ -1428,7 +1550,8 @@ class SendMessageView(APIView):
             # )
             
             return Response({
-                'id': message.id,
+                'id': str(message.id),
+                'seq': message.seq,
                 'content': message.content,
                 'sender_id': str(user.id),
                 'sent_at': message.sent_at.isoformat(),
@@ -1440,7 +1563,7 @@ class SendMessageView(APIView):
 
 
 class MatchMessagesView(generics.ListAPIView):
-    """Get messages for a specific match"""
+    """Get messages for a specific match, one keyset page at a time (see api/history.py)"""
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
     
@@ -1450,70 +1573,49 @@ class MatchMessagesView(generics.ListAPIView):
     
     def get_queryset(self):
         match_id = self.kwargs['match_id']  # This is actually a like_id
-        user = self.request.user
+        
+        # Verify user is part of this match
+        conversation = membership.conversation_for(match_id, self.request.user.id)
+        if conversation is None:
+            return []
         
         try:
-            # Get the Like object first
-            like = Like.objects.get(
-                id=match_id,
-                status=Like.LikeStatus.MATCHED
-            )
-            
-            # Verify user is part of this match
-            if user not in [like.liker, like.liked]:
-                return []
-            
-            # Get the corresponding Match object
-            user1, user2 = sorted([like.liker, like.liked], key=lambda u: str(u.id))
-            match = Match.objects.get(user1=user1, user2=user2)
-            
-            from .models import Message
-            return Message.objects.filter(match=match).select_related('sender').order_by('sent_at')
-            
-        except (Match.DoesNotExist, Like.DoesNotExist):
+            match = Match.objects.get(id=conversation.match_id)
+        except Match.DoesNotExist:
             return []
+        messages = chat_store.messages_for(match).select_related('sender')
+        return history.page(messages, 'seq', self.request.query_params)
 
 
 class ChatMessagesView(generics.ListCreateAPIView):
-    """API view for chat messages between matched users"""
-    serializer_class = ChatMessageSerializer
+    """
+    API view for chat messages between matched users, addressed by Like id.
+    Reads and writes the same chat store as the match endpoints (see
+    api/chat_store.py); history is keyset-paged (see api/history.py).
+    """
+    serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
-    
+
+    def get_conversation(self):
+        # Ensure current user is part of this match
+        conversation = membership.conversation_for(self.kwargs.get('match_id'), self.request.user.id)
+        if conversation is None:
+            return None
+        return Match.objects.filter(id=conversation.match_id).first()
+
     def get_queryset(self):
-        match_id = self.kwargs.get('match_id')
-        try:
-            # Verify the match exists and user is part of it
-            match = Like.objects.get(
-                id=match_id,
-                status=Like.LikeStatus.MATCHED
-            )
-            
-            # Ensure current user is part of this match
-            if self.request.user not in [match.liker, match.liked]:
-                return ChatMessage.objects.none()
-                
-            return ChatMessage.objects.filter(match=match).select_related('sender')
-            
-        except Like.DoesNotExist:
-            return ChatMessage.objects.none()
-    
+        match = self.get_conversation()
+        if match is None:
+            return Message.objects.none()
+        messages = chat_store.messages_for(match).select_related('sender')
+        return history.page(messages, 'seq', self.request.query_params)
+
     def perform_create(self, serializer):
-        match_id = self.kwargs.get('match_id')
-        try:
-            match = Like.objects.get(
-                id=match_id,
-                status=Like.LikeStatus.MATCHED
-            )
-            
-            # Ensure current user is part of this match
-            if self.request.user not in [match.liker, match.liked]:
-                raise serializers.ValidationError("You are not part of this match")
-                
-            serializer.save(sender=self.request.user, match=match)
-            
-        except Like.DoesNotExist:
-            raise serializers.ValidationError("Match not found")
+        match = self.get_conversation()
+        if match is None:
+            raise ValidationError("Match not found")
+        serializer.instance = chat_store.append(match, self.request.user, serializer.validated_data['content'])
 
 
 class MatchDetailView(generics.RetrieveAPIView):
@@ -1528,16 +1630,13 @@ class MatchDetailView(generics.RetrieveAPIView):
         ).select_related('liker', 'liked')
     
     def get_object(self):
-        match_id = self.kwargs.get('match_id')
+        # Routed as matches/<uuid:pk>/
+        match_id = self.kwargs.get('match_id') or self.kwargs.get('pk')
+        # Ensure current user is part of this match
+        if membership.conversation_for(match_id, self.request.user.id) is None:
+            raise Http404("Match not found")
         try:
-            match = self.get_queryset().get(id=match_id)
-            
-            # Ensure current user is part of this match
-            if self.request.user not in [match.liker, match.liked]:
-                raise Http404("Match not found")
-                
-            return match
-            
+            return self.get_queryset().get(id=match_id)
         except Like.DoesNotExist:
             raise Http404("Match not found")
 
@@ -1571,6 +1670,8 @@ class CreateFakeLikeView(APIView):
             if not created and like.status != Like.LikeStatus.LIKED:
                 like.status = Like.LikeStatus.LIKED
                 like.save()
+            # Keep the pair state in step so the other user's like back is detected as mutual
+            pairs.set_like(liker.id, liked.id)
                 
             return Response({
                 'success': True,
@@ -1691,6 +1792,7 @@ class PurchaseCoinsView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
     
+    @idempotent
     def post(self, request):
         package_id = request.data.get('package_id')
         
@@ -1770,14 +1872,7 @@ class PurchaseCoinsView(APIView):
             # Log the payload for debugging
             logging.info(f"Chapa payload: {chapa_payload}")
             
-            chapa_response = requests.post(
-                'https://api.chapa.co/v1/transaction/initialize',
-                json=chapa_payload,
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
+            chapa_response = chapa.initialize(chapa_payload)
             
             logging.info(f"Chapa response status: {chapa_response.status_code}")
             logging.info(f"Chapa response body: {chapa_response.text}")
@@ -1913,66 +2008,51 @@ class VerifyCoinPaymentView(APIView):
             # Find the purchase
             coin_purchase = CoinPurchase.objects.get(transaction_ref=tx_ref, user=request.user)
             
-            # Call Chapa verify API
-            verify_response = requests.get(
-                f'https://api.chapa.co/v1/transaction/verify/{tx_ref}',
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}'
-                }
-            )
-            
-            logging.info(f"Chapa verify response for {tx_ref}: {verify_response.status_code} - {verify_response.text}")
-            
-            if verify_response.status_code == 200:
-                verify_data = verify_response.json()
-                
-                if verify_data.get('status') == 'success':
-                    payment_status = verify_data['data'].get('status')
-                    
-                    if payment_status == 'success':
-                        # Payment verified successfully
-                        if coin_purchase.status != 'completed':
-                            coin_purchase.status = 'completed'
-                            coin_purchase.completed_at = timezone.now()
-                            coin_purchase.save()
-                            
-                            # Credit coins to user wallet
-                            wallet, _ = UserWallet.objects.get_or_create(user=request.user)
-                            wallet.coins += coin_purchase.coins_purchased
-                            wallet.save()
-                            
-                            logging.info(f"Payment verified and coins credited: {tx_ref}, user: {request.user.username}, coins: {coin_purchase.coins_purchased}")
-                        
-                        return Response({
-                            'success': True,
-                            'status': 'completed',
-                            'message': 'Payment verified successfully',
-                            'coins_credited': coin_purchase.coins_purchased,
-                            'new_balance': wallet.coins,
-                            'payment_details': verify_data['data']
-                        })
-                    else:
-                        # Payment not successful
-                        coin_purchase.status = 'failed'
-                        coin_purchase.save()
-                        
-                        return Response({
-                            'success': False,
-                            'status': payment_status,
-                            'message': f'Payment status: {payment_status}',
-                            'payment_details': verify_data['data']
-                        })
-                else:
-                    return Response({
-                        'error': 'Verification failed',
-                        'details': verify_data
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            else:
+            # Verified on the chapa pool, shared with a webhook for the same tx_ref
+            try:
+                verification = chapa.defer_once(payment_verification.verify_coin_purchase, tx_ref).result(
+                    timeout=settings.CHAPA_REQUEST_DEADLINE
+                )
+            except FutureTimeout:
+                # Completes in the background; the client polls again
+                return Response({
+                    'success': False,
+                    'status': 'pending',
+                    'message': 'Verification in progress, please retry shortly'
+                }, status=status.HTTP_202_ACCEPTED)
+
+            logging.info(f"Chapa verify result for {tx_ref}: {verification.status}")
+
+            if verification.status is None:
                 return Response({
-                    'error': 'Failed to verify payment',
-                    'status_code': verify_response.status_code
+                    'error': 'Verification failed',
+                    'details': verification.details
                 }, status=status.HTTP_400_BAD_REQUEST)
-                
+
+            if verification.status == 'success':
+                # Payment verified successfully; the coins were credited by the verification
+                wallet, _ = UserWallet.objects.get_or_create(user=request.user)
+
+                return Response({
+                    'success': True,
+                    'status': 'completed',
+                    'message': 'Payment verified successfully',
+                    'coins_credited': coin_purchase.coins_purchased,
+                    'new_balance': wallet.coins,
+                    'payment_details': verification.details
+                })
+
+            # Payment not successful
+            coin_purchase.status = 'failed'
+            coin_purchase.save()
+
+            return Response({
+                'success': False,
+                'status': verification.status,
+                'message': f'Payment status: {verification.status}',
+                'payment_details': verification.details
+            })
+
         except CoinPurchase.DoesNotExist:
             return Response({'error': 'Purchase not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -2034,6 +2114,7 @@ class SendGiftView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
     
+    @idempotent
     def post(self, request):
         serializer = SendGiftSerializer(data=request.data)
         if not serializer.is_valid():
@@ -2048,54 +2129,47 @@ class SendGiftView(APIView):
         except (User.DoesNotExist, GiftType.DoesNotExist):
             return Response({'error': 'Invalid receiver or gift type'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if sender has enough coins
         sender_wallet, _ = UserWallet.objects.get_or_create(user=sender)
         total_cost = gift_type.coin_cost * data['quantity']
         
         # For testing: Auto-add coins if insufficient (only in DEBUG mode)
         if settings.DEBUG and sender_wallet.coins < total_cost:
             logging.info(f"TEST MODE: Adding {total_cost} coins to {sender.username} for testing")
-            sender_wallet.coins += total_cost
-            sender_wallet.save()
+            ledger.transfer('dev_grant', (None, ledger.Code.COIN_ISSUE), (sender.id, ledger.Code.APP_COINS), total_cost)
+        
+        # Check if receiver has subaccount for split payment
+        # (actual transfer happens via Chapa automatically)
+        has_subaccount = UserSubaccount.objects.filter(user=receiver, is_active=True).exists()
         
-        if sender_wallet.coins < total_cost:
+        # One transaction: the debit is a conditional UPDATE (coins >= cost), so
+        # concurrent sends cannot spend the same coins twice, and a failed debit
+        # rolls back the gift row with it
+        try:
+            with transaction.atomic():
+                gift_transaction = GiftTransaction.objects.create(
+                    sender=sender,
+                    receiver=receiver,
+                    gift_type=gift_type,
+                    quantity=data['quantity'],
+                    message=data.get('message', ''),
+                    split_payment_processed=has_subaccount,
+                )
+                
+                # Deduct coins from sender, credit the receiver's gift earnings
+                share = gift_transaction.receiver_share_etb
+                ledger.post('gift', [
+                    (sender.id, ledger.Code.APP_COINS, -total_cost),
+                    (None, ledger.Code.COIN_SPEND, total_cost),
+                    (None, ledger.Code.GIFT_PAYOUT, -share),
+                    (receiver.id, ledger.Code.GIFT_EARNINGS, share),
+                ], reference=gift_transaction.id)
+        except ledger.InsufficientFunds:
             return Response({
                 'error': 'Insufficient coins',
                 'required': total_cost,
                 'available': sender_wallet.coins
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create gift transaction
-        gift_transaction = GiftTransaction.objects.create(
-            sender=sender,
-            receiver=receiver,
-            gift_type=gift_type,
-            quantity=data['quantity'],
-            message=data.get('message', '')
-        )
-        
-        # Deduct coins from sender
-        sender_wallet.coins -= total_cost
-        sender_wallet.save()
-        
-        # Check if receiver has subaccount for split payment
-        has_subaccount = hasattr(receiver, 'subaccount') and receiver.subaccount.is_active
-        
-        # Add earnings to receiver if they have a subaccount
-        if has_subaccount:
-            receiver.subaccount.total_earnings_etb += gift_transaction.receiver_share_etb
-            receiver.subaccount.save()
-        
-        # Also track in wallet
-        receiver_wallet, _ = UserWallet.objects.get_or_create(user=receiver)
-        receiver_wallet.total_earned += gift_transaction.receiver_share_etb
-        receiver_wallet.save()
-        
-        # Mark split payment as processed (actual transfer happens via Chapa automatically)
-        if has_subaccount:
-            gift_transaction.split_payment_processed = True
-            gift_transaction.save()
-        
         return Response({
             'success': True,
             'message': 'Gift sent successfully!',
@@ -2136,14 +2210,7 @@ class SendGiftView(APIView):
                 }
             }
             
-            response = requests.post(
-                'https://api.chapa.co/v1/transaction/initialize',
-                json=split_payload,
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
+            response = chapa.initialize(split_payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -2207,14 +2274,7 @@ class CreateSubAccountView(APIView):
         }
         
         try:
-            response = requests.post(
-                'https://api.chapa.co/v1/subaccount',
-                json=subaccount_payload,
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
+            response = chapa.create_subaccount(subaccount_payload)
             
             if response.status_code == 200:
                 data = response.json()
@@ -2252,73 +2312,30 @@ class ChapaWebhookView(APIView):
             # Extract webhook data
             tx_ref = request.data.get('tx_ref') or request.data.get('trx_ref')
             status_webhook = request.data.get('status')
-            ref_id = request.data.get('ref_id') or request.data.get('reference')
             
             if not tx_ref:
                 return Response({'error': 'Missing tx_ref'}, status=status.HTTP_400_BAD_REQUEST)
             
             logging.info(f"Webhook received for tx_ref: {tx_ref}, status: {status_webhook}")
             
-            # Automatically verify the transaction with Chapa API
-            if status_webhook == 'success':
-                try:
-                    verify_response = requests.get(
-                        f'https://api.chapa.co/v1/transaction/verify/{tx_ref}',
-                        headers={'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}'}
-                    )
-                    
-                    if verify_response.status_code == 200:
-                        verify_data = verify_response.json()
-                        if verify_data.get('status') == 'success':
-                            verified_status = verify_data['data'].get('status')
-                            verified_ref = verify_data['data'].get('reference')
-                            
-                            if verified_status != 'success':
-                                logging.warning(f"Verification failed for {tx_ref}: status={verified_status}")
-                                return Response({'status': 'verification_failed'})
-                            
-                            # Use verified reference if available
-                            if verified_ref:
-                                ref_id = verified_ref
-                        else:
-                            logging.error(f"Verification API returned non-success: {verify_data}")
-                            return Response({'status': 'verification_failed'})
-                    else:
-                        logging.error(f"Verification API error: {verify_response.status_code}")
-                        return Response({'status': 'verification_failed'})
-                        
-                except Exception as e:
-                    logging.error(f"Verification request failed: {e}")
-                    return Response({'status': 'verification_error'})
-            
             # Handle coin purchase completion
             if tx_ref.startswith('coin-'):
                 try:
                     coin_purchase = CoinPurchase.objects.get(transaction_ref=tx_ref)
-                    
+
                     if status_webhook == 'success' and coin_purchase.status == 'pending':
-                        # Add coins to user's wallet
-                        wallet, _ = UserWallet.objects.get_or_create(user=coin_purchase.user)
-                        wallet.coins += coin_purchase.coins_purchased
-                        wallet.total_spent += coin_purchase.amount_etb
-                        wallet.save()
-                        
-                        # Update purchase status
-                        coin_purchase.status = 'completed'
-                        coin_purchase.completed_at = timezone.now()
-                        coin_purchase.save()
-                        
-                        logging.info(f"Coin purchase completed: {tx_ref}, user: {coin_purchase.user.username}, coins: {coin_purchase.coins_purchased}")
-                        
+                        # Verified with Chapa's API and completed in the background: recorded, then acknowledged
+                        payment_verification.enqueue('coins', tx_ref)
+
                     elif status_webhook == 'failed':
                         coin_purchase.status = 'failed'
                         coin_purchase.save()
                         logging.info(f"Coin purchase failed: {tx_ref}")
-                        
+
                 except CoinPurchase.DoesNotExist:
                     logging.error(f"Coin purchase not found: {tx_ref}")
                     return Response({'error': 'Purchase not found'}, status=status.HTTP_404_NOT_FOUND)
-            
+
             return Response({'status': 'success', 'message': 'Webhook processed successfully'})
             
         except Exception as e:
@@ -2343,75 +2360,24 @@ class SubscriptionWebhookView(APIView):
             
             logging.info(f"Subscription webhook received for tx_ref: {tx_ref}, status: {status_webhook}")
             
-            # Automatically verify the transaction with Chapa API
-            if status_webhook == 'success':
-                try:
-                    verify_response = requests.get(
-                        f'https://api.chapa.co/v1/transaction/verify/{tx_ref}',
-                        headers={'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}'}
-                    )
-                    
-                    if verify_response.status_code == 200:
-                        verify_data = verify_response.json()
-                        if verify_data.get('status') == 'success':
-                            verified_status = verify_data['data'].get('status')
-                            
-                            if verified_status != 'success':
-                                logging.warning(f"Subscription verification failed for {tx_ref}: status={verified_status}")
-                                return Response({'status': 'verification_failed'})
-                        else:
-                            logging.error(f"Subscription verification API returned non-success: {verify_data}")
-                            return Response({'status': 'verification_failed'})
-                    else:
-                        logging.error(f"Subscription verification API error: {verify_response.status_code}")
-                        return Response({'status': 'verification_failed'})
-                        
-                except Exception as e:
-                    logging.error(f"Subscription verification request failed: {e}")
-                    return Response({'status': 'verification_error'})
-            
             # Handle subscription purchase completion
             if tx_ref.startswith('sub-'):
                 try:
                     subscription_purchase = SubscriptionPurchase.objects.get(transaction_ref=tx_ref)
-                    
+
                     if status_webhook == 'success' and subscription_purchase.status == 'pending':
-                        # Activate the subscription
-                        user = subscription_purchase.user
-                        now = timezone.now()
-                        expires = now + timedelta(days=subscription_purchase.duration_days)
-                        
-                        # Apply the subscription benefits based on plan code
-                        if subscription_purchase.plan_code == 'BOOST':
-                            user.has_boost = True
-                            user.boost_expiry = expires
-                        elif subscription_purchase.plan_code == 'LIKES_REVEAL':
-                            user.can_see_likes = True
-                            user.likes_reveal_expiry = expires
-                        elif subscription_purchase.plan_code == 'AD_FREE':
-                            user.ad_free = True
-                            user.ad_free_expiry = expires
-                        
-                        user.save()
-                        
-                        # Update purchase status
-                        subscription_purchase.status = 'completed'
-                        subscription_purchase.completed_at = now
-                        subscription_purchase.activated_at = now
-                        subscription_purchase.expires_at = expires
-                        subscription_purchase.save()
-                        
-                        logging.info(f"Subscription activated: {tx_ref}, user: {user.username}, plan: {subscription_purchase.plan_code}")
-                        
+                        # Verified with Chapa's API and activated in the background: recorded, then acknowledged
+                        payment_verification.enqueue('subscription', tx_ref)
+
                     elif status_webhook == 'failed':
                         subscription_purchase.status = 'failed'
                         subscription_purchase.save()
                         logging.info(f"Subscription purchase failed: {tx_ref}")
-                        
+
                 except SubscriptionPurchase.DoesNotExist:
                     logging.error(f"Subscription purchase not found: {tx_ref}")
                     return Response({'error': 'Purchase not found'}, status=status.HTTP_404_NOT_FOUND)
-            
+
             return Response({'status': 'success', 'message': 'Subscription webhook processed successfully'})
             
         except Exception as e:
@@ -2428,19 +2394,9 @@ class BankListView(APIView):
     
     def get(self, request):
         try:
-            response = requests.get(
-                'https://api.chapa.co/v1/banks',
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return Response(data)
-            else:
-                return Response({'error': 'Failed to fetch banks'}, status=status.HTTP_400_BAD_REQUEST)
-                
+            return Response(chapa.banks())
+        except requests.exceptions.HTTPError:
+            return Response({'error': 'Failed to fetch banks'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logging.error(f"Bank list fetch error: {e}")
             return Response({'error': 'Service unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -2473,18 +2429,9 @@ class CreateSubaccountView(APIView):
         
         # Get bank name from bank_code
         try:
-            banks_response = requests.get(
-                'https://api.chapa.co/v1/banks',
-                headers={'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}'}
-            )
-            
-            if banks_response.status_code == 200:
-                banks_data = banks_response.json()
-                banks = banks_data.get('data', [])
-                bank = next((b for b in banks if str(b.get('id')) == str(bank_code)), None)
-                bank_name = bank.get('name', 'Unknown Bank') if bank else 'Unknown Bank'
-            else:
-                bank_name = 'Unknown Bank'
+            banks = chapa.banks().get('data', [])
+            bank = next((b for b in banks if str(b.get('id')) == str(bank_code)), None)
+            bank_name = bank.get('name', 'Unknown Bank') if bank else 'Unknown Bank'
         except Exception as e:
             logging.error(f"Failed to fetch bank name: {e}")
             bank_name = 'Unknown Bank'
@@ -2501,14 +2448,7 @@ class CreateSubaccountView(APIView):
         try:
             logging.info(f"Creating Chapa subaccount for user {request.user.username}: {chapa_payload}")
             
-            response = requests.post(
-                'https://api.chapa.co/v1/subaccount',
-                json=chapa_payload,
-                headers={
-                    'Authorization': f'Bearer {settings.CHAPA_SECRET_KEY}',
-                    'Content-Type': 'application/json'
-                }
-            )
+            response = chapa.create_subaccount(chapa_payload)
             
             logging.info(f"Chapa subaccount response: {response.status_code} - {response.text}")
             
@@ -2600,14 +2540,15 @@ class SubaccountStatusView(APIView):
         
         try:
             subaccount = request.user.subaccount
+            balances = subaccount.ledger_balances
             
             return Response({
                 'has_subaccount': True,
                 'bank_name': subaccount.bank_name,
                 'account_number': subaccount.account_number[-4:].rjust(len(subaccount.account_number), '*'),
-                'total_earnings': str(subaccount.total_earnings_etb),
-                'total_withdrawn': str(subaccount.total_withdrawn_etb),
-                'available_balance': str(subaccount.available_balance),
+                'total_earnings': str(balances['total_earnings_etb']),
+                'total_withdrawn': str(balances['total_withdrawn_etb']),
+                'available_balance': str(balances['available_balance']),
                 'is_active': subaccount.is_active,
                 'is_verified': subaccount.is_verified,
                 'created_at': subaccount.created_at.isoformat()
@@ -2635,10 +2576,11 @@ class DeleteSubaccountView(APIView):
             subaccount = request.user.subaccount
             
             # Check if user has pending earnings
-            if subaccount.available_balance > 0:
+            available = subaccount.available_balance
+            if available > 0:
                 return Response({
                     'error': 'Cannot delete subaccount with pending earnings',
-                    'available_balance': str(subaccount.available_balance),
+                    'available_balance': str(available),
                     'message': 'Please withdraw or wait for settlement of your earnings before changing accounts'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
@@ -0,0 +1,70 @@
+"""
+Token authentication for the WebSocket router.
+
+Sockets authenticate with the DRF token in the ``?token=`` query string.
+Mobile clients reconnect constantly on flaky networks, so the token -> user
+lookup (one ``select_related`` query) is cached for ``WS_TOKEN_CACHE_TTL``
+seconds; unknown tokens are cached too, so a storm of stale reconnects does
+not reach the auth table either. Deleting or re-keying a token (logout,
+rotation) drops its cache entry (see api/signals.py). That only reaches
+other workers through a shared cache (``CACHE_URL``); with a process-local
+one a valid token is cached for at most ``LOCAL_CACHE_AUTH_TTL`` seconds.
+"""
+import hashlib
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+
+from . import cache_scope
+
+_MISSING = 'missing'
+
+
+def _cache_key(token_key):
+    # Never put raw credentials in cache keys
+    return f"ws_token:{hashlib.sha256(token_key.encode()).hexdigest()}"
+
+
+def invalidate(token_key):
+    cache.delete(_cache_key(token_key))
+
+
+def _resolve(token_key):
+    key = _cache_key(token_key)
+    cached = cache.get(key)
+    if cached is not None:
+        return None if cached == _MISSING else cached
+    token = Token.objects.select_related('user').filter(key=token_key).first()
+    user = token.user if token is not None and token.user.is_active else None
+    if user is None:
+        cache.set(key, _MISSING, settings.WS_TOKEN_CACHE_TTL)
+    else:
+        cache.set(key, user, cache_scope.authorization_ttl(settings.WS_TOKEN_CACHE_TTL))
+    return user
+
+
+@database_sync_to_async
+def get_user_for_token(token_key):
+    return _resolve(token_key) if token_key else None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Sets ``scope['user']`` from the ``token`` query parameter, when one is given."""
+
+    async def __call__(self, scope, receive, send):
+        token_key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        if token_key:
+            scope = dict(scope)
+            scope['user'] = await get_user_for_token(token_key) or AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+
+def TokenAuthMiddlewareStack(inner):
+    """Session auth (for browsers) with token auth layered on top."""
+    return AuthMiddlewareStack(TokenAuthMiddleware(inner))
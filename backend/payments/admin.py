@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.utils import timezone
 from django.db import transaction
-from .models import CoinPackage, Gift, Wallet, Payment, Receipt, AuditLog, GiftTransaction, WithdrawalRequest, KYCSubmission
-from . import tasks
+from .models import (
+    CoinPackage, Gift, Wallet, Payment, Receipt, AuditLog, GiftTransaction, WithdrawalRequest, KYCSubmission,
+    LedgerAccount, LedgerEntry,
+)
+from . import ledger, tasks
 
 
 @admin.register(CoinPackage)
@@ -25,6 +28,31 @@ class WalletAdmin(admin.ModelAdmin):
     search_fields = ("user__username", "user__email")
 
 
+@admin.register(LedgerAccount)
+class LedgerAccountAdmin(admin.ModelAdmin):
+    list_display = ("user", "code", "shard", "currency", "balance", "updated_at")
+    search_fields = ("user__username", "user__email")
+    list_filter = ("code", "currency")
+    readonly_fields = ("user", "code", "shard", "currency", "balance", "updated_at")
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    # Append-only: entries are posted by payments/ledger.py, never edited here
+    list_display = ("id", "transaction", "account", "amount", "balance_after", "created_at")
+    list_select_related = ("transaction", "account")
+    list_filter = ("transaction__kind",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = (
@@ -110,12 +138,12 @@ class WithdrawalRequestAdmin(admin.ModelAdmin):
             if wd.status != WithdrawalRequest.Status.PENDING:
                 continue
             with transaction.atomic():
-                wallet = Wallet.objects.select_for_update().get(user=wd.user)
-                wallet.hold_etb = (wallet.hold_etb - wd.amount_etb)
-                from decimal import Decimal
-                if wallet.hold_etb < 0:
-                    wallet.hold_etb = Decimal('0.00')
-                wallet.save(update_fields=["hold_etb", "updated_at"])
+                # Release hold back to available
+                held = ledger.balance(wd.user_id, ledger.Code.HOLD)
+                ledger.transfer(
+                    'withdrawal_release', (wd.user_id, ledger.Code.HOLD), (wd.user_id, ledger.Code.EARNINGS),
+                    min(wd.amount_etb, held), reference=wd.id,
+                )
 
                 wd.status = WithdrawalRequest.Status.REJECTED
                 wd.failure_reason = reason
@@ -0,0 +1,157 @@
+"""
+``Idempotency-Key`` support for POST endpoints that move money.
+
+Mobile clients retry a POST when the response times out, and every retry
+used to run the view again: another ``Payment`` / ``CoinPurchase`` row and
+another Chapa call, or a second gift debit. A client may now send an
+``Idempotency-Key`` header (any unique string, e.g. a UUID per user
+action), and views decorated with ``idempotent`` run at most once per key:
+
+    class GiftSendView(APIView):
+        @idempotent
+        def post(self, request): ...
+
+The first request claims the key with an INSERT on the unique
+``(user, key)`` row, committed on its own, then runs the view outside any
+transaction of ours. A final response (2xx, or 409 for a conflict that a
+retry cannot fix) is stored for ``IDEMPOTENCY_KEY_TTL`` seconds, and a
+repeat is answered from that row, one indexed lookup, with
+``Idempotent-Replayed: true``. Any other response or an exception releases
+the key, so a client that fixes its input can retry with the same key. A
+duplicate that arrives while the first is still running loses the INSERT
+and gets 409 with ``Retry-After``; it never runs the view. Reusing a key for
+a different request (method, path or body) gets 422.
+
+A claim still unfinished after ``IDEMPOTENCY_LOCK_TIMEOUT`` seconds belongs
+to a request that died, possibly after the view had moved money. It is not
+run again: a duplicate gets 409 telling the client to check the outcome
+(balances, purchase status) and use a new key. Only an expired key is
+claimed afresh.
+
+Requests without the header behave as before. ``manage.py
+purge_idempotency_keys`` deletes expired rows.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def _fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: values for key, values in data.lists()}
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def _in_progress():
+    return Response(
+        {"detail": f"A request with this {HEADER} is still in progress"},
+        status=status.HTTP_409_CONFLICT,
+        headers={'Retry-After': '1'},
+    )
+
+
+def _abandoned():
+    return Response(
+        {"detail": f"The request with this {HEADER} did not finish; check its outcome and retry with a new key"},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+def _is_final(status_code):
+    """Whether a response is stored for replay; anything else releases the key."""
+    return 200 <= status_code < 300 or status_code == status.HTTP_409_CONFLICT
+
+
+def _answer(record, fingerprint):
+    """The response to a request whose key is already claimed by ``record``."""
+    if record.fingerprint != fingerprint:
+        return Response({"detail": f"{HEADER} was already used for a different request"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.response_status is None:
+        if record.locked_until <= timezone.now():
+            return _abandoned()
+        return _in_progress()
+    return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(user, key, fingerprint):
+    """Claim ``key`` for this request: (record, None), or (None, response) if it is taken."""
+    now = timezone.now()
+    claim = {
+        'fingerprint': fingerprint,
+        'response_status': None,
+        'response_body': None,
+        'locked_until': now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+        'expires_at': now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    }
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, **claim), None
+        except IntegrityError:
+            # A concurrent duplicate inserted first
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            return None, _answer(record, fingerprint) if record else _in_progress()
+
+    if record.expires_at > now:
+        return None, _answer(record, fingerprint)
+    # Expired: claim it afresh, unless a concurrent request just did
+    taken = IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until, expires_at=record.expires_at).update(**claim)
+    if not taken:
+        return None, _in_progress()
+    for field, value in claim.items():
+        setattr(record, field, value)
+    return record, None
+
+
+def idempotent(view_method):
+    """Decorate an APIView ``post`` to honour the ``Idempotency-Key`` header."""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({"detail": f"{HEADER} must be at most 255 characters"}, status=status.HTTP_400_BAD_REQUEST)
+
+        record, response = _claim(request.user, key, _fingerprint(request))
+        if response is not None:
+            return response
+
+        # Only while the claim is still ours (it may have expired and been claimed afresh)
+        mine = IdempotencyKey.objects.filter(pk=record.pk, locked_until=record.locked_until)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except BaseException:
+            mine.delete()
+            raise
+        if isinstance(response, Response) and _is_final(response.status_code):
+            # Stored as the client saw it (DRF's JSON encoding of Decimals, UUIDs, ...)
+            body = json.loads(JSONRenderer().render(response.data) or b'null')
+            mine.update(response_status=response.status_code, response_body=body)
+        else:
+            mine.delete()
+        return response
+
+    return wrapper
+
+
+def purge_expired():
+    """Delete expired keys; returns how many were removed."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,344 @@
+"""
+Double-entry ledger for coins and ETB.
+
+Balances used to be counters on the wallet rows (``Wallet.coin_balance /
+balance_etb / hold_etb``, ``UserWallet.coins / total_spent / total_earned``,
+``UserSubaccount.total_earnings_etb``), updated with read-modify-write
+``+=`` and ``save()``, with ``AuditLog`` JSON as the only history. Every
+balance is now a ``LedgerAccount`` and every change is a ``post``: one
+``LedgerTransaction`` whose entries sum to zero per currency, e.g. a gift
+
+    sender   coins        -50   COIN
+    system   coin_spend   +50   COIN
+    system   gift_payout  -35   ETB
+    creator  earnings     +35   ETB
+
+Entries are append-only. A user account's ``balance`` is updated in the
+same transaction with an in-place increment. A debit is a conditional
+``UPDATE ... WHERE balance >= amount`` that raises ``InsufficientFunds``
+instead of going negative, and the entry records the ``balance_after``
+returned by the same statement (``RETURNING``). Reading a user balance is
+one indexed row.
+
+Earnings accounts are sharded for the same reason on the user side: a
+popular creator is credited by many senders at once. A credit goes to one
+of ``LEDGER_EARNINGS_SHARDS`` rows at random, reads sum the shards (still
+one indexed query), and a debit (a withdrawal) locks the shards and folds
+them into shard 0 in the same transaction, so it sees the exact total. The
+shards are locked together with the other rows of the post, in the same pk
+order every post updates rows in.
+``fold`` does the same on its own, and ``snapshot_ledger --fold`` runs it
+for every account with balance spread over shards.
+
+System accounts take part in almost every transaction, so their row is
+never updated, which would serialize all posts on it. Their balance is the
+latest ``LedgerSnapshot`` plus the entries after it. ``manage.py
+snapshot_ledger`` takes snapshots of every account that moved, and with
+``--verify`` it runs ``reconcile``. Both are bulk scans over the entries
+rather than per-user work.
+"""
+import random
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import LedgerAccount, LedgerEntry, LedgerSnapshot, LedgerTransaction
+
+Code = LedgerAccount.Code
+COIN = LedgerAccount.Currency.COIN
+ETB = LedgerAccount.Currency.ETB
+
+CURRENCY = {
+    Code.COINS: COIN,
+    Code.EARNINGS: ETB,
+    Code.HOLD: ETB,
+    Code.APP_COINS: COIN,
+    Code.APP_SPENT: ETB,
+    Code.GIFT_EARNINGS: ETB,
+    Code.WITHDRAWN: ETB,
+    Code.COIN_ISSUE: COIN,
+    Code.COIN_SPEND: COIN,
+    Code.SALES: ETB,
+    Code.GIFT_PAYOUT: ETB,
+    Code.PAYOUT: ETB,
+}
+
+# Accounts credited often enough to be spread over shards
+SHARDED = {Code.EARNINGS, Code.GIFT_EARNINGS}
+
+_CENT = Decimal('0.01')
+_SETTLE = timedelta(minutes=5)
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, user_id, code, amount):
+        super().__init__(f"Insufficient {code} balance for user {user_id}: needs {amount}")
+        self.user_id = user_id
+        self.code = code
+        self.amount = amount
+
+
+def _amount(value):
+    return Decimal(value).quantize(_CENT)
+
+
+def _account_ids(keys):
+    """{(user_id, code, shard): account id} for ``keys``, creating missing accounts."""
+    user_keys = [key for key in keys if key[0] is not None]
+    system_codes = [code for user_id, code, _ in keys if user_id is None]
+    query = Q(pk__in=[])
+    if user_keys:
+        query |= Q(user_id__in={user_id for user_id, _, _ in user_keys}, code__in={code for _, code, _ in user_keys})
+    if system_codes:
+        query |= Q(user__isnull=True, code__in=system_codes)
+    ids = {
+        (user_id, code, shard): pk
+        for pk, user_id, code, shard in LedgerAccount.objects.filter(query).values_list('pk', 'user_id', 'code', 'shard')
+    }
+    for user_id, code, shard in keys:
+        if (user_id, code, shard) not in ids:
+            account, _ = LedgerAccount.objects.get_or_create(user_id=user_id, code=code, shard=shard, defaults={'currency': CURRENCY[code]})
+            ids[(user_id, code, shard)] = account.pk
+    return ids
+
+
+def _add(account_id, amount, now):
+    """Add ``amount`` to a user account in one ``UPDATE ... RETURNING``: the new balance, or None if a debit would go below zero."""
+    qn = connection.ops.quote_name
+    balance = qn('balance')
+    sql = f"UPDATE {qn(LedgerAccount._meta.db_table)} SET {balance} = {balance} + %s, {qn('updated_at')} = %s WHERE {qn('id')} = %s"
+    params = [amount, connection.ops.adapt_datetimefield_value(now), account_id]
+    if amount < 0:
+        sql += f" AND {balance} >= %s"
+        params.append(-amount)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} RETURNING {balance}", params)
+        row = cursor.fetchone()
+    # SQLite hands NUMERIC columns back as int/float
+    return None if row is None else _amount(str(row[0]))
+
+
+def _lock_for_fold(keys, folded):
+    """Lock the user accounts ``keys`` and every shard of the ``folded`` (user_id, code) accounts.
+
+    One ``SELECT ... FOR UPDATE`` in pk order, the order ``post`` updates rows
+    in, so a fold cannot hold a shard while waiting for a row another post
+    locked first. Returns (legs moving the folded accounts' other shards into
+    shard 0, {(user_id, code, shard): account id} of every locked row).
+    """
+    query = Q(pk__in=[])
+    for user_id, code in folded:
+        query |= Q(user_id=user_id, code=code)
+    user_keys = [key for key in keys if key[0] is not None]
+    if user_keys:
+        query |= Q(pk__in=[keys[key] for key in user_keys])
+    locked = LedgerAccount.objects.select_for_update().filter(query).order_by('pk').values_list('pk', 'user_id', 'code', 'shard', 'balance')
+    legs = defaultdict(Decimal)
+    ids = {}
+    for pk, user_id, code, shard, amount in locked:
+        ids[(user_id, code, shard)] = pk
+        if (user_id, code) in folded and shard and amount:
+            legs[(user_id, code, shard)] -= amount
+            legs[(user_id, code, 0)] += amount
+    return legs, ids
+
+
+def post(kind, legs, reference='', metadata=None):
+    """Post ``legs`` ([(user_id or None, code, amount)], signed) as one transaction.
+
+    Legs must sum to zero per currency. Raises ``InsufficientFunds`` (and
+    rolls back) if a debit would take a user account below zero.
+    """
+    amounts = defaultdict(Decimal)
+    for user_id, code, amount in legs:
+        amounts[(user_id, code)] += _amount(amount)
+    amounts = {key: amount for key, amount in amounts.items() if amount}
+    totals = defaultdict(Decimal)
+    for (_, code), amount in amounts.items():
+        totals[CURRENCY[code]] += amount
+    unbalanced = {currency: total for currency, total in totals.items() if total}
+    if unbalanced:
+        raise ValueError(f"Unbalanced ledger transaction {kind}: {unbalanced}")
+    if not amounts:
+        return None
+
+    with transaction.atomic():
+        # Spread credits to sharded accounts; a debit folds the account into shard 0
+        rows = defaultdict(Decimal)
+        folded = set()
+        for (user_id, code), amount in amounts.items():
+            if user_id is None or code not in SHARDED:
+                rows[(user_id, code, 0)] += amount
+            elif amount > 0:
+                rows[(user_id, code, random.randrange(settings.LEDGER_EARNINGS_SHARDS))] += amount
+            else:
+                folded.add((user_id, code))
+                rows[(user_id, code, 0)] += amount
+
+        ids = _account_ids(list(rows))
+        if folded:
+            legs, locked = _lock_for_fold({key: ids[key] for key in rows}, folded)
+            ids.update(locked)
+            for key, moved in legs.items():
+                rows[key] += moved
+        rows = {key: amount for key, amount in rows.items() if amount}
+
+        tx = LedgerTransaction.objects.create(kind=kind, reference=str(reference or ''), metadata=metadata or {})
+        entries = []
+        now = timezone.now()
+        # Same lock order in every transaction, so concurrent posts cannot deadlock
+        for key in sorted(rows, key=ids.get):
+            user_id, code, _ = key
+            amount = rows[key]
+            balance_after = None
+            if user_id is not None:
+                balance_after = _add(ids[key], amount, now)
+                if balance_after is None:
+                    raise InsufficientFunds(user_id, code, -amount)
+            entries.append(LedgerEntry(transaction=tx, account_id=ids[key], amount=amount, balance_after=balance_after))
+        LedgerEntry.objects.bulk_create(entries)
+    return tx
+
+
+def transfer(kind, source, destination, amount, reference='', metadata=None):
+    """``post`` moving ``amount`` from ``source`` to ``destination`` ((user_id or None, code) each)."""
+    amount = _amount(amount)
+    return post(kind, [(*source, -amount), (*destination, amount)], reference=reference, metadata=metadata)
+
+
+def balance(user_id, code):
+    """Current balance of an account: one row for user accounts, snapshot plus tail for system ones."""
+    if user_id is not None:
+        return LedgerAccount.balance_of(user_id, code)
+    account_id = LedgerAccount.objects.filter(user__isnull=True, code=code).values_list('pk', flat=True).first()
+    if account_id is None:
+        return Decimal('0.00')
+    return _replay(account_id)
+
+
+def balances(user_ids, codes):
+    """{(user_id, code): balance} for several user accounts in one query; missing accounts are zero."""
+    rows = (
+        LedgerAccount.objects
+        .filter(user_id__in=user_ids, code__in=codes)
+        .values('user_id', 'code')
+        .annotate(total=Sum('balance'))
+        .values_list('user_id', 'code', 'total')
+    )
+    found = {(user_id, code): value for user_id, code, value in rows}
+    return {(user_id, code): found.get((user_id, code), Decimal('0.00')) for user_id in user_ids for code in codes}
+
+
+def fold(user_id, code):
+    """Move a sharded account's balance into shard 0; returns the ``fold`` transaction, or None if there was nothing to move."""
+    with transaction.atomic():
+        legs, ids = _lock_for_fold({}, {(user_id, code)})
+        if not legs:
+            return None
+        ids.update(_account_ids(list(legs)))
+        tx = LedgerTransaction.objects.create(kind='fold')
+        now = timezone.now()
+        entries = []
+        for key in sorted(legs, key=ids.get):
+            balance_after = _add(ids[key], legs[key], now)
+            entries.append(LedgerEntry(transaction=tx, account_id=ids[key], amount=legs[key], balance_after=balance_after))
+        LedgerEntry.objects.bulk_create(entries)
+    return tx
+
+
+def fold_all():
+    """``fold`` every account with a balance on a shard other than 0; returns how many were folded."""
+    spread = (
+        LedgerAccount.objects
+        .filter(code__in=SHARDED, shard__gt=0)
+        .exclude(balance=0)
+        .values_list('user_id', 'code')
+        .distinct()
+    )
+    return sum(1 for user_id, code in list(spread) if fold(user_id, code))
+
+
+def _replay(account_id):
+    """An account's balance from its latest snapshot plus the entries after it."""
+    snapshot = LedgerSnapshot.objects.filter(account_id=account_id).order_by('-entry_id').values_list('entry_id', 'balance').first()
+    since, base = snapshot or (0, Decimal('0.00'))
+    tail = LedgerEntry.objects.filter(account_id=account_id, id__gt=since).aggregate(s=Sum('amount'))['s']
+    return base + (tail or Decimal('0.00'))
+
+
+def _latest_snapshot_id():
+    return LedgerSnapshot.objects.filter(account=OuterRef('account')).order_by('-entry_id').values('entry_id')[:1]
+
+
+def _tails(before=None):
+    """{account_id: (entries total, last entry id)} for entries after each account's latest snapshot, in one scan."""
+    rows = LedgerEntry.objects.annotate(since=Coalesce(Subquery(_latest_snapshot_id()), 0)).filter(id__gt=F('since'))
+    if before is not None:
+        rows = rows.filter(created_at__lt=before)
+    rows = (
+        rows
+        .values('account')
+        .annotate(total=Sum('amount'), last=Max('id'))
+    )
+    return {row['account']: (row['total'], row['last']) for row in rows}
+
+
+def _latest_snapshots():
+    """{account_id: balance} of every account's latest snapshot."""
+    rows = LedgerSnapshot.objects.filter(entry_id=Subquery(_latest_snapshot_id())).values_list('account_id', 'balance')
+    return dict(rows)
+
+
+def snapshot():
+    """Snapshot every account with entries since its last snapshot; returns how many were taken."""
+    # Entry ids are allocated before commit, so leave recent ones for the next run
+    # rather than snapshot past an entry whose transaction is still open
+    tails = _tails(before=timezone.now() - _SETTLE)
+    bases = _latest_snapshots()
+    LedgerSnapshot.objects.bulk_create([
+        LedgerSnapshot(account_id=account_id, entry_id=last, balance=bases.get(account_id, Decimal('0.00')) + total)
+        for account_id, (total, last) in tails.items()
+    ], batch_size=1000)
+    return len(tails)
+
+
+def reconcile():
+    """Problems found by a full consistency check, as a list of strings (empty when the books balance)."""
+    problems = []
+    unbalanced = (
+        LedgerEntry.objects
+        .values('transaction', 'account__currency')
+        .annotate(total=Sum('amount'))
+        .exclude(total=0)
+    )
+    for row in unbalanced:
+        problems.append(f"transaction {row['transaction']} sums to {row['total']} {row['account__currency']}")
+
+    tails = _tails()
+    accounts = list(LedgerAccount.objects.filter(user__isnull=False).values_list('pk', 'user_id', 'code', 'shard', 'balance'))
+    bases = _latest_snapshots()
+    for pk, user_id, code, shard, account_balance in accounts:
+        name = f"{user_id}:{code}#{shard}" if shard else f"{user_id}:{code}"
+        total, _ = tails.get(pk, (Decimal('0.00'), None))
+        expected = bases.get(pk, Decimal('0.00')) + total
+        if expected != account_balance:
+            # Balances and entries were read at different moments: re-check under the row lock
+            account_balance, expected = _check_account(pk)
+            if expected != account_balance:
+                problems.append(f"account {name} holds {account_balance}, entries say {expected}")
+        if account_balance < 0:
+            problems.append(f"account {name} is negative ({account_balance})")
+    return problems
+
+
+def _check_account(account_id):
+    """(balance, snapshot plus entries) for one account, read consistently."""
+    with transaction.atomic():
+        account_balance = LedgerAccount.objects.select_for_update().values_list('balance', flat=True).get(pk=account_id)
+        return account_balance, _replay(account_id)
@@ -0,0 +1,112 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.test.utils import override_settings
+
+from payments import ledger
+from payments.models import LedgerAccount, LedgerEntry, LedgerTransaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark gift credits to a single creator: credits/sec for each earnings shard count '
+        '(LEDGER_EARNINGS_SHARDS). Creates and then deletes its own users and ledger rows; '
+        'run it against a scratch PostgreSQL database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='1,2,4,8,16', help='Comma-separated shard counts to compare')
+        parser.add_argument('--senders', type=int, default=32, help='Concurrent senders (threads, one DB connection each)')
+        parser.add_argument('--credits', type=int, default=2000, help='Gifts sent to the creator per run')
+        parser.add_argument('--work-ms', type=float, default=2.0, help='Time each gift spends in its transaction after the ledger post (the rest of the request)')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark users and ledger rows')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stderr.write('SQLite takes one write lock for the whole database, so shard counts will not differ.')
+        try:
+            shard_counts = [int(n) for n in options['shards'].split(',') if n]
+        except ValueError:
+            raise CommandError('--shards must be comma-separated integers')
+        if not shard_counts or min(shard_counts) < 1:
+            raise CommandError('--shards needs at least one count >= 1')
+
+        baseline = None
+        for shards in shard_counts:
+            with override_settings(LEDGER_EARNINGS_SHARDS=shards):
+                rate, failed = self.run(options)
+            baseline = baseline or rate
+            self.stdout.write(self.style.SUCCESS(
+                f'shards={shards}: {options["credits"] - failed} credits from {options["senders"]} senders, '
+                f'{rate:,.0f} credits/s ({rate / baseline:.1f}x)' + (f', {failed} failed' if failed else '')
+            ))
+
+    def run(self, options):
+        User = get_user_model()
+        tag = uuid.uuid4().hex[:8]
+        senders = options['senders']
+        credits = options['credits']
+        per_sender = [credits // senders + (1 if i < credits % senders else 0) for i in range(senders)]
+        payout = Decimal('0.75')
+        work = options['work_ms'] / 1000
+
+        creator = User.objects.create_user(username=f'bench_{tag}_creator', email=f'bench_{tag}_creator@example.com')
+        fans = [
+            User.objects.create_user(username=f'bench_{tag}_{i}', email=f'bench_{tag}_{i}@example.com')
+            for i in range(senders)
+        ]
+        ledger.post('bench', [(None, ledger.Code.COIN_ISSUE, -credits)] + [
+            (fan.id, ledger.Code.COINS, count) for fan, count in zip(fans, per_sender)
+        ])
+
+        barrier = threading.Barrier(senders + 1)
+        failures = []
+
+        def send(fan, count):
+            try:
+                barrier.wait()
+                for _ in range(count):
+                    try:
+                        with transaction.atomic():
+                            ledger.post('bench', [
+                                (fan.id, ledger.Code.COINS, -1),
+                                (None, ledger.Code.COIN_SPEND, 1),
+                                (None, ledger.Code.GIFT_PAYOUT, -payout),
+                                (creator.id, ledger.Code.EARNINGS, payout),
+                            ])
+                            time.sleep(work)
+                    except OperationalError:
+                        failures.append(fan.id)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=send, args=(fan, count)) for fan, count in zip(fans, per_sender)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        # The withdrawal path must still see every credit: fold and compare with the entries
+        expected = payout * (credits - len(failures))
+        ledger.fold(creator.id, ledger.Code.EARNINGS)
+        total = LedgerAccount.balance_of(creator.id, ledger.Code.EARNINGS)
+        if total != expected:
+            raise CommandError(f'Creator earnings are {total}, expected {expected}')
+
+        if not options['keep']:
+            users = [creator.id] + [fan.id for fan in fans]
+            bench = LedgerTransaction.objects.filter(kind__in=['bench', 'fold'], entries__account__user_id__in=users).distinct()
+            bench_ids = list(bench.values_list('pk', flat=True))
+            LedgerEntry.objects.filter(transaction_id__in=bench_ids).delete()
+            LedgerTransaction.objects.filter(pk__in=bench_ids).delete()
+            User.objects.filter(pk__in=users).delete()
+        return (credits - len(failures)) / elapsed, len(failures)
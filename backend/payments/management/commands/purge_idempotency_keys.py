@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments import idempotency
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records (run via cron/scheduler)"
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Idempotency key purge complete. Deleted: {deleted}"))
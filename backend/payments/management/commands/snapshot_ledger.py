@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import ledger
+
+
+class Command(BaseCommand):
+    help = "Snapshot ledger account balances (run via cron/scheduler); --fold folds sharded accounts first, --verify reconciles the books"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Check that transactions balance and account balances match their entries')
+        parser.add_argument('--fold', action='store_true', help='Fold earnings shards back into one row per account')
+
+    def handle(self, *args, **options):
+        if options['fold']:
+            folded = ledger.fold_all()
+            self.stdout.write(f"Folded accounts: {folded}")
+        if options['verify']:
+            problems = ledger.reconcile()
+            for problem in problems:
+                self.stderr.write(problem)
+            if problems:
+                raise CommandError(f"Ledger reconciliation found {len(problems)} problem(s)")
+            self.stdout.write("Ledger reconciles.")
+        taken = ledger.snapshot()
+        self.stdout.write(self.style.SUCCESS(f"Ledger snapshot complete. Accounts snapshotted: {taken}"))
@@ -0,0 +1,125 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:21
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def carry_over_balances(apps, schema_editor):
+    """Open a ledger account for every non-zero wallet counter, balanced against a system account."""
+    Wallet = apps.get_model('payments', 'Wallet')
+    UserWallet = apps.get_model('api', 'UserWallet')
+    UserSubaccount = apps.get_model('api', 'UserSubaccount')
+    LedgerAccount = apps.get_model('payments', 'LedgerAccount')
+    LedgerTransaction = apps.get_model('payments', 'LedgerTransaction')
+    LedgerEntry = apps.get_model('payments', 'LedgerEntry')
+
+    currency = {'coin_issue': 'COIN', 'sales': 'ETB', 'gift_payout': 'ETB', 'payout': 'ETB'}
+    # user_id -> {code: (amount, system code)}
+    openings = {}
+    for user_id, coins, balance, hold in Wallet.objects.values_list('user_id', 'coin_balance', 'balance_etb', 'hold_etb'):
+        opening = openings.setdefault(user_id, {})
+        opening['coins'] = (Decimal(coins), 'coin_issue')
+        opening['earnings'] = (balance - hold, 'gift_payout')
+        opening['hold'] = (hold, 'gift_payout')
+    for user_id, coins, spent, earned in UserWallet.objects.values_list('user_id', 'coins', 'total_spent', 'total_earned'):
+        opening = openings.setdefault(user_id, {})
+        opening['app_coins'] = (Decimal(coins), 'coin_issue')
+        opening['app_spent'] = (spent, 'sales')
+        opening['gift_earnings'] = (earned, 'gift_payout')
+    for user_id, earned, withdrawn in UserSubaccount.objects.values_list('user_id', 'total_earnings_etb', 'total_withdrawn_etb'):
+        opening = openings.setdefault(user_id, {})
+        # UserWallet.total_earned counted the same gifts, always at least as many
+        previous = opening.get('gift_earnings', (Decimal('0.00'), 'gift_payout'))[0]
+        opening['gift_earnings'] = (max(previous, earned), 'gift_payout')
+        opening['withdrawn'] = (withdrawn, 'payout')
+
+    system = {}
+    for code, cur in currency.items():
+        system[code] = LedgerAccount.objects.get_or_create(user=None, code=code, defaults={'currency': cur})[0].pk
+    for user_id, opening in openings.items():
+        opening = {code: legs for code, legs in opening.items() if legs[0]}
+        if not opening:
+            continue
+        accounts = LedgerAccount.objects.bulk_create([
+            LedgerAccount(user_id=user_id, code=code, currency=currency[system_code], balance=amount)
+            for code, (amount, system_code) in opening.items()
+        ])
+        tx = LedgerTransaction.objects.create(kind='opening_balance', reference=str(user_id))
+        entries = []
+        for account, (amount, system_code) in zip(accounts, opening.values()):
+            entries.append(LedgerEntry(transaction=tx, account_id=account.pk, amount=amount, balance_after=amount))
+            entries.append(LedgerEntry(transaction=tx, account_id=system[system_code], amount=-amount))
+        LedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+        ('api', '0034_notification_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(db_index=True, max_length=32)),
+                ('reference', models.CharField(blank=True, default='', max_length=128)),
+                ('metadata', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(choices=[('coins', 'Coins (Wallet)'), ('earnings', 'Creator earnings available (Wallet)'), ('hold', 'Held for pending withdrawals (Wallet)'), ('app_coins', 'Coins (UserWallet)'), ('app_spent', 'ETB spent on coins (UserWallet)'), ('gift_earnings', 'ETB earned from gifts (UserWallet/UserSubaccount)'), ('withdrawn', 'ETB withdrawn (UserSubaccount)'), ('coin_issue', 'Coins issued'), ('coin_spend', 'Coins spent on gifts'), ('sales', 'ETB received for coins'), ('gift_payout', 'ETB owed to creators for gifts'), ('payout', 'ETB paid out')], max_length=32)),
+                ('currency', models.CharField(choices=[('COIN', 'Coins'), ('ETB', 'Ethiopian Birr')], max_length=4)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_accounts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='payments.ledgeraccount')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('balance_after', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='payments.ledgeraccount')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='payments.ledgertransaction')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'code'), name='unique_ledger_user_account'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('code',), name='unique_ledger_system_account'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgersnapshot',
+            index=models.Index(fields=['account', '-entry_id'], name='ledgersnapshot_account_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['account', 'id'], name='ledgerentry_account_idx'),
+        ),
+        migrations.RunPython(carry_over_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='wallet',
+            name='balance_etb',
+        ),
+        migrations.RemoveField(
+            model_name='wallet',
+            name='coin_balance',
+        ),
+        migrations.RemoveField(
+            model_name='wallet',
+            name='hold_etb',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_remove_wallet_balances'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='ledgeraccount',
+            name='unique_ledger_user_account',
+        ),
+        migrations.AddField(
+            model_name='ledgeraccount',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgeraccount',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'code', 'shard'), name='unique_ledger_user_account'),
+        ),
+    ]
@@ -43,14 +43,11 @@ class Gift(TimeStampedModel):
 
 
 class Wallet(TimeStampedModel):
+    """A user's payment settings. Balances live in the ledger (LedgerAccount, payments/ledger.py)."""
+
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wallet')
-    coin_balance = models.PositiveIntegerField(default=0)
     # Whether the user is banned from sending gifts or transacting
     is_banned = models.BooleanField(default=False)
-    # Creator earnings/payout balance in ETB
-    balance_etb = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
-    # Held funds reserved for pending withdrawals
-    hold_etb = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     # Simple KYC level flag
     kyc_level = models.PositiveSmallIntegerField(default=1)
     # If true, withdrawals are blocked pending risk review
@@ -59,6 +56,24 @@ class Wallet(TimeStampedModel):
     def __str__(self) -> str:
         return f"Wallet<{self.user_id}>: {self.coin_balance} coins"
 
+    @property
+    def coin_balance(self) -> int:
+        return int(LedgerAccount.balance_of(self.user_id, LedgerAccount.Code.COINS))
+
+    @property
+    def balance_etb(self) -> Decimal:
+        """Creator earnings/payout balance in ETB, including funds held for pending withdrawals."""
+        return self.available_etb + self.hold_etb
+
+    @property
+    def available_etb(self) -> Decimal:
+        return LedgerAccount.balance_of(self.user_id, LedgerAccount.Code.EARNINGS)
+
+    @property
+    def hold_etb(self) -> Decimal:
+        """Held funds reserved for pending withdrawals."""
+        return LedgerAccount.balance_of(self.user_id, LedgerAccount.Code.HOLD)
+
 
 class Payment(TimeStampedModel):
     class Status(models.TextChoices):
@@ -179,3 +194,140 @@ class KYCSubmission(TimeStampedModel):
 
     def __str__(self) -> str:
         return f"KYC<{self.pk}> {self.user_id} {self.doc_type} {self.status}"
+
+
+class LedgerAccount(models.Model):
+    """One balance in the double-entry ledger (see payments/ledger.py).
+
+    User accounts have a ``user`` and a running ``balance``, updated with
+    every entry. System accounts (``user`` is null) are the other side of
+    money entering or leaving the app. Nearly every transaction touches one,
+    so their row is never updated: their balance is the latest snapshot plus
+    the entries after it, and they may go negative.
+
+    Earnings accounts, which popular creators get credited many times a
+    second, are split into ``shard`` rows: a credit lands on a random shard
+    so concurrent gifts lock different rows, and the balance is the sum of
+    the shards. Debits first fold the shards back into shard 0.
+    """
+
+    class Code(models.TextChoices):
+        # Per-user accounts
+        COINS = 'coins', 'Coins (Wallet)'
+        EARNINGS = 'earnings', 'Creator earnings available (Wallet)'
+        HOLD = 'hold', 'Held for pending withdrawals (Wallet)'
+        APP_COINS = 'app_coins', 'Coins (UserWallet)'
+        APP_SPENT = 'app_spent', 'ETB spent on coins (UserWallet)'
+        GIFT_EARNINGS = 'gift_earnings', 'ETB earned from gifts (UserWallet/UserSubaccount)'
+        WITHDRAWN = 'withdrawn', 'ETB withdrawn (UserSubaccount)'
+        # System accounts
+        COIN_ISSUE = 'coin_issue', 'Coins issued'
+        COIN_SPEND = 'coin_spend', 'Coins spent on gifts'
+        SALES = 'sales', 'ETB received for coins'
+        GIFT_PAYOUT = 'gift_payout', 'ETB owed to creators for gifts'
+        PAYOUT = 'payout', 'ETB paid out'
+
+    class Currency(models.TextChoices):
+        COIN = 'COIN', 'Coins'
+        ETB = 'ETB', 'Ethiopian Birr'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name='ledger_accounts')
+    code = models.CharField(max_length=32, choices=Code.choices)
+    currency = models.CharField(max_length=4, choices=Currency.choices)
+    shard = models.PositiveSmallIntegerField(default=0)
+    balance = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'code', 'shard'], condition=models.Q(user__isnull=False), name='unique_ledger_user_account'),
+            models.UniqueConstraint(fields=['code'], condition=models.Q(user__isnull=True), name='unique_ledger_system_account'),
+        ]
+
+    def __str__(self) -> str:
+        shard = f"#{self.shard}" if self.shard else ''
+        return f"LedgerAccount<{self.user_id or 'system'}:{self.code}{shard}> {self.balance} {self.currency}"
+
+    @classmethod
+    def balance_of(cls, user_id, code) -> Decimal:
+        """Balance of a user account, summed over its shards (system accounts: see ledger.balance)."""
+        balance = cls.objects.filter(user_id=user_id, code=code).aggregate(total=models.Sum('balance'))['total']
+        return Decimal('0.00') if balance is None else balance
+
+
+class LedgerTransaction(models.Model):
+    """A set of entries that sum to zero per currency, posted together."""
+
+    kind = models.CharField(max_length=32, db_index=True)  # e.g. 'gift', 'topup', 'withdrawal_hold'
+    reference = models.CharField(max_length=128, blank=True, default='')  # id of the business object
+    metadata = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"LedgerTx<{self.pk}> {self.kind} {self.reference}"
+
+
+class LedgerEntry(models.Model):
+    """One leg of a LedgerTransaction. Append-only: entries are never updated or deleted."""
+
+    id = models.BigAutoField(primary_key=True)
+    transaction = models.ForeignKey(LedgerTransaction, on_delete=models.PROTECT, related_name='entries')
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='entries')
+    amount = models.DecimalField(max_digits=18, decimal_places=2)  # positive credits, negative debits
+    # Running balance of a user account; null for system accounts
+    balance_after = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'id'], name='ledgerentry_account_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"LedgerEntry<{self.pk}> {self.account_id} {self.amount:+} -> {self.balance_after}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only")
+        super().save(*args, **kwargs)
+
+
+class LedgerSnapshot(models.Model):
+    """An account's balance as of entry ``entry_id`` (inclusive), taken periodically by snapshot_ledger."""
+
+    account = models.ForeignKey(LedgerAccount, on_delete=models.CASCADE, related_name='snapshots')
+    entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=18, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-entry_id'], name='ledgersnapshot_account_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"LedgerSnapshot<{self.account_id}@{self.entry_id}> {self.balance}"
+
+
+class IdempotencyKey(models.Model):
+    """A client's ``Idempotency-Key`` for a POST and the response it got (see payments/idempotency.py)."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # sha256 of method, path and body: the same key with a different request is rejected
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # An unfinished claim older than this is treated as abandoned (worker died)
+    locked_until = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self) -> str:
+        return f"IdempotencyKey<{self.user_id}:{self.key}> {self.response_status or 'pending'}"
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import CoinPackage, Payment, Receipt, Gift, Wallet, GiftTransaction, WithdrawalRequest, KYCSubmission
 
@@ -41,7 +42,7 @@ class ReceiptSerializer(serializers.ModelSerializer):
 
 
 class GiftSendSerializer(serializers.Serializer):
-    recipient_id = serializers.IntegerField()
+    recipient_id = serializers.UUIDField()
     gift_id = serializers.IntegerField()
 
     def validate(self, attrs):
@@ -62,7 +63,38 @@ class GiftSendSerializer(serializers.Serializer):
         return attrs
 
 
+class GiftShowerItemSerializer(serializers.Serializer):
+    recipient_id = serializers.UUIDField()
+    gift_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class GiftShowerSerializer(serializers.Serializer):
+    """A batch of gifts, possibly to several recipients, settled as one transaction."""
+    items = GiftShowerItemSerializer(many=True, allow_empty=False)
+
+    def validate(self, attrs):
+        request = self.context.get('request')
+        user = getattr(request, 'user', None)
+        if not user or not user.is_authenticated:
+            raise serializers.ValidationError("Authentication required")
+
+        items = attrs['items']
+        if any(item['recipient_id'] == user.id for item in items):
+            raise serializers.ValidationError("Cannot gift yourself")
+
+        total = sum(item['quantity'] for item in items)
+        if total > settings.GIFT_SHOWER_MAX_GIFTS:
+            raise serializers.ValidationError(f"At most {settings.GIFT_SHOWER_MAX_GIFTS} gifts per shower")
+
+        return attrs
+
+
 class WalletSerializer(serializers.ModelSerializer):
+    # Ledger balances (model properties)
+    coin_balance = serializers.IntegerField(read_only=True)
+    balance_etb = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    hold_etb = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     recent_gifts = serializers.SerializerMethodField()
 
     class Meta:
@@ -9,13 +9,6 @@ except Exception:  # pragma: no cover
         return func
 
 from django.utils import timezone
-from asgiref.sync import async_to_sync
-
-try:
-    from channels.layers import get_channel_layer  # type: ignore
-except Exception:  # pragma: no cover
-    def get_channel_layer():
-        return None
 
 from decimal import Decimal
 from django.db import transaction
@@ -23,18 +16,12 @@ from django.db.models import Sum, Count
 
 from .models import WithdrawalRequest, Wallet, AuditLog, Payment, GiftTransaction
 from .payouts import PayoutAdapter
+from . import ledger
+from api import events
 
 
 def notify_admin_new_withdrawal(withdrawal_id: int) -> None:
-    try:
-        layer = get_channel_layer()
-        if layer:
-            async_to_sync(layer.group_send)(
-                "admins",
-                {"type": "notify", "payload": {"event": "withdrawal.new", "id": withdrawal_id}},
-            )
-    except Exception:
-        pass
+    events.send({"admins": [{"event": "withdrawal.new", "id": withdrawal_id}]})
 
 
 @shared_task
@@ -54,13 +41,10 @@ def process_withdrawal_payout(withdrawal_id: int) -> None:
         return
 
     with transaction.atomic():
-        wallet = Wallet.objects.select_for_update().get(user=wd.user)
+        wallet = Wallet.objects.get(user=wd.user)
         amount = Decimal(wd.amount_etb).quantize(Decimal('0.01'))
-        wallet.balance_etb = (wallet.balance_etb - amount).quantize(Decimal('0.01'))
-        wallet.hold_etb = (wallet.hold_etb - amount).quantize(Decimal('0.01'))
-        if wallet.hold_etb < 0:
-            wallet.hold_etb = Decimal('0.00')
-        wallet.save(update_fields=["balance_etb", "hold_etb", "updated_at"]) 
+        # The held amount leaves the wallet
+        ledger.transfer('withdrawal_paid', (wd.user_id, ledger.Code.HOLD), (None, ledger.Code.PAYOUT), amount, reference=wd.id)
 
         wd.status = WithdrawalRequest.Status.PAID
         wd.provider_ref = provider_ref
@@ -73,19 +57,10 @@ def process_withdrawal_payout(withdrawal_id: int) -> None:
             metadata={"withdrawal_id": wd.id, "amount": str(amount), "provider_ref": provider_ref},
         )
 
-    try:
-        layer = get_channel_layer()
-        if layer:
-            async_to_sync(layer.group_send)(
-                f"user_{wd.user_id}",
-                {"type": "notify", "payload": {"event": "withdrawal.paid", "id": wd.id, "amount": str(wd.amount_etb)}}
-            )
-            async_to_sync(layer.group_send)(
-                f"user_{wd.user_id}",
-                {"type": "notify", "payload": {"event": "wallet.updated"}}
-            )
-    except Exception:
-        pass
+    events.send_to_users({wd.user_id: [
+        {"event": "withdrawal.paid", "id": wd.id, "amount": str(wd.amount_etb)},
+        events.wallet_updated(wallet),
+    ]})
 
 
 def _within_minutes(minutes: int):
@@ -3,6 +3,7 @@ from .views import (
     TopUpCreateView,
     ReceiptRetrieveView,
     GiftSendView,
+    GiftShowerView,
     WalletView,
     GiftListView,
     CoinPackageListView,
@@ -25,6 +26,7 @@ urlpatterns = [
     path('api/payments/webhooks/chapa/', ChapaWebhookView.as_view(), name='chapa-webhook'),
     path('api/payments/<int:pk>/receipt/', ReceiptRetrieveView.as_view(), name='receipt-detail'),
     path('api/gifts/send/', GiftSendView.as_view(), name='gift-send'),
+    path('api/gifts/shower/', GiftShowerView.as_view(), name='gift-shower'),
     path('api/wallet/', WalletView.as_view(), name='wallet'),
     path('api/wallet/withdraw/', WithdrawRequestView.as_view(), name='wallet-withdraw'),
     path('api/kyc/submit/', KYCSubmitView.as_view(), name='kyc-submit'),
@@ -8,7 +8,7 @@ from decimal import Decimal
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import F, Sum
+from django.db.models import Sum
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
@@ -16,17 +16,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.throttling import UserRateThrottle
-from asgiref.sync import async_to_sync
-
-# Optional channels import (fallback to no-op if not installed)
-try:  # pragma: no cover - optional dep
-    from channels.layers import get_channel_layer
-except Exception:  # pragma: no cover
-    def get_channel_layer():
-        return None
-
 from django.utils import timezone
 
+from api import events
+
 from .models import (
     CoinPackage,
     Payment,
@@ -43,6 +36,7 @@ from .serializers import (
     PaymentSerializer,
     ReceiptSerializer,
     GiftSendSerializer,
+    GiftShowerSerializer,
     WalletSerializer,
     GiftSerializer,
     CoinPackageListSerializer,
@@ -51,7 +45,8 @@ from .serializers import (
     KYCSubmitSerializer,
 )
 from .serializers import map_gift_animation
-from . import tasks
+from . import ledger, tasks
+from .idempotency import idempotent
 
 
 def _stub_checkout_url(payment: Payment) -> str:
@@ -78,9 +73,14 @@ class GiftsSendThrottle(UserRateThrottle):
     scope = 'gifts_send'
 
 
+class GiftsShowerThrottle(UserRateThrottle):
+    scope = 'gifts_shower'
+
+
 class TopUpCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         serializer = TopUpCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -106,9 +106,10 @@ class TopUpCreateView(APIView):
                     gw_fee_etb=Decimal('0.00'),
                 )
                 # Credit wallet immediately
-                wallet, _ = Wallet.objects.select_for_update().get_or_create(user=request.user)
-                wallet.coin_balance = wallet.coin_balance + package.coins
-                wallet.save(update_fields=["coin_balance", "updated_at"])
+                ledger.transfer(
+                    'topup', (None, ledger.Code.COIN_ISSUE), (request.user.id, ledger.Code.COINS),
+                    package.coins, reference=payment.id,
+                )
 
                 # Create a simple receipt
                 Receipt.objects.get_or_create(
@@ -195,29 +196,13 @@ class ChapaWebhookView(APIView):
             # Credit wallet coins
             wallet, _ = Wallet.objects.get_or_create(user=payment.user)
             before = wallet.coin_balance
-            wallet.coin_balance = before + payment.package.coins
-            wallet.save(update_fields=["coin_balance", "updated_at"])
+            ledger.transfer(
+                'payment', (None, ledger.Code.COIN_ISSUE), (payment.user_id, ledger.Code.COINS),
+                payment.package.coins, reference=payment.id,
+            )
 
             # After commit, notify user wallet updated (best-effort)
-            def _emit_wallet_update():
-                try:
-                    layer = get_channel_layer()
-                    if layer:
-                        async_to_sync(layer.group_send)(
-                            f"user_{payment.user_id}",
-                            {
-                                "type": "notify",
-                                "payload": {
-                                    "event": "wallet.updated",
-                                    "coin_balance": str(wallet.coin_balance),
-                                    "balance_etb": str(wallet.balance_etb),
-                                    "hold_etb": str(wallet.hold_etb),
-                                },
-                            },
-                        )
-                except Exception:
-                    pass
-            transaction.on_commit(_emit_wallet_update)
+            events.send_on_commit({payment.user_id: [events.wallet_updated(wallet)]})
 
             # Create receipt if not exists
             Receipt.objects.get_or_create(
@@ -261,6 +246,7 @@ class GiftSendView(APIView):
     permission_classes = [IsAuthenticated]
     throttle_classes = [GiftsSendThrottle]
 
+    @idempotent
     def post(self, request):
         serializer = GiftSendSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -277,41 +263,25 @@ class GiftSendView(APIView):
         commission_rate = Decimal(settings.PLATFORM_COMMISSION_RATE)
         vat_rate = Decimal(settings.VAT_RATE)
 
-        # Transactional operation with row-level locks to avoid double spend
+        # One transaction; the ledger debit is conditional, so concurrent sends cannot double spend
         try:
             with transaction.atomic():
-                # Lock wallets
-                sender_wallet = Wallet.objects.select_for_update().get_or_create(user=sender)[0]
-                recipient_wallet = Wallet.objects.select_for_update().get_or_create(user=recipient)[0]
+                sender_wallet = Wallet.objects.get_or_create(user=sender)[0]
+                recipient_wallet = Wallet.objects.get_or_create(user=recipient)[0]
 
                 if sender_wallet.is_banned:
                     return Response({"detail": "Sender is banned from sending gifts"}, status=status.HTTP_403_FORBIDDEN)
 
                 bypass = getattr(settings, 'PAYMENTS_BYPASS', False)
-                if not bypass:
-                    if sender_wallet.coin_balance < gift.coins:
-                        return Response({"detail": "Insufficient coin balance"}, status=status.HTTP_400_BAD_REQUEST)
-
-                    # Deduct coins atomically to avoid races
-                    updated = (
-                        Wallet.objects
-                        .filter(pk=sender_wallet.pk, coin_balance__gte=gift.coins)
-                        .update(coin_balance=F('coin_balance') - gift.coins)
-                    )
-                    if updated != 1:
-                        return Response({"detail": "Insufficient coin balance"}, status=status.HTTP_400_BAD_REQUEST)
-                    sender_wallet.refresh_from_db(fields=["coin_balance", "updated_at"])  # reflect new balance
-                # else: bypass coin balance check and deduction in test mode
+                if not bypass and sender_wallet.coin_balance < gift.coins:
+                    return Response({"detail": "Insufficient coin balance"}, status=status.HTTP_400_BAD_REQUEST)
 
                 # Compute split
                 commission_gross, vat_on_commission, commission_net, creator_payout = _split_gift_value_inclusive_commission(
                     gift.value_etb, commission_rate, vat_rate
                 )
 
-                # Credit recipient earnings
                 before = recipient_wallet.balance_etb
-                recipient_wallet.balance_etb = (recipient_wallet.balance_etb + creator_payout).quantize(Decimal('0.01'))
-                recipient_wallet.save(update_fields=["balance_etb", "updated_at"])
 
                 # Persist transaction
                 tx = GiftTransaction.objects.create(
@@ -327,6 +297,18 @@ class GiftSendView(APIView):
                     status=GiftTransaction.Status.SUCCESS,
                 )
 
+                # Debit sender coins (bypassed in test mode) and credit recipient earnings
+                legs = [
+                    (None, ledger.Code.GIFT_PAYOUT, -creator_payout),
+                    (recipient.id, ledger.Code.EARNINGS, creator_payout),
+                ]
+                if not bypass:
+                    legs += [
+                        (sender.id, ledger.Code.COINS, -gift.coins),
+                        (None, ledger.Code.COIN_SPEND, gift.coins),
+                    ]
+                ledger.post('gift', legs, reference=tx.id)
+
                 # Audit logs
                 AuditLog.objects.create(
                     user=sender,
@@ -336,7 +318,7 @@ class GiftSendView(APIView):
                         "gift": gift.name,
                         "coins": gift.coins,
                         "value_etb": str(gift.value_etb),
-                        "to": recipient.id,
+                        "to": str(recipient.id),
                     },
                 )
                 AuditLog.objects.create(
@@ -348,81 +330,48 @@ class GiftSendView(APIView):
                         "coins": gift.coins,
                         "value_etb": str(gift.value_etb),
                         "creator_payout": str(creator_payout),
-                        "from": sender.id,
+                        "from": str(sender.id),
                         "balance_before": str(before),
                         "balance_after": str(recipient_wallet.balance_etb),
                     },
                 )
 
+        except ledger.InsufficientFunds:
+            return Response({"detail": "Insufficient coin balance"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             # Rollback ensured by atomic; record failure log for observability
             AuditLog.objects.create(
                 user=sender,
                 event="GIFT_SEND_FAILED",
-                metadata={"error": str(e), "recipient_id": recipient_id, "gift_id": gift_id},
+                metadata={"error": str(e), "recipient_id": str(recipient_id), "gift_id": gift_id},
             )
             return Response({"detail": "Failed to send gift"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Emit realtime events after commit
-        def _emit():
-            try:
-                layer = get_channel_layer()
-                if not layer:
-                    return
-                icon, anim = map_gift_animation(gift.name)
-                payload_sender = {
-                    "event": "gift.sent",
-                    "tx_id": tx.id,
-                    "gift": gift.name,
-                    "coins": gift.coins,
-                    "valueETB": str(gift.value_etb),
-                    "gift_icon": icon,
-                    "gift_animation_type": anim,
-                }
-                payload_recipient = {
-                    "event": "gift.received",
-                    "tx_id": tx.id,
-                    "gift": gift.name,
-                    "coins": gift.coins,
-                    "valueETB": str(gift.value_etb),
-                    "creator_payout": str(creator_payout),
-                    "gift_icon": icon,
-                    "gift_animation_type": anim,
-                }
-                # Group naming scheme per user
-                async_to_sync(layer.group_send)(f"user_{sender.id}", {"type": "notify", "payload": payload_sender})
-                async_to_sync(layer.group_send)(f"user_{recipient.id}", {"type": "notify", "payload": payload_recipient})
-
-                # Also push wallet.updated snapshots
-                async_to_sync(layer.group_send)(
-                    f"user_{sender.id}",
-                    {
-                        "type": "notify",
-                        "payload": {
-                            "event": "wallet.updated",
-                            "coin_balance": str(sender_wallet.coin_balance),
-                            "balance_etb": str(sender_wallet.balance_etb),
-                            "hold_etb": str(sender_wallet.hold_etb),
-                        },
-                    },
-                )
-                async_to_sync(layer.group_send)(
-                    f"user_{recipient.id}",
-                    {
-                        "type": "notify",
-                        "payload": {
-                            "event": "wallet.updated",
-                            "coin_balance": str(recipient_wallet.coin_balance),
-                            "balance_etb": str(recipient_wallet.balance_etb),
-                            "hold_etb": str(recipient_wallet.hold_etb),
-                        },
-                    },
-                )
-            except Exception:
-                # Best-effort; do not fail main flow
-                pass
-
-        transaction.on_commit(_emit)
+        # Emit realtime events after commit: one envelope per user
+        icon, anim = map_gift_animation(gift.name)
+        payload_sender = {
+            "event": "gift.sent",
+            "tx_id": tx.id,
+            "gift": gift.name,
+            "coins": gift.coins,
+            "valueETB": str(gift.value_etb),
+            "gift_icon": icon,
+            "gift_animation_type": anim,
+        }
+        payload_recipient = {
+            "event": "gift.received",
+            "tx_id": tx.id,
+            "gift": gift.name,
+            "coins": gift.coins,
+            "valueETB": str(gift.value_etb),
+            "creator_payout": str(creator_payout),
+            "gift_icon": icon,
+            "gift_animation_type": anim,
+        }
+        events.send_on_commit({
+            sender.id: [payload_sender, events.wallet_updated(sender_wallet)],
+            recipient.id: [payload_recipient, events.wallet_updated(recipient_wallet)],
+        })
 
         # Build response payload with animation metadata
         icon, anim = map_gift_animation(gift.name)
@@ -437,6 +386,192 @@ class GiftSendView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+class GiftShowerView(APIView):
+    """Send many gifts, to one or several recipients, in one request.
+
+    The whole batch is one ledger posting: the sender is debited the total
+    once (conditionally, as in ``GiftSendView``) and each recipient is
+    credited the sum of their payouts. Gift and audit rows are bulk-created,
+    and each user gets one realtime envelope summarising their side.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [GiftsShowerThrottle]
+
+    @idempotent
+    def post(self, request):
+        serializer = GiftShowerSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+        sender = request.user
+
+        User = get_user_model()
+        recipients = User.objects.in_bulk({item['recipient_id'] for item in items})
+        gifts = Gift.objects.in_bulk({item['gift_id'] for item in items})
+        missing_recipients = {item['recipient_id'] for item in items} - set(recipients)
+        if missing_recipients:
+            return Response({"detail": "Recipient not found", "recipient_ids": sorted(str(pk) for pk in missing_recipients)}, status=status.HTTP_404_NOT_FOUND)
+        missing_gifts = {item['gift_id'] for item in items} - set(gifts)
+        if missing_gifts:
+            return Response({"gift_id": f"Invalid gift_id: {sorted(missing_gifts)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        commission_rate = Decimal(settings.PLATFORM_COMMISSION_RATE)
+        vat_rate = Decimal(settings.VAT_RATE)
+        splits = {
+            gift.id: _split_gift_value_inclusive_commission(gift.value_etb, commission_rate, vat_rate)
+            for gift in gifts.values()
+        }
+        total_coins = sum(gifts[item['gift_id']].coins * item['quantity'] for item in items)
+        total_gifts = sum(item['quantity'] for item in items)
+
+        try:
+            with transaction.atomic():
+                sender_wallet = Wallet.objects.get_or_create(user=sender)[0]
+                if sender_wallet.is_banned:
+                    return Response({"detail": "Sender is banned from sending gifts"}, status=status.HTTP_403_FORBIDDEN)
+
+                bypass = getattr(settings, 'PAYMENTS_BYPASS', False)
+                if not bypass and sender_wallet.coin_balance < total_coins:
+                    return Response({"detail": "Insufficient coin balance", "required": total_coins}, status=status.HTTP_400_BAD_REQUEST)
+
+                Wallet.objects.bulk_create([Wallet(user_id=pk) for pk in recipients], ignore_conflicts=True)
+
+                rows = []
+                for item in items:
+                    gift = gifts[item['gift_id']]
+                    commission_gross, vat_on_commission, commission_net, creator_payout = splits[gift.id]
+                    rows += [
+                        GiftTransaction(
+                            sender=sender,
+                            recipient_id=item['recipient_id'],
+                            gift=gift,
+                            coins_spent=gift.coins,
+                            value_etb=gift.value_etb,
+                            commission_gross=commission_gross,
+                            vat_on_commission=vat_on_commission,
+                            commission_net=commission_net,
+                            creator_payout=creator_payout,
+                            status=GiftTransaction.Status.SUCCESS,
+                        )
+                        for _ in range(item['quantity'])
+                    ]
+                txs = GiftTransaction.objects.bulk_create(rows)
+
+                # One posting for the batch; ledger.post sums the legs per account
+                legs = [(None, ledger.Code.GIFT_PAYOUT, -sum(tx.creator_payout for tx in txs))]
+                legs += [(tx.recipient_id, ledger.Code.EARNINGS, tx.creator_payout) for tx in txs]
+                if not bypass:
+                    legs += [
+                        (sender.id, ledger.Code.COINS, -total_coins),
+                        (None, ledger.Code.COIN_SPEND, total_coins),
+                    ]
+                posting = ledger.post('gift_shower', legs, metadata={"tx_ids": [tx.id for tx in txs]})
+
+                audit = []
+                for tx in txs:
+                    gift = gifts[tx.gift_id]
+                    audit.append(AuditLog(
+                        user=sender,
+                        event="GIFT_SENT",
+                        metadata={
+                            "tx_id": tx.id,
+                            "gift": gift.name,
+                            "coins": gift.coins,
+                            "value_etb": str(gift.value_etb),
+                            "to": str(tx.recipient_id),
+                            "ledger_tx": posting.id if posting else None,
+                        },
+                    ))
+                    audit.append(AuditLog(
+                        user_id=tx.recipient_id,
+                        event="GIFT_RECEIVED",
+                        metadata={
+                            "tx_id": tx.id,
+                            "gift": gift.name,
+                            "coins": gift.coins,
+                            "value_etb": str(gift.value_etb),
+                            "creator_payout": str(tx.creator_payout),
+                            "from": str(sender.id),
+                            "ledger_tx": posting.id if posting else None,
+                        },
+                    ))
+                AuditLog.objects.bulk_create(audit)
+
+        except ledger.InsufficientFunds:
+            return Response({"detail": "Insufficient coin balance", "required": total_coins}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            AuditLog.objects.create(
+                user=sender,
+                event="GIFT_SEND_FAILED",
+                metadata={"error": str(e), "shower": True, "gifts": total_gifts, "coins": total_coins},
+            )
+            return Response({"detail": "Failed to send gifts"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # Per recipient: {gift_id: count} and total payout, in request order
+        received = {}
+        for tx in txs:
+            entry = received.setdefault(tx.recipient_id, {"gifts": {}, "creator_payout": Decimal('0.00')})
+            entry["gifts"][tx.gift_id] = entry["gifts"].get(tx.gift_id, 0) + 1
+            entry["creator_payout"] += tx.creator_payout
+
+        def _summary(counts):
+            summary = []
+            for gift_id, count in counts.items():
+                gift = gifts[gift_id]
+                icon, anim = map_gift_animation(gift.name)
+                summary.append({
+                    "gift_id": gift.id,
+                    "gift": gift.name,
+                    "count": count,
+                    "coins": gift.coins,
+                    "valueETB": str(gift.value_etb),
+                    "gift_icon": icon,
+                    "gift_animation_type": anim,
+                })
+            return summary
+
+        sent = {}
+        for tx in txs:
+            sent[tx.gift_id] = sent.get(tx.gift_id, 0) + 1
+
+        # One envelope per user after commit: the shower summary and a wallet snapshot
+        wallets = events.wallets_updated([sender.id, *received])
+        batch = {
+            sender.id: [{
+                "event": "gift.shower.sent",
+                "tx_ids": [tx.id for tx in txs],
+                "coins": total_coins,
+                "recipients": [str(pk) for pk in received],
+                "gifts": _summary(sent),
+            }],
+        }
+        for recipient_id, entry in received.items():
+            batch.setdefault(recipient_id, []).append({
+                "event": "gift.shower.received",
+                "from": str(sender.id),
+                "tx_ids": [tx.id for tx in txs if tx.recipient_id == recipient_id],
+                "creator_payout": str(entry["creator_payout"]),
+                "gifts": _summary(entry["gifts"]),
+            })
+        for user_id, update in wallets.items():
+            batch[user_id].append(update)
+        events.send_on_commit(batch)
+
+        return Response({
+            "ok": True,
+            "gifts_sent": len(txs),
+            "coins_spent": total_coins,
+            "tx_ids": [tx.id for tx in txs],
+            "recipients": [
+                {
+                    "recipient_id": str(recipient_id),
+                    "gifts": _summary(entry["gifts"]),
+                    "creator_payout": str(entry["creator_payout"]),
+                }
+                for recipient_id, entry in received.items()
+            ],
+        }, status=status.HTTP_200_OK)
+
+
 class WalletView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -500,10 +635,9 @@ class DevGrantCoinsView(APIView):
             return Response({"detail": "Provide a positive 'coins' amount"}, status=status.HTTP_400_BAD_REQUEST)
 
         with transaction.atomic():
-            wallet, _ = Wallet.objects.select_for_update().get_or_create(user=request.user)
+            wallet, _ = Wallet.objects.get_or_create(user=request.user)
             before = wallet.coin_balance
-            wallet.coin_balance = before + coins
-            wallet.save(update_fields=["coin_balance", "updated_at"])
+            ledger.transfer('dev_grant', (None, ledger.Code.COIN_ISSUE), (request.user.id, ledger.Code.COINS), coins)
 
             AuditLog.objects.create(
                 user=request.user,
@@ -581,6 +715,7 @@ class ActivateSubscriptionView(APIView):
 class WithdrawRequestView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         serializer = WithdrawalCreateSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -603,9 +738,8 @@ class WithdrawRequestView(APIView):
         if amount < min_withdrawal:
             return Response({"detail": f"Minimum withdrawal is {min_withdrawal}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Enforce available funds: available = balance - hold
-        available = (wallet.balance_etb - wallet.hold_etb).quantize(Decimal('0.01'))
-        if amount > available:
+        # Enforce available funds: available = balance - hold (summed over the earnings shards)
+        if amount > wallet.available_etb:
             return Response({"detail": "Insufficient available balance"}, status=status.HTTP_400_BAD_REQUEST)
 
         # Limits
@@ -630,17 +764,6 @@ class WithdrawRequestView(APIView):
 
         try:
             with transaction.atomic():
-                # Re-fetch with lock
-                wallet = Wallet.objects.select_for_update().get(pk=wallet.pk)
-                # Recompute available in transaction
-                available = (wallet.balance_etb - wallet.hold_etb).quantize(Decimal('0.01'))
-                if amount > available:
-                    return Response({"detail": "Insufficient available balance"}, status=status.HTTP_400_BAD_REQUEST)
-
-                # Place amount on hold, do not decrease balance yet
-                wallet.hold_etb = (wallet.hold_etb + amount).quantize(Decimal('0.01'))
-                wallet.save(update_fields=["hold_etb", "updated_at"])
-
                 wd = WithdrawalRequest.objects.create(
                     user=user,
                     method=method,
@@ -649,12 +772,18 @@ class WithdrawRequestView(APIView):
                     status=WithdrawalRequest.Status.PENDING,
                 )
 
+                # Place amount on hold, do not decrease balance yet. The debit locks and folds
+                # the earnings shards first, so it checks the exact total and fails if no longer available
+                ledger.transfer('withdrawal_hold', (user.id, ledger.Code.EARNINGS), (user.id, ledger.Code.HOLD), amount, reference=wd.id)
+
                 AuditLog.objects.create(
                     user=user,
                     event="WITHDRAWAL_REQUESTED",
                     metadata={"withdrawal_id": wd.id, "amount": str(amount), "method": method, "destination": destination},
                 )
 
+        except ledger.InsufficientFunds:
+            return Response({"detail": "Insufficient available balance"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception:
             return Response({"detail": "Failed to create withdrawal request"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -718,12 +847,13 @@ class AdminWithdrawalRejectView(APIView):
 
         reason = request.data.get('reason') or 'Rejected by admin'
         with transaction.atomic():
-            wallet = Wallet.objects.select_for_update().get(user=wd.user)
+            wallet = Wallet.objects.get(user=wd.user)
             # Release hold back to available
-            wallet.hold_etb = (wallet.hold_etb - wd.amount_etb).quantize(Decimal('0.01'))
-            if wallet.hold_etb < 0:
-                wallet.hold_etb = Decimal('0.00')
-            wallet.save(update_fields=["hold_etb", "updated_at"])
+            held = ledger.balance(wd.user_id, ledger.Code.HOLD)
+            ledger.transfer(
+                'withdrawal_release', (wd.user_id, ledger.Code.HOLD), (wd.user_id, ledger.Code.EARNINGS),
+                min(wd.amount_etb, held), reference=wd.id,
+            )
 
             wd.status = WithdrawalRequest.Status.REJECTED
             wd.failure_reason = reason
@@ -735,34 +865,11 @@ class AdminWithdrawalRejectView(APIView):
                 metadata={"withdrawal_id": wd.id, "reason": reason},
             )
 
-        # Notify user (best-effort)
-        try:
-            layer = get_channel_layer()
-            if layer:
-                async_to_sync(layer.group_send)(f"user_{wd.user_id}", {"type": "notify", "payload": {"event": "withdrawal.rejected", "id": wd.id, "reason": reason}})
-        except Exception:
-            pass
-
-        # After commit, also notify wallet updated
-        def _emit_wallet_update():
-            try:
-                layer = get_channel_layer()
-                if layer:
-                    async_to_sync(layer.group_send)(
-                        f"user_{wd.user_id}",
-                        {
-                            "type": "notify",
-                            "payload": {
-                                "event": "wallet.updated",
-                                "coin_balance": str(wallet.coin_balance),
-                                "balance_etb": str(wallet.balance_etb),
-                                "hold_etb": str(wallet.hold_etb),
-                            },
-                        },
-                    )
-            except Exception:
-                pass
-        transaction.on_commit(_emit_wallet_update)
+        # Notify user (best-effort), rejection and wallet snapshot in one envelope
+        events.send_on_commit({wd.user_id: [
+            {"event": "withdrawal.rejected", "id": wd.id, "reason": reason},
+            events.wallet_updated(wallet),
+        ]})
 
         return Response({"ok": True})
 
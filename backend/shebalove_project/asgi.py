@@ -10,14 +10,17 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from api.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shebalove_project.settings')
+django_asgi_app = get_asgi_application()
+
+# Imported after Django is set up: these touch models
+from api.routing import websocket_urlpatterns
+from api.ws_auth import TokenAuthMiddlewareStack
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": TokenAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
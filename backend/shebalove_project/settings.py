@@ -153,12 +153,27 @@ else:
     }
 
 # Cache configuration
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# CACHE_URL (redis://host:6379/1) gives every worker one shared cache. Without it each
+# process keeps its own LocMemCache, which is only correct for a single process; the 'broker' and 'redis'
+# channel layers require it (see api/cache_scope.py)
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
     }
-}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+# Without CACHE_URL, cached socket tokens and chat memberships are trusted for at most this many seconds,
+# since a logout or unmatch in another process cannot drop this process's entry
+LOCAL_CACHE_AUTH_TTL = int(os.getenv('LOCAL_CACHE_AUTH_TTL', '5'))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -247,6 +262,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 # --- Google OAuth2 Client ID ---
@@ -280,6 +296,7 @@ REST_FRAMEWORK = {
         'user': os.getenv('DRF_USER_RATE', '100/min'),
         'anon': os.getenv('DRF_ANON_RATE', '50/min'),
         'gifts_send': os.getenv('GIFTS_SEND_RATE', '10/min'),
+        'gifts_shower': os.getenv('GIFTS_SHOWER_RATE', '10/min'),
     },
 }
 
@@ -290,6 +307,15 @@ PLATFORM_COMMISSION_RATE = os.getenv('PLATFORM_COMMISSION_RATE', '0.25')
 GATEWAY_RATE = os.getenv('GATEWAY_RATE', '0.03')
 GATEWAY_FIXED = os.getenv('GATEWAY_FIXED', '2.00')
 COINS_PER_ETB = int(os.getenv('COINS_PER_ETB', '1'))
+# Rows each creator earnings ledger account is spread over, so concurrent gifts
+# to one creator lock different rows (see payments/ledger.py)
+LEDGER_EARNINGS_SHARDS = int(os.getenv('LEDGER_EARNINGS_SHARDS', '8'))
+# Most gifts (summed over all recipients) one gift shower request may send
+GIFT_SHOWER_MAX_GIFTS = int(os.getenv('GIFT_SHOWER_MAX_GIFTS', '100'))
+# How long a payment/gift POST's Idempotency-Key and stored response are kept, and
+# after how many seconds an unfinished request's claim on its key is considered abandoned
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 3600)))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '60'))
 
 # --- Dev/Test toggles ---
 # When true, payment-requiring actions (topups, gift sending balance checks) will bypass
@@ -302,6 +328,57 @@ PAYMENTS_BYPASS = os.getenv('PAYMENTS_BYPASS', '0') in ('1', 'true', 'True')
 AUTO_IMPORT_TOKEN_GIFTS = os.getenv('AUTO_IMPORT_TOKEN_GIFTS', '0') in ('1', 'true', 'True')
 TOKEN_PLATFORM_DB_PATH = os.getenv('TOKEN_PLATFORM_DB_PATH', '')
 
+# --- Discovery ---
+# Max candidates kept in a user's precomputed discovery pool, and how long a pool
+# is served before it is rebuilt from scratch.
+DISCOVERY_POOL_SIZE = int(os.getenv('DISCOVERY_POOL_SIZE', '1000'))
+DISCOVERY_POOL_TTL_SECONDS = int(os.getenv('DISCOVERY_POOL_TTL_SECONDS', str(6 * 3600)))
+# Max non-boosted candidates sampled and scored per pool build (see api/scoring.py)
+DISCOVERY_SCORING_LIMIT = int(os.getenv('DISCOVERY_SCORING_LIMIT', '10000'))
+# Per-user Bloom filter of already swiped/liked profiles: initial size and target false-positive rate
+DISCOVERY_SEEN_FILTER_CAPACITY = int(os.getenv('DISCOVERY_SEEN_FILTER_CAPACITY', '2000'))
+DISCOVERY_SEEN_FILTER_ERROR_RATE = float(os.getenv('DISCOVERY_SEEN_FILTER_ERROR_RATE', '0.01'))
+# Profiles returned per /potential-matches/ request
+DISCOVERY_DECK_SIZE = int(os.getenv('DISCOVERY_DECK_SIZE', '50'))
+# Upper bound for the ?limit= of the cursor-paginated /discovery/deck/ endpoint
+DISCOVERY_DECK_MAX_PAGE_SIZE = int(os.getenv('DISCOVERY_DECK_MAX_PAGE_SIZE', '50'))
+# Geohash precision of the viewer's position baked into the pool's filter key;
+# moving out of that cell (~5km at precision 5) forces a rebuild for distance filters
+DISCOVERY_ORIGIN_GEOHASH_PRECISION = int(os.getenv('DISCOVERY_ORIGIN_GEOHASH_PRECISION', '5'))
+# Max swipes accepted by one /swipes/batch/ request
+SWIPE_BATCH_MAX_SIZE = int(os.getenv('SWIPE_BATCH_MAX_SIZE', '100'))
+# Max users returned by /interests/shared/
+SHARED_INTERESTS_PAGE_SIZE = int(os.getenv('SHARED_INTERESTS_PAGE_SIZE', '50'))
+# Max conversations returned by one /matches/inbox/ page
+INBOX_PAGE_SIZE = int(os.getenv('INBOX_PAGE_SIZE', '50'))
+# Chat history page size (default and max ?limit=) for the message list endpoints
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', '50'))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_MAX_PAGE_SIZE', '200'))
+# Conversations idle this long are moved to MessageArchive by archive_messages
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '365'))
+# Seconds without a heartbeat before a user counts as offline (see api/presence.py)
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', '90'))
+# Minimum seconds between last_seen_at writes while a user stays connected
+PRESENCE_PERSIST_INTERVAL = int(os.getenv('PRESENCE_PERSIST_INTERVAL', '60'))
+# Typing indicator changes a sender may broadcast per second
+CHAT_TYPING_EVENTS_PER_SECOND = float(os.getenv('CHAT_TYPING_EVENTS_PER_SECOND', '3'))
+# Seconds between repeated "still typing" broadcasts
+CHAT_TYPING_REFRESH_INTERVAL = float(os.getenv('CHAT_TYPING_REFRESH_INTERVAL', '3'))
+# Chat socket messages are written in batches of up to this many (see api/chat_writer.py)
+CHAT_WRITE_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BATCH_SIZE', '200'))
+# ... or whatever arrived within this many milliseconds
+CHAT_WRITE_FLUSH_MS = int(os.getenv('CHAT_WRITE_FLUSH_MS', '10'))
+# Node part of generated message ids (0-1023), one per process. Unset, each process leases one in
+# the shared cache (CACHE_URL) for CHAT_NODE_LEASE_TTL seconds at a time (see api/message_ids.py)
+CHAT_NODE_ID = int(os.environ['CHAT_NODE_ID']) if os.getenv('CHAT_NODE_ID') else None
+CHAT_NODE_LEASE_TTL = int(os.getenv('CHAT_NODE_LEASE_TTL', '300'))
+# Seconds a conversation's participant set is cached for chat authorization (see api/membership.py)
+CHAT_MEMBERSHIP_CACHE_TTL = int(os.getenv('CHAT_MEMBERSHIP_CACHE_TTL', '300'))
+# Undelivered notifications kept per user for replay on reconnect (see api/notifications.py)
+NOTIFICATION_OUTBOX_SIZE = int(os.getenv('NOTIFICATION_OUTBOX_SIZE', '200'))
+# Publishes between trims of the older events, so up to this many more may be kept meanwhile
+NOTIFICATION_OUTBOX_TRIM_EVERY = int(os.getenv('NOTIFICATION_OUTBOX_TRIM_EVERY', '50'))
+
 # Chapa Payment Gateway Configuration
 CHAPA_SECRET_KEY = os.getenv('CHAPA_SECRET_KEY', '')
 CHAPA_PUBLIC_KEY = os.getenv('CHAPA_PUBLIC_KEY', '')
@@ -310,6 +387,27 @@ CHAPA_ENCRYPTION_KEY = os.getenv('CHAPA_ENCRYPTION_KEY', '')
 # Legacy provider secrets (for backward compatibility)
 CHAPA_SECRET = os.getenv('CHAPA_SECRET', CHAPA_SECRET_KEY)
 CHAPA_PUBLIC = os.getenv('CHAPA_PUBLIC', CHAPA_PUBLIC_KEY)
+# Chapa API client (see api/chapa.py); point CHAPA_BASE_URL at run_fake_chapa for local testing
+CHAPA_BASE_URL = os.getenv('CHAPA_BASE_URL', 'https://api.chapa.co/v1')
+# Seconds to wait for a connection / for Chapa's response
+CHAPA_CONNECT_TIMEOUT = float(os.getenv('CHAPA_CONNECT_TIMEOUT', '5'))
+CHAPA_READ_TIMEOUT = float(os.getenv('CHAPA_READ_TIMEOUT', '20'))
+# Extra attempts after a failed call (POSTs only when the request never reached Chapa)
+CHAPA_MAX_RETRIES = int(os.getenv('CHAPA_MAX_RETRIES', '2'))
+# Seconds a Chapa call made while a client waits (views) may take in total, retries included;
+# webhook verification runs in the background with the full retry budget
+CHAPA_REQUEST_DEADLINE = float(os.getenv('CHAPA_REQUEST_DEADLINE', '8'))
+# Keep-alive connections per process
+CHAPA_POOL_SIZE = int(os.getenv('CHAPA_POOL_SIZE', '10'))
+# Consecutive failures that open the circuit, and seconds before it lets a call through again
+CHAPA_BREAKER_FAILURES = int(os.getenv('CHAPA_BREAKER_FAILURES', '5'))
+CHAPA_BREAKER_RESET = float(os.getenv('CHAPA_BREAKER_RESET', '30'))
+# Seconds the bank list is cached
+CHAPA_BANKS_CACHE_TTL = int(os.getenv('CHAPA_BANKS_CACHE_TTL', '3600'))
+# Webhook-reported payments still unverified after this many seconds are retried by verify_pending_payments
+CHAPA_VERIFY_SWEEP_AFTER = int(os.getenv('CHAPA_VERIFY_SWEEP_AFTER', '300'))
+# Sweeps without a verdict from Chapa before a payment is dropped (and logged) for manual follow-up
+CHAPA_VERIFY_MAX_ATTEMPTS = int(os.getenv('CHAPA_VERIFY_MAX_ATTEMPTS', '20'))
 TELEBIRR_API_KEY = os.getenv('TELEBIRR_API_KEY', '')
 
 # Frontend URL for building checkout links
@@ -335,10 +433,41 @@ RISK_WITHDRAWALS_SAME_DEST_THRESHOLD = int(os.getenv('RISK_WITHDRAWALS_SAME_DEST
 
 # Channels Configuration
 ASGI_APPLICATION = 'shebalove_project.asgi.application'
+# Seconds a WebSocket token -> user lookup is cached (see api/ws_auth.py)
+WS_TOKEN_CACHE_TTL = int(os.getenv('WS_TOKEN_CACHE_TTL', '60'))
 
 # Channel Layers (Redis for production, in-memory for development)
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# CHANNEL_LAYER_BACKEND: 'memory' (single process only), 'redis' (channels_redis,
+# sharded over every host in CHANNEL_LAYER_HOSTS) or 'broker' (pure-Python
+# stand-in for dev/CI, see api/channel_layers.py and run_channel_broker).
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'memory')
+# Comma-separated: redis://host:6379/0 URLs for 'redis', host:port for 'broker'
+CHANNEL_LAYER_HOSTS = [h.strip() for h in os.getenv('CHANNEL_LAYER_HOSTS', '').split(',') if h.strip()]
+CHANNEL_LAYER_CAPACITY = int(os.getenv('CHANNEL_LAYER_CAPACITY', '100'))
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_LAYER_HOSTS or ['redis://127.0.0.1:6379/0'],
+                'capacity': CHANNEL_LAYER_CAPACITY,
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'broker':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'api.channel_layers.BrokerChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_LAYER_HOSTS or ['127.0.0.1:6390'],
+                'capacity': CHANNEL_LAYER_CAPACITY,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': CHANNEL_LAYER_CAPACITY},
+        },
+    }
@@ -0,0 +1,12 @@
+"""
+Settings for ``manage.py test`` (manage.py selects them for that command).
+
+SQLite's default test database lives in memory, where concurrent writers
+fail outright, so it is a file here instead (SendGiftConcurrencyTests sends
+from many threads at once).
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}